@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# loading AGAT's stats YAML. AGAT writes a section for every feature type
+# (transcript, mrna, ncrna, ...) with and without isoforms, but the report
+# only reads one or two of them, so most of the document is thrown away
+# after it has been built.
+#
+# - load_yaml builds the whole document with the libyaml C parser when
+#   pyyaml has it, and the pure-python parser otherwise.
+# - load_sections reads the parser's events and only builds the values at
+#   the given paths (e.g. transcript/without_isoforms/value). everything
+#   else is skipped as a run of events without resolving or constructing
+#   any of its values, which is where most of the loading time goes. the
+#   result has the same nesting as the full document, minus the skipped
+#   parts, so it can be mapped the same way.
+#
+# a path is a tuple of steps, and each step is a tuple of alternative keys,
+# as in the compiled field mappings (mappings.py).
+
+import yaml
+from yaml.events import (
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+start_events = (MappingStartEvent, SequenceStartEvent)
+end_events = (MappingEndEvent, SequenceEndEvent)
+
+
+def get_loader_class():
+    return getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def load_yaml(f):
+    return yaml.load(f, Loader=get_loader_class())
+
+
+def skip_node(loader, depth=0):
+    # depth 1 skips the rest of a node whose start event was already read
+    while True:
+        event = loader.get_event()
+        if isinstance(event, start_events):
+            depth += 1
+        elif isinstance(event, end_events):
+            depth -= 1
+        if depth == 0:
+            return
+
+
+def get_tag(loader, event, node_class, value):
+    if event.tag is None or event.tag == "!":
+        return loader.resolve(node_class, value, event.implicit)
+    return event.tag
+
+
+def compose_node(loader):
+    # the same nodes as yaml's composer, built from the loader's events
+    event = loader.get_event()
+    if isinstance(event, ScalarEvent):
+        return ScalarNode(
+            get_tag(loader, event, ScalarNode, event.value),
+            event.value,
+            event.start_mark,
+            event.end_mark,
+            style=event.style,
+        )
+    if isinstance(event, SequenceStartEvent):
+        tag = get_tag(loader, event, SequenceNode, None)
+        items = []
+        while not loader.check_event(SequenceEndEvent):
+            items.append(compose_node(loader))
+        end_event = loader.get_event()
+        return SequenceNode(
+            tag,
+            items,
+            event.start_mark,
+            end_event.end_mark,
+            flow_style=event.flow_style,
+        )
+    if isinstance(event, MappingStartEvent):
+        tag = get_tag(loader, event, MappingNode, None)
+        pairs = []
+        while not loader.check_event(MappingEndEvent):
+            pairs.append((compose_node(loader), compose_node(loader)))
+        end_event = loader.get_event()
+        return MappingNode(
+            tag,
+            pairs,
+            event.start_mark,
+            end_event.end_mark,
+            flow_style=event.flow_style,
+        )
+    # AGAT doesn't write anchors, so there is nothing for an alias to refer to
+    raise ValueError(f"Unexpected YAML {event} at {event.start_mark}")
+
+
+def select_mapping(loader, paths, depth):
+    # reads a mapping, from after its start event, keeping the entries on
+    # the paths
+    selected = {}
+    while not loader.check_event(MappingEndEvent):
+        key_event = loader.get_event()
+        if not isinstance(key_event, ScalarEvent):
+            # a complex key, which AGAT doesn't write. skip it and its value
+            if isinstance(key_event, start_events):
+                skip_node(loader, depth=1)
+            skip_node(loader)
+            continue
+        key = key_event.value
+        matching = [x for x in paths if key in x[depth]]
+        if not matching:
+            skip_node(loader)
+        elif any(len(x) == depth + 1 for x in matching):
+            selected[key] = loader.construct_document(compose_node(loader))
+        elif loader.check_event(MappingStartEvent):
+            loader.get_event()
+            selected[key] = select_mapping(loader, matching, depth + 1)
+        else:
+            skip_node(loader)
+    loader.get_event()
+    return selected
+
+
+def load_sections(f, paths):
+    loader = get_loader_class()(f)
+    try:
+        # stream and document start
+        loader.get_event()
+        loader.get_event()
+        if not loader.check_event(MappingStartEvent):
+            return {}
+        loader.get_event()
+        return select_mapping(loader, paths, 0)
+    finally:
+        loader.dispose()
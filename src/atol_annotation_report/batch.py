@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+
+# this runs the reporter over many annotations in a single process pool.
+# it takes a manifest (TSV or JSON) with one row per annotation. the columns
+# match the input and output arguments of atol-annotation-report.
+# each worker imports typst once and keeps the template loaded, so the
+# interpreter startup and template compile are paid per worker, not per report.
+# a failed annotation is recorded in the status file and the batch keeps going.
+# if a worker process dies (e.g. killed for running out of memory), the
+# reports that were still queued or running fail with it and are recorded as
+# failed, and the status file is still written for every row.
+
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+from atol_annotation_report.cache import ResultCache, default_cache_dir, default_max_mb
+from atol_annotation_report.inputs import (
+    add_mirror,
+    get_uncompressed_name,
+    input_path,
+    open_input,
+    parse_mirror,
+)
+from atol_annotation_report.profiling import (
+    StageProfiler,
+    log_formats,
+    setup_logging,
+    summarise_profiles,
+)
+from atol_annotation_report.python_reporter import (
+    generate_report,
+    default_formats,
+    output_formats,
+    parse_formats,
+)
+from atol_annotation_report.render import ReportRenderer
+
+logger = logging.getLogger(__name__)
+
+input_columns = [
+    "metadata_file",
+    "agat_file",
+    "annotation_file",
+    "busco_file",
+    "busco_full_table",
+    "omark_file",
+    "omark_detail",
+    "annooddities_file",
+    "genome_file",
+]
+
+output_columns = {
+    "output_file": "test_out.pdf",
+    "json_atol": "json_atol.json",
+    "json_full": "json_full.json",
+    "html": "summary.html",
+    "preview_png": "preview.png",
+    "preview_svg": "preview.svg",
+}
+
+status_columns = ["id", "status", "seconds", "output_file", "json_full", "error"]
+
+# these are set up once in each worker process by init_worker
+worker_renderer = None
+worker_formats = None
+worker_cache = None
+
+
+def parse_arguments():
+
+    argument_parser = argparse.ArgumentParser(
+        description="Generate JSON and PDF annotation reports for every row in a manifest",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    argument_parser.add_argument(
+        "manifest",
+        type=input_path,
+        help=(
+            "a TSV or JSON manifest (or - for stdin) with one annotation per row. Columns: id, "
+            + ", ".join(input_columns + list(output_columns))
+        ),
+    )
+    argument_parser.add_argument(
+        "-t",
+        "--threads",
+        default=os.cpu_count(),
+        type=int,
+        help="Number of worker processes",
+    )
+    argument_parser.add_argument(
+        "-s",
+        "--status_file",
+        default=Path("batch_status.tsv"),
+        type=Path,
+        help="Path to the per-annotation status summary (TSV)",
+    )
+    argument_parser.add_argument(
+        "--formats",
+        default=list(default_formats),
+        type=parse_formats,
+        help="Comma-separated outputs to write for each row, from "
+        + ",".join(output_formats),
+    )
+    argument_parser.add_argument(
+        "--no_pdf",
+        action="store_true",
+        help="Don't render PDF reports (same as leaving pdf out of --formats). typst is not loaded",
+    )
+    argument_parser.add_argument(
+        "--package_cache",
+        type=Path,
+        help="A local directory of typst packages (laid out as <namespace>/<name>/<version>) to resolve template imports from instead of downloading them",
+    )
+
+    argument_parser.add_argument(
+        "--input_mirror",
+        action="append",
+        default=[],
+        type=parse_mirror,
+        help="Read input URLs starting with URL_PREFIX from a local directory, as URL_PREFIX=DIRECTORY (e.g. s3://bucket/runs/=/data/runs/). Can be repeated. Other URLs need fsspec",
+    )
+
+    argument_parser.add_argument(
+        "--cache_dir",
+        type=Path,
+        help="Directory for cached results, shared by all workers (default: $XDG_CACHE_HOME/atol-annotation-report or ~/.cache/atol-annotation-report)",
+    )
+    argument_parser.add_argument(
+        "--cache_max_mb",
+        default=default_max_mb,
+        type=int,
+        help="Size cap for the cache directory in MB. The least recently used results are deleted first",
+    )
+    argument_parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Don't read or write cached results",
+    )
+
+    argument_parser.add_argument(
+        "--log_format",
+        default="text",
+        choices=log_formats,
+        help="Write progress messages as plain text or as one JSON object per line",
+    )
+    argument_parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Also log the timing of each stage",
+    )
+    argument_parser.add_argument(
+        "--profile",
+        type=Path,
+        help="Write the stage timings of every report, and their percentiles over the batch, to this JSON file",
+    )
+
+    args = argument_parser.parse_args()
+    if args.no_pdf and "pdf" in args.formats:
+        args.formats.remove("pdf")
+
+    return args
+
+
+def read_manifest(path_to_manifest):
+    # JSON manifests are a list of objects, anything else is read as TSV
+    with open_input(path_to_manifest) as f:
+        if get_uncompressed_name(path_to_manifest).endswith(".json"):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f, delimiter="\t"))
+
+    manifest = []
+    for i, row in enumerate(rows):
+        item = {"id": row.get("id") or str(i + 1)}
+        for column in input_columns:
+            value = row.get(column)
+            if value == "-":
+                raise ValueError(
+                    f"{column} of row {item['id']} is -, but workers can't read stdin"
+                )
+            item[column] = input_path(value) if value else None
+        for column, default in output_columns.items():
+            value = row.get(column)
+            if not value:
+                # keep outputs from different rows apart
+                value = f"{item['id']}_{default}"
+            item[column] = Path(value)
+        manifest.append(item)
+
+    return manifest
+
+
+def init_worker(
+    package_path,
+    formats,
+    cache_dir=None,
+    cache_max_mb=default_max_mb,
+    log_format="text",
+    verbose=False,
+    input_mirrors=(),
+):
+    global worker_renderer, worker_formats, worker_cache
+    setup_logging(log_format, verbose=verbose)
+    for prefix, directory in input_mirrors:
+        add_mirror(prefix, directory)
+    worker_formats = formats
+    if cache_dir is not None:
+        worker_cache = ResultCache(cache_dir, max_mb=cache_max_mb)
+    if {"pdf", "png", "svg"} & set(formats):
+        worker_renderer = ReportRenderer(package_path=package_path)
+
+
+def run_item(item):
+    start = time.perf_counter()
+    profiler = StageProfiler()
+    status = {
+        "id": item["id"],
+        "output_file": str(item["output_file"]),
+        "json_full": str(item["json_full"]),
+    }
+    try:
+        # the batch is already parallel, so each report runs single-threaded
+        args = Namespace(
+            threads=1,
+            formats=worker_formats,
+            **{k: v for k, v in item.items() if k != "id"},
+        )
+        generate_report(
+            args, renderer=worker_renderer, cache=worker_cache, profiler=profiler
+        )
+        status["status"] = "success"
+        status["error"] = ""
+    except Exception as e:
+        logger.exception(f"Report {item['id']} failed")
+        status["status"] = "failed"
+        status["error"] = f"{type(e).__name__}: {e}"
+    status["seconds"] = round(time.perf_counter() - start, 3)
+    status["stages"] = profiler.records
+    status["peak_rss_scope"] = profiler.peak_rss_scope
+    return status
+
+
+def run_batch(
+    manifest,
+    threads,
+    package_path=None,
+    formats=default_formats,
+    cache_dir=None,
+    cache_max_mb=default_max_mb,
+    log_format="text",
+    verbose=False,
+    input_mirrors=(),
+):
+    # statuses are kept in manifest order, not completion order
+    statuses = [None] * len(manifest)
+    with ProcessPoolExecutor(
+        max_workers=threads,
+        initializer=init_worker,
+        initargs=(
+            package_path,
+            formats,
+            cache_dir,
+            cache_max_mb,
+            log_format,
+            verbose,
+            input_mirrors,
+        ),
+    ) as pool:
+        futures = {pool.submit(run_item, item): i for i, item in enumerate(manifest)}
+        for future in as_completed(futures):
+            item = manifest[futures[future]]
+            try:
+                statuses[futures[future]] = future.result()
+            except Exception as e:
+                # e.g. a worker process was killed, which breaks the pool
+                logger.error(f"Report {item['id']} failed: {type(e).__name__}: {e}")
+                statuses[futures[future]] = {
+                    "id": item["id"],
+                    "output_file": str(item["output_file"]),
+                    "json_full": str(item["json_full"]),
+                    "status": "failed",
+                    "error": f"{type(e).__name__}: {e}",
+                    "seconds": None,
+                    "stages": [],
+                    "peak_rss_scope": "report",
+                }
+
+    return statuses
+
+
+def write_status(statuses, path_to_status):
+    with open(path_to_status, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(
+            f, fieldnames=status_columns, delimiter="\t", extrasaction="ignore"
+        )
+        writer.writeheader()
+        writer.writerows(statuses)
+
+
+def write_profile(statuses, path_to_profile):
+    # with "process", a worker's later reports include the peaks of its
+    # earlier ones
+    if all(x["peak_rss_scope"] == "report" for x in statuses):
+        peak_rss_scope = "report"
+    else:
+        peak_rss_scope = "process"
+    profile = {
+        "peak_rss_scope": peak_rss_scope,
+        "reports": [{"id": x["id"], "stages": x["stages"]} for x in statuses],
+        "summary": summarise_profiles([x["stages"] for x in statuses]),
+    }
+    with open(path_to_profile, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+
+
+def main():
+    args = parse_arguments()
+    setup_logging(args.log_format, verbose=args.verbose)
+
+    logger.info("Reading manifest")
+    for prefix, directory in args.input_mirror:
+        add_mirror(prefix, directory)
+    manifest = read_manifest(args.manifest)
+
+    logger.info(f"Generating {len(manifest)} reports with {args.threads} workers")
+    if args.no_cache:
+        cache_dir = None
+    else:
+        cache_dir = args.cache_dir or default_cache_dir()
+    statuses = run_batch(
+        manifest,
+        args.threads,
+        package_path=args.package_cache,
+        formats=args.formats,
+        cache_dir=cache_dir,
+        cache_max_mb=args.cache_max_mb,
+        log_format=args.log_format,
+        verbose=args.verbose,
+        input_mirrors=args.input_mirror,
+    )
+    write_status(statuses, args.status_file)
+    if args.profile is not None:
+        write_profile(statuses, args.profile)
+
+    n_failed = sum(1 for x in statuses if x["status"] != "success")
+    logger.info(
+        f"Batch completed: {len(statuses) - n_failed} succeeded, {n_failed} failed. "
+        f"Status written to {args.status_file}"
+    )
+
+    if n_failed > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+
+# benchmarks for the reporting tool.
+# render: per-report latency of the cold typst.compile path against a warm
+#   ReportRenderer (and optionally a running render daemon), using the
+#   bundled test data. the warm renderer also renders the PNG and SVG
+#   previews, so every render path is exercised with the installed typst
+#   (run it after installing typst==render.min_typst_version to check the
+#   minimum pinned version).
+# startup: import time of the reporter (from -X importtime) and wall time of
+#   a JSON-only run, each in a fresh interpreter. fails if the import is
+#   slower than --max_import_ms or loads typst, yaml or multiprocessing,
+#   which should only be imported when their stage runs.
+# suite: reading, mapping, JSON output and rendering timed separately on
+#   large synthetic inputs (see synthetic.py) for each tool.
+# agat: loading a large multi-section AGAT YAML with pyyaml's pure-python
+#   loader, the libyaml loader, and the section loader the reporter uses
+#   (see agat_yaml.py). fails if the sections map differently from the full
+#   document.
+#
+# any summary written with --output_file can be passed back as --baseline.
+# a path whose median time is more than --tolerance slower than the baseline
+# is reported as a failure, so regressions can be caught locally.
+
+from importlib.resources import files
+from pathlib import Path
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from atol_annotation_report.python_reporter import (
+    collect_stats,
+    get_field_mapper,
+    map_agat_stats,
+    map_oddities,
+    parse_metadata,
+    read_agat,
+    read_annooddities,
+    read_json,
+    render_report,
+)
+
+non_timing_keys = ["environment", "failures"]
+
+
+def get_test_data_path(filename):
+    return Path(files("atol_annotation_report"), "resources", "test-data", filename)
+
+
+def summarise_timings(timings):
+    return {
+        "n": len(timings),
+        "mean_s": statistics.mean(timings),
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "max_s": max(timings),
+    }
+
+
+def time_renders(renderer, combined_stats, outdir, n_reports, label):
+    timings = []
+    for i in range(n_reports):
+        output_file = Path(outdir, f"{label}_{i}.pdf")
+        start = time.perf_counter()
+        render_report(combined_stats, output_file, renderer=renderer)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_render(args):
+    from atol_annotation_report.render import (
+        DaemonRenderer,
+        ReportRenderer,
+        check_typst_version,
+    )
+
+    _, combined_stats = collect_stats(
+        metadata_file=get_test_data_path("test-metadata.json"),
+        agat_file=get_test_data_path("agat.stats.yaml"),
+        busco_file=get_test_data_path("short_summary.specific.busco.json"),
+        omark_file=get_test_data_path("omark_summary.json"),
+    )
+
+    results = {}
+    with tempfile.TemporaryDirectory() as outdir:
+        results["cold"] = time_renders(
+            None, combined_stats, outdir, args.n_reports, "cold"
+        )
+
+        # the one-off cost of loading the template is reported separately
+        start = time.perf_counter()
+        renderer = ReportRenderer()
+        results["warm_setup"] = [time.perf_counter() - start]
+        results["warm"] = time_renders(
+            renderer, combined_stats, outdir, args.n_reports, "warm"
+        )
+        for preview_format in ["png", "svg"]:
+            _, results[f"warm_{preview_format}"] = time_repeats(
+                lambda: renderer.render_first_page(
+                    combined_stats, format=preview_format
+                ),
+                args.n_reports,
+            )
+
+        if args.socket is not None:
+            results["daemon"] = time_renders(
+                DaemonRenderer(args.socket),
+                combined_stats,
+                outdir,
+                args.n_reports,
+                "daemon",
+            )
+
+    summary = {label: summarise_timings(timings) for label, timings in results.items()}
+    summary["environment"] = {
+        "typst": check_typst_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    return summary
+
+
+lazy_modules = ["typst", "yaml", "multiprocessing", "concurrent.futures"]
+
+
+def read_importtime(stderr):
+    # returns {module: cumulative import time in seconds}
+    import_times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        import_times[module.strip()] = int(cumulative) / 1e6
+    return import_times
+
+
+def benchmark_startup(args):
+    import_timings = []
+    run_timings = []
+    loaded_lazy_modules = set()
+    for _ in range(args.n_runs):
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                "import atol_annotation_report.python_reporter",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        import_times = read_importtime(result.stderr)
+        import_timings.append(import_times["atol_annotation_report.python_reporter"])
+        loaded_lazy_modules.update(m for m in lazy_modules if m in import_times)
+
+        with tempfile.TemporaryDirectory() as outdir:
+            start = time.perf_counter()
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "atol_annotation_report.python_reporter",
+                    "--formats",
+                    "json_atol,json_full",
+                    "--no_cache",
+                    "--busco_file",
+                    get_test_data_path("short_summary.specific.busco.json"),
+                    "--omark_file",
+                    get_test_data_path("omark_summary.json"),
+                ],
+                cwd=outdir,
+                capture_output=True,
+                check=True,
+            )
+            run_timings.append(time.perf_counter() - start)
+
+    summary = {
+        "import": summarise_timings(import_timings),
+        "json_only_run": summarise_timings(run_timings),
+    }
+
+    failures = [
+        f"{module} is imported at startup" for module in sorted(loaded_lazy_modules)
+    ]
+    import_ms = summary["import"]["median_s"] * 1000
+    if import_ms > args.max_import_ms:
+        failures.append(
+            f"median import time {import_ms:.1f} ms is over {args.max_import_ms} ms"
+        )
+    summary["failures"] = failures
+
+    return summary
+
+
+def time_repeats(function, n_repeats):
+    # returns the result of the last call and the time taken by each call
+    timings = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+def write_json(document, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f)
+
+
+def benchmark_suite(args):
+    from atol_annotation_report.busco import summarise_full_table
+    from atol_annotation_report.synthetic import write_inputs
+
+    # tool: (input argument, read the file, map the document)
+    agat_sections = get_field_mapper("agat").get_section_paths()
+    tool_stages = {
+        "agat": (
+            "agat_file",
+            lambda x: read_agat(x, sections=agat_sections),
+            map_agat_stats,
+        ),
+        "busco": ("busco_file", read_json, get_field_mapper("busco").map),
+        "omark": ("omark_file", read_json, get_field_mapper("omark").map),
+        "annooddities": (
+            "annooddities_file",
+            read_annooddities,
+            lambda x: (map_oddities(x), {}),
+        ),
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as outdir:
+        input_dir = args.input_dir or Path(outdir, "inputs")
+        inputs = write_inputs(input_dir, args.scale, seed=args.seed)
+
+        combined_stats = parse_metadata(get_test_data_path("test-metadata.json"))
+        stats_for_gnl = {}
+        for tool, (input_argument, read, map_document) in tool_stages.items():
+            path = inputs[input_argument]
+            document, results[f"{tool}_read"] = time_repeats(
+                lambda: read(path), args.n_repeats
+            )
+            (all_stats, key_stats), results[f"{tool}_map"] = time_repeats(
+                lambda: map_document(document), args.n_repeats
+            )
+            combined_stats[tool] = all_stats
+            stats_for_gnl.update(key_stats)
+
+        # the full table is streamed, so reading and summarising are one stage
+        full_table_stats, results["busco_full_table"] = time_repeats(
+            lambda: summarise_full_table(inputs["busco_full_table"]), args.n_repeats
+        )
+        combined_stats["busco"] |= full_table_stats
+
+        _, results["json_atol"] = time_repeats(
+            lambda: write_json(
+                {"annotation": stats_for_gnl}, Path(outdir, "atol.json")
+            ),
+            args.n_repeats,
+        )
+        _, results["json_full"] = time_repeats(
+            lambda: write_json(combined_stats, Path(outdir, "full.json")),
+            args.n_repeats,
+        )
+
+        if not args.no_render:
+            from atol_annotation_report.render import ReportRenderer
+
+            renderer, results["render_setup"] = time_repeats(ReportRenderer, 1)
+            _, results["render"] = time_repeats(
+                lambda: renderer.render(combined_stats, Path(outdir, "report.pdf")),
+                args.n_repeats,
+            )
+
+        input_bytes = {k: Path(v).stat().st_size for k, v in inputs.items()}
+
+    summary = {label: summarise_timings(timings) for label, timings in results.items()}
+    summary["environment"] = {
+        "scale": args.scale,
+        "seed": args.seed,
+        "n_repeats": args.n_repeats,
+        "input_bytes": input_bytes,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    return summary
+
+
+def benchmark_agat(args):
+    import yaml
+
+    from atol_annotation_report.synthetic import write_agat_yaml
+
+    def read_safe_loader(path):
+        with open(path, "rt") as f:
+            return yaml.load(f, Loader=yaml.SafeLoader)
+
+    agat_sections = get_field_mapper("agat").get_section_paths()
+    loaders = {
+        "safe_loader": read_safe_loader,
+        "c_loader": read_agat,
+        "sections": lambda x: read_agat(x, sections=agat_sections),
+    }
+
+    results = {}
+    mapped = {}
+    with tempfile.TemporaryDirectory() as outdir:
+        path = Path(outdir, "agat.stats.yaml")
+        write_agat_yaml(
+            path, args.n_feature_types, args.n_subfeature_types, seed=args.seed
+        )
+        for label, read in loaders.items():
+            document, results[label] = time_repeats(lambda: read(path), args.n_repeats)
+            mapped[label] = map_agat_stats(document)
+        input_bytes = path.stat().st_size
+
+    summary = {label: summarise_timings(timings) for label, timings in results.items()}
+    summary["environment"] = {
+        "n_feature_types": args.n_feature_types,
+        "n_subfeature_types": args.n_subfeature_types,
+        "seed": args.seed,
+        "n_repeats": args.n_repeats,
+        "input_bytes": input_bytes,
+        "libyaml": yaml.__with_libyaml__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    summary["failures"] = [
+        f"{label} maps differently from safe_loader"
+        for label in loaders
+        if mapped[label] != mapped["safe_loader"]
+    ]
+    return summary
+
+
+def compare_to_baseline(summary, baseline, tolerance, min_regression_ms):
+    failures = []
+    environment = summary.get("environment", {})
+    baseline_environment = baseline.get("environment", {})
+    for key in ["scale", "seed", "n_feature_types", "n_subfeature_types"]:
+        if environment.get(key) != baseline_environment.get(key):
+            failures.append(
+                f"baseline {key} {baseline_environment.get(key)} does not match "
+                f"{environment.get(key)}"
+            )
+    for label, stats in summary.items():
+        if label in non_timing_keys or label not in baseline:
+            continue
+        median_ms = stats["median_s"] * 1000
+        baseline_ms = baseline[label]["median_s"] * 1000
+        if (
+            median_ms > baseline_ms * (1 + tolerance)
+            and median_ms - baseline_ms > min_regression_ms
+        ):
+            failures.append(
+                f"{label} median {median_ms:.1f} ms is slower than the baseline "
+                f"{baseline_ms:.1f} ms"
+            )
+    return failures
+
+
+def print_summary(summary):
+    print(f"{'path':<20}{'n':>6}{'mean (ms)':>12}{'median (ms)':>14}")
+    for label, stats in summary.items():
+        if label in non_timing_keys:
+            continue
+        print(
+            f"{label:<20}{stats['n']:>6}"
+            f"{stats['mean_s'] * 1000:>12.1f}{stats['median_s'] * 1000:>14.1f}"
+        )
+
+
+def parse_arguments():
+
+    argument_parser = argparse.ArgumentParser(
+        description="Benchmarks for the AToL annotation report tool",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    argument_parser.add_argument(
+        "-o",
+        "--output_file",
+        type=Path,
+        help="Write the benchmark summary to this JSON file",
+    )
+    argument_parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="A summary from an earlier run (written with --output_file) to check for regressions against",
+    )
+    argument_parser.add_argument(
+        "--tolerance",
+        default=0.25,
+        type=float,
+        help="Fail if a median time is more than this fraction slower than the baseline",
+    )
+    argument_parser.add_argument(
+        "--min_regression_ms",
+        default=1.0,
+        type=float,
+        help="Ignore slowdowns smaller than this many milliseconds, which are mostly noise",
+    )
+    subparsers = argument_parser.add_subparsers(dest="benchmark", required=True)
+
+    render_parser = subparsers.add_parser(
+        "render",
+        help="Compare per-report render latency of the cold and warm typst paths",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    render_parser.add_argument(
+        "-n",
+        "--n_reports",
+        default=20,
+        type=int,
+        help="Number of reports to render on each path",
+    )
+    render_parser.add_argument(
+        "-s",
+        "--socket",
+        type=Path,
+        help="Also time a running atol-annotation-report-render-daemon on this socket",
+    )
+    render_parser.set_defaults(run=benchmark_render)
+
+    startup_parser = subparsers.add_parser(
+        "startup",
+        help="Check the reporter's import time and JSON-only run time in a fresh interpreter",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    startup_parser.add_argument(
+        "-n",
+        "--n_runs",
+        default=10,
+        type=int,
+        help="Number of fresh interpreters to time",
+    )
+    startup_parser.add_argument(
+        "--max_import_ms",
+        default=50.0,
+        type=float,
+        help="Fail if the median import time is over this many milliseconds",
+    )
+    startup_parser.set_defaults(run=benchmark_startup)
+
+    suite_parser = subparsers.add_parser(
+        "suite",
+        help="Time reading, mapping, JSON output and rendering on large synthetic inputs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    suite_parser.add_argument(
+        "--scale",
+        default="large",
+        choices=["small", "large"],
+        help="Size of the synthetic inputs",
+    )
+    suite_parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="Random seed for the synthetic inputs",
+    )
+    suite_parser.add_argument(
+        "-n",
+        "--n_repeats",
+        default=5,
+        type=int,
+        help="Number of times to time each stage",
+    )
+    suite_parser.add_argument(
+        "--input_dir",
+        type=Path,
+        help="Write the synthetic inputs to this directory and keep them (default: a temporary directory)",
+    )
+    suite_parser.add_argument(
+        "--no_render",
+        action="store_true",
+        help="Don't time the typst render",
+    )
+    suite_parser.set_defaults(run=benchmark_suite)
+
+    agat_parser = subparsers.add_parser(
+        "agat",
+        help="Compare AGAT YAML loaders on a large synthetic multi-section file",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    agat_parser.add_argument(
+        "--n_feature_types",
+        default=40,
+        type=int,
+        help="Number of transcript-level sections in the YAML",
+    )
+    agat_parser.add_argument(
+        "--n_subfeature_types",
+        default=60,
+        type=int,
+        help="Number of subfeature types in each section",
+    )
+    agat_parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="Random seed for the synthetic YAML",
+    )
+    agat_parser.add_argument(
+        "-n",
+        "--n_repeats",
+        default=3,
+        type=int,
+        help="Number of times to time each loader",
+    )
+    agat_parser.set_defaults(run=benchmark_agat)
+
+    args = argument_parser.parse_args()
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+    summary = args.run(args)
+    if args.baseline is not None:
+        with open(args.baseline, "rt") as f:
+            baseline = json.load(f)
+        summary["failures"] = summary.get("failures", []) + compare_to_baseline(
+            summary, baseline, args.tolerance, args.min_regression_ms
+        )
+    print_summary(summary)
+    if args.output_file is not None:
+        with open(args.output_file, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    for failure in summary.get("failures", []):
+        print(f"FAILED: {failure}")
+    if summary.get("failures"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
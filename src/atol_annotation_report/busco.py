@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# this summarises BUSCO's full_table.tsv, which lists every BUSCO of the
+# lineage with its status and the sequence it was found on. the table can be
+# large for big lineages and proteomes with isoforms, so it is read as a
+# stream, one row at a time. only the aggregates are kept: the duplicated
+# and fragmented BUSCOs, and counts per sequence, which are bounded by the
+# lineage size and the number of sequences, not by the size of the table.
+#
+# in genome mode (when the table has gene positions) the sequence is a
+# chromosome or scaffold, sometimes with the hit's coordinates appended
+# (chr1:1000-2000), which are dropped. in protein and transcriptome mode it is
+# a protein or transcript, so counts per sequence are only calculated when a
+# sequence_map ({protein: contig}) is given.
+#
+# the output is added to the busco block:
+# - duplicated_buscos: [{"busco_id", "description", "sequences"}]
+# - fragmented_buscos: [{"busco_id", "description", "sequence"}]
+#   the sequences of these are the hits: genes or proteins in protein mode,
+#   and chromosomes or scaffolds in genome mode.
+# - busco_sequences: [{"sequence", "single_copy", "duplicated", "fragmented",
+#   "complete_percent"}], most complete first. complete_percent is the
+#   percentage of the lineage's BUSCOs that are complete on that sequence.
+
+import logging
+import re
+
+from atol_annotation_report.inputs import open_input
+
+logger = logging.getLogger(__name__)
+
+coordinates_pattern = re.compile(r":\d+-\d+$")
+
+
+def read_full_table(f):
+    # yields (busco_id, status, sequence, genome_mode, description) for each
+    # row. missing BUSCOs have no sequence.
+    sequence_column = None
+    for line in f:
+        if line.startswith("#"):
+            # the last comment line is the header
+            columns = line[1:].strip().split("\t")
+            if "Sequence" in columns:
+                sequence_column = columns.index("Sequence")
+                description_column = (
+                    columns.index("Description") if "Description" in columns else -1
+                )
+                genome_mode = "Gene Start" in columns
+            continue
+        if not line.strip():
+            continue
+        if sequence_column is None:
+            raise ValueError("BUSCO full table has no header")
+        row = line.rstrip("\n").split("\t")
+        n_columns = len(row)
+        yield (
+            row[0],
+            row[1],
+            row[sequence_column] if n_columns > sequence_column else None,
+            genome_mode,
+            row[description_column] if 0 <= description_column < n_columns else None,
+        )
+
+
+def summarise_full_table(path_to_full_table, sequence_map=None):
+    # the rows of each BUSCO are next to each other
+    n_buscos = 0
+    previous_busco_id = None
+    duplicated = {}
+    fragmented = []
+    # {sequence: [single copy, duplicated copies, fragmented]}
+    sequence_counts = {}
+    # {busco_id: sequences with a copy}
+    duplicated_sequences = {}
+
+    with open_input(path_to_full_table) as f:
+        for busco_id, status, sequence, genome_mode, description in read_full_table(f):
+            if busco_id != previous_busco_id:
+                n_buscos += 1
+                previous_busco_id = busco_id
+            if status == "Missing" or not sequence:
+                continue
+
+            # the hit is the gene or protein in protein mode, and the
+            # sequence in genome mode
+            hit = coordinates_pattern.sub("", sequence) if genome_mode else sequence
+            if status == "Duplicated":
+                entry = duplicated.setdefault(
+                    busco_id,
+                    {"busco_id": busco_id, "description": description, "sequences": []},
+                )
+                entry["sequences"].append(hit)
+            elif status == "Fragmented":
+                fragmented.append(
+                    {"busco_id": busco_id, "description": description, "sequence": hit}
+                )
+
+            if genome_mode:
+                sequence = hit
+            elif sequence_map is not None:
+                sequence = sequence_map.get(sequence)
+            else:
+                continue
+            if sequence is None:
+                continue
+            counts = sequence_counts.setdefault(sequence, [0, 0, 0])
+            if status == "Complete":
+                counts[0] += 1
+            elif status == "Duplicated":
+                counts[1] += 1
+                duplicated_sequences.setdefault(busco_id, set()).add(sequence)
+            elif status == "Fragmented":
+                counts[2] += 1
+
+    # a duplicated BUSCO is complete on each sequence it was found on
+    complete_duplicated = {}
+    for sequences in duplicated_sequences.values():
+        for sequence in sequences:
+            complete_duplicated[sequence] = complete_duplicated.get(sequence, 0) + 1
+
+    busco_sequences = []
+    for sequence, (n_single, n_duplicated, n_fragmented) in sequence_counts.items():
+        n_complete = n_single + complete_duplicated.get(sequence, 0)
+        busco_sequences.append(
+            {
+                "sequence": sequence,
+                "single_copy": n_single,
+                "duplicated": n_duplicated,
+                "fragmented": n_fragmented,
+                "complete_percent": round(100 * n_complete / n_buscos, 2),
+            }
+        )
+    busco_sequences.sort(key=lambda x: (-x["complete_percent"], x["sequence"]))
+
+    summary = {
+        "duplicated_buscos": sorted(duplicated.values(), key=lambda x: x["busco_id"]),
+        "fragmented_buscos": fragmented,
+    }
+    if busco_sequences:
+        summary["busco_sequences"] = busco_sequences
+    else:
+        logger.info(
+            "BUSCO full table has no sequence positions, so no per-sequence counts"
+        )
+    return summary
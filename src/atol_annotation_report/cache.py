@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# an on-disk cache of parsed tool blocks and rendered PDFs, so reruns only
+# redo the parts whose inputs changed.
+#
+# each entry is named by a sha256 over the tool version, the field mapping
+# spec, the source of the modules that parse and map the tool outputs
+# (parser_modules), what the entry is (e.g. the agat block from an AGAT YAML), and the
+# stored contents of every input file (compressed files are not
+# decompressed to hash them). PDFs are keyed on the template contents and the
+# combined statistics they were rendered from.
+# blocks are stored as JSON and PDFs as-is. reading an entry updates its
+# modification time, and when the cache grows past its size cap the least
+# recently used entries are deleted.
+# entries are written to a temporary file and moved into place, so several
+# processes (e.g. batch workers) can share a cache directory.
+# the directory isn't scanned on every write. each process keeps a running
+# total of the cache size, from one scan and the sizes it writes, and only
+# scans again when that total passes the cap, or after rescan_writes writes
+# to count the entries other processes added. eviction goes down to
+# evict_to_fraction of the cap, so a full cache isn't scanned again on the
+# next write.
+
+from pathlib import Path
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+
+from atol_annotation_report.inputs import open_raw, resolve_input
+from atol_annotation_report.mappings import get_spec_path
+
+logger = logging.getLogger(__name__)
+
+default_max_mb = 1024
+mmap_min_bytes = 64 * 1024 * 1024
+rescan_writes = 100
+evict_to_fraction = 0.9
+
+# the modules whose code decides what a cached block contains
+parser_modules = [
+    "python_reporter",
+    "mappings",
+    "inputs",
+    "agat_yaml",
+    "gff_stats",
+    "busco",
+    "omark",
+    "oddities",
+    "fasta",
+]
+
+
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path(Path.home(), ".cache")
+    return Path(cache_home, "atol-annotation-report")
+
+
+def get_tool_version():
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("atol-annotation-report")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def hash_parser_modules():
+    from importlib.resources import files
+
+    modules_hash = hashlib.sha256()
+    for module in parser_modules:
+        source = files("atol_annotation_report").joinpath(module + ".py")
+        modules_hash.update(source.read_bytes())
+    return modules_hash.hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    # hashes the stored bytes, so compressed inputs are not decompressed.
+    # large local files are hashed from a memory map in one call, which
+    # skips copying them through read buffers
+    file_hash = hashlib.sha256()
+    path = resolve_input(path)
+    if isinstance(path, Path) and path.stat().st_size >= mmap_min_bytes:
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as file_map:
+            file_hash.update(file_map)
+        return file_hash.hexdigest()
+    with open_raw(path) as f:
+        while chunk := f.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, cache_dir=None, max_mb=default_max_mb):
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_mb * 1024 * 1024
+        # blocks parsed by edited code or mapped with an edited spec must not
+        # come from the cache, even under the same version
+        self.version = ":".join(
+            [get_tool_version(), hash_file(get_spec_path()), hash_parser_modules()]
+        )
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # estimated size of the cache directory, None until it is scanned
+        self.total_bytes = None
+        self.writes_since_scan = 0
+
+    def make_key(self, kind, parts):
+        key = hashlib.sha256()
+        for part in [self.version, kind, *parts]:
+            key.update(str(part).encode("utf-8"))
+            key.update(b"\0")
+        return key.hexdigest()
+
+    def entry_path(self, key, suffix):
+        return Path(self.cache_dir, key[:2], key + suffix)
+
+    def read(self, key, suffix):
+        path = self.entry_path(key, suffix)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    def write(self, key, suffix, write_entry):
+        path = self.entry_path(key, suffix)
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write_entry(f)
+                entry_bytes = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.writes_since_scan += 1
+        if self.total_bytes is not None:
+            self.total_bytes += entry_bytes
+        if (
+            self.total_bytes is None
+            or self.total_bytes > self.max_bytes
+            or self.writes_since_scan >= rescan_writes
+        ):
+            self.evict()
+
+    def get_block(self, kind, input_files, parse):
+        # returns the cached result of parse() for these input files, or runs
+        # it and caches the result
+        key = self.make_key(kind, [hash_file(x) for x in input_files])
+        path = self.read(key, ".json")
+        if path is not None:
+            try:
+                with open(path, "rt", encoding="utf-8") as f:
+                    result = json.load(f)
+                logger.info(f"Using cached {kind} results")
+                return result
+            except FileNotFoundError:
+                pass
+        result = parse()
+        self.write(key, ".json", lambda f: f.write(json.dumps(result).encode("utf-8")))
+        return result
+
+    def pdf_key(self, path_to_template, combined_stats):
+        return self.make_key(
+            "pdf",
+            [hash_file(path_to_template), json.dumps(combined_stats, sort_keys=True)],
+        )
+
+    def get_pdf(self, key, output_file):
+        path = self.read(key, ".pdf")
+        if path is None:
+            return False
+        try:
+            shutil.copyfile(path, output_file)
+        except FileNotFoundError:
+            return False
+        logger.info("Using cached PDF report")
+        return True
+
+    def put_pdf(self, key, output_file):
+        with open(output_file, "rb") as pdf:
+            self.write(key, ".pdf", lambda f: shutil.copyfileobj(pdf, f))
+
+    def evict(self):
+        entries = []
+        total_bytes = 0
+        for path in self.cache_dir.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+        self.writes_since_scan = 0
+        if total_bytes > self.max_bytes:
+            for _, size, path in sorted(entries):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+                if total_bytes <= self.max_bytes * evict_to_fraction:
+                    break
+        self.total_bytes = total_bytes
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+# a comparison report for several annotations, e.g. BRAKER3 against another
+# annotation of the same genome. the inputs are the rows of a batch manifest
+# (parsed in a process pool) and/or existing json_full files.
+#
+# every numeric field of the agat, busco, omark and annooddities blocks is
+# compared across all the annotations at once: the difference from the
+# reference annotation (the first one, or --reference), and for fields with
+# a "better" direction in the field mapping spec, a rank (1 is best, ties
+# share a rank). annotations are ranked overall by their mean rank.
+#
+# all the annotations and the comparison go to the comparison template in one
+# typst compile, as the "comparison" input:
+# {"labels": [...], "reference": ..., "reports": [full_results, ...],
+#  "metrics": [{"block", "field", "label", "better", "values", "deltas",
+#               "percent_deltas", "ranks"}, ...],
+#  "mean_ranks": [...], "overall_ranks": [...]}
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import logging
+import os
+import sys
+
+from atol_annotation_report import batch
+from atol_annotation_report.cache import default_cache_dir, default_max_mb
+from atol_annotation_report.inputs import get_uncompressed_name, input_path, open_input
+from atol_annotation_report.mappings import get_field_mapper
+from atol_annotation_report.profiling import log_formats, setup_logging
+from atol_annotation_report.python_reporter import collect_stats
+
+logger = logging.getLogger(__name__)
+
+compared_blocks = ["agat", "busco", "omark", "annooddities"]
+
+
+def get_comparison_template_path():
+    from importlib.resources import files
+
+    return Path(files("atol_annotation_report"), "resources", "comparison_template.typ")
+
+
+def parse_json_full(value):
+    # LABEL=PATH, or PATH labelled with its file name
+    label, sep, path = value.rpartition("=")
+    if not sep:
+        label = Path(get_uncompressed_name(path)).stem
+    return label, input_path(path)
+
+
+def is_metric(field, values):
+    if "version" in field:
+        return False
+    numbers = [x for x in values if x is not None]
+    return bool(numbers) and all(
+        isinstance(x, (int, float)) and not isinstance(x, bool) for x in numbers
+    )
+
+
+def get_ranks(values, better):
+    # competition ranking (1, 2, 2, 4), with None for missing values
+    present = [x for x in values if x is not None]
+    ranked = sorted(present, reverse=(better == "higher"))
+    first_rank = {}
+    for i, value in enumerate(ranked):
+        first_rank.setdefault(value, i + 1)
+    return [None if x is None else first_rank[x] for x in values]
+
+
+def compare_metric(values, reference_index, better=None):
+    reference = values[reference_index]
+    deltas = []
+    percent_deltas = []
+    for value in values:
+        if value is None or reference is None:
+            deltas.append(None)
+            percent_deltas.append(None)
+            continue
+        delta = value - reference
+        deltas.append(round(delta, 6))
+        percent_deltas.append(
+            round(100 * delta / reference, 2) if reference != 0 else None
+        )
+    return {
+        "values": values,
+        "deltas": deltas,
+        "percent_deltas": percent_deltas,
+        "ranks": get_ranks(values, better) if better is not None else None,
+    }
+
+
+def compare_reports(labels, reports, reference=None):
+    reference_index = labels.index(reference) if reference is not None else 0
+
+    metrics = []
+    for block in compared_blocks:
+        better = get_field_mapper(block).better
+        # fields in the order they first appear
+        fields = {}
+        for report in reports:
+            fields.update(dict.fromkeys(report.get(block, {})))
+        for field in fields:
+            values = [report.get(block, {}).get(field, "N/A") for report in reports]
+            values = [None if x == "N/A" else x for x in values]
+            if not is_metric(field, values):
+                continue
+            metric = {
+                "block": block,
+                "field": field,
+                "label": field.replace("_", " ").capitalize(),
+                "better": better.get(field),
+            }
+            metric.update(compare_metric(values, reference_index, better.get(field)))
+            metrics.append(metric)
+
+    # the overall rank is the rank of each annotation's mean rank
+    mean_ranks = []
+    for i in range(len(reports)):
+        ranks = [x["ranks"][i] for x in metrics if x["ranks"] is not None]
+        ranks = [x for x in ranks if x is not None]
+        mean_ranks.append(round(sum(ranks) / len(ranks), 2) if ranks else None)
+
+    return {
+        "labels": labels,
+        "reference": labels[reference_index],
+        "reports": reports,
+        "metrics": metrics,
+        "mean_ranks": mean_ranks,
+        "overall_ranks": get_ranks(mean_ranks, "lower"),
+    }
+
+
+def parse_item(item):
+    # runs in a worker set up by batch.init_worker
+    _, combined_stats = collect_stats(
+        **{column: item[column] for column in batch.input_columns},
+        cache=batch.worker_cache,
+    )
+    return combined_stats
+
+
+def collect_reports(
+    manifest=None,
+    json_full=None,
+    threads=1,
+    cache_dir=None,
+    cache_max_mb=default_max_mb,
+    log_format="text",
+    verbose=False,
+):
+    # returns (labels, reports) with the manifest rows first
+    labels = []
+    reports = []
+    if manifest is not None:
+        items = batch.read_manifest(manifest)
+        logger.info(f"Parsing the inputs of {len(items)} annotations")
+        with ProcessPoolExecutor(
+            max_workers=threads,
+            initializer=batch.init_worker,
+            initargs=(None, [], cache_dir, cache_max_mb, log_format, verbose),
+        ) as pool:
+            reports.extend(pool.map(parse_item, items))
+        labels.extend(x["id"] for x in items)
+    for label, path in json_full or []:
+        with open_input(path) as f:
+            reports.append(json.load(f))
+        labels.append(label)
+    return labels, reports
+
+
+def render_comparison(comparison, output_file, package_path=None):
+    import typst
+
+    logger.info("Rendering comparison template")
+    typst.compile(
+        input=get_comparison_template_path(),
+        output=output_file,
+        sys_inputs={"comparison": json.dumps(comparison)},
+        package_path=package_path,
+    )
+
+
+def parse_arguments():
+
+    argument_parser = argparse.ArgumentParser(
+        description="Compare several annotations in one JSON and PDF report",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    input_group = argument_parser.add_argument_group("Input")
+    input_group.add_argument(
+        "-m",
+        "--manifest",
+        type=Path,
+        help="A batch manifest (see atol-annotation-report-batch) with one annotation per row. The ids label the annotations",
+    )
+    input_group.add_argument(
+        "-j",
+        "--json_full",
+        nargs="+",
+        type=parse_json_full,
+        help="json_full files from earlier runs, each as LABEL=PATH or PATH (labelled with the file name)",
+    )
+    input_group.add_argument(
+        "-r",
+        "--reference",
+        help="Label of the annotation the others are compared to (default: the first)",
+    )
+    input_group.add_argument(
+        "-t",
+        "--threads",
+        default=os.cpu_count(),
+        type=int,
+        help="Number of processes used to parse the manifest rows",
+    )
+
+    output_group = argument_parser.add_argument_group("Output")
+    output_group.add_argument(
+        "-o",
+        "--output_file",
+        default=Path("comparison.pdf"),
+        type=Path,
+        help="Path to the output PDF report",
+    )
+    output_group.add_argument(
+        "--json",
+        default=Path("comparison.json"),
+        type=Path,
+        help="Path to the output JSON with every annotation's results and the comparison",
+    )
+    output_group.add_argument(
+        "--no_pdf",
+        action="store_true",
+        help="Don't render the PDF report. typst is not loaded",
+    )
+    output_group.add_argument(
+        "--package_cache",
+        type=Path,
+        help="A local directory of typst packages (laid out as <namespace>/<name>/<version>) to resolve template imports from instead of downloading them",
+    )
+
+    cache_group = argument_parser.add_argument_group("Cache")
+    cache_group.add_argument(
+        "--cache_dir",
+        type=Path,
+        help="Directory for cached results (default: $XDG_CACHE_HOME/atol-annotation-report or ~/.cache/atol-annotation-report)",
+    )
+    cache_group.add_argument(
+        "--cache_max_mb",
+        default=default_max_mb,
+        type=int,
+        help="Size cap for the cache directory in MB. The least recently used results are deleted first",
+    )
+    cache_group.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Don't read or write cached results",
+    )
+
+    log_group = argument_parser.add_argument_group("Logging")
+    log_group.add_argument(
+        "--log_format",
+        default="text",
+        choices=log_formats,
+        help="Write progress messages as plain text or as one JSON object per line",
+    )
+    log_group.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Also log the timing of each stage",
+    )
+
+    args = argument_parser.parse_args()
+    if args.manifest is None and not args.json_full:
+        argument_parser.error("give a --manifest, --json_full files, or both")
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+    setup_logging(args.log_format, verbose=args.verbose)
+
+    if args.no_cache:
+        cache_dir = None
+    else:
+        cache_dir = args.cache_dir or default_cache_dir()
+    labels, reports = collect_reports(
+        manifest=args.manifest,
+        json_full=args.json_full,
+        threads=args.threads,
+        cache_dir=cache_dir,
+        cache_max_mb=args.cache_max_mb,
+        log_format=args.log_format,
+        verbose=args.verbose,
+    )
+    if len(set(labels)) != len(labels):
+        logger.error("Each annotation needs a different label")
+        sys.exit(1)
+    if args.reference is not None and args.reference not in labels:
+        logger.error(f"No annotation is labelled {args.reference}")
+        sys.exit(1)
+
+    logger.info(f"Comparing {len(reports)} annotations")
+    comparison = compare_reports(labels, reports, args.reference)
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump(comparison, f)
+    outputs = ["JSON (" + str(args.json) + ")"]
+
+    if not args.no_pdf:
+        render_comparison(comparison, args.output_file, args.package_cache)
+        outputs.insert(0, "PDF (" + str(args.output_file) + ")")
+
+    logger.info("Comparison completed. Report available as " + ", ".join(outputs))
+
+
+if __name__ == "__main__":
+    main()
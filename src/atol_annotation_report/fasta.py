@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# random access to an uncompressed genome FASTA through a samtools-style .fai
+# index and a memory map of the file, so sequence can be fetched without
+# loading the genome into memory.
+# if the .fai is missing it is built with one pass over the file and written
+# next to the FASTA when that directory is writable.
+
+from pathlib import Path
+import logging
+import mmap
+
+logger = logging.getLogger(__name__)
+
+complement_table = bytes.maketrans(b"ACGTNacgtn", b"TGCANtgcan")
+
+
+def reverse_complement(sequence):
+    return sequence.translate(complement_table)[::-1]
+
+
+def build_fai(path_to_fasta):
+    # returns {name: (length, offset, line_bases, line_width)}
+    index = {}
+    name = None
+    length = seq_offset = 0
+    line_bases = line_width = None
+    with open(path_to_fasta, "rb") as f:
+        offset = 0
+        for line in f:
+            line_length = len(line)
+            if line.startswith(b">"):
+                # a record without sequence lines gets 0s, like samtools faidx
+                if name is not None:
+                    index[name] = (length, seq_offset, line_bases or 0, line_width or 0)
+                name = line[1:].split()[0].decode()
+                length = 0
+                seq_offset = offset + line_length
+                line_bases = None
+                line_width = None
+            elif name is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if line_bases is None:
+                    line_bases = bases
+                    line_width = line_length
+                length += bases
+            offset += line_length
+        if name is not None:
+            index[name] = (length, seq_offset, line_bases or 0, line_width or 0)
+    return index
+
+
+def read_fai(path_to_fai):
+    index = {}
+    with open(path_to_fai, "rt") as f:
+        for line in f:
+            name, length, offset, line_bases, line_width = line.split("\t")[:5]
+            index[name] = (int(length), int(offset), int(line_bases), int(line_width))
+    return index
+
+
+def write_fai(index, path_to_fai):
+    with open(path_to_fai, "wt") as f:
+        for name, (length, offset, line_bases, line_width) in index.items():
+            f.write(f"{name}\t{length}\t{offset}\t{line_bases}\t{line_width}\n")
+
+
+class FastaIndex:
+    def __init__(self, path_to_fasta):
+        path_to_fasta = Path(path_to_fasta)
+        if path_to_fasta.suffix in (".gz", ".bgz", ".zst"):
+            raise ValueError(
+                f"{path_to_fasta} is compressed. Indexed access needs an uncompressed FASTA"
+            )
+        path_to_fai = Path(str(path_to_fasta) + ".fai")
+        if path_to_fai.exists():
+            self.index = read_fai(path_to_fai)
+        else:
+            logger.info(f"Indexing {path_to_fasta}")
+            self.index = build_fai(path_to_fasta)
+            try:
+                write_fai(self.index, path_to_fai)
+            except OSError:
+                pass
+        self.file = open(path_to_fasta, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def length(self, name):
+        return self.index[name][0]
+
+    def fetch(self, name, start, end):
+        # 1-based, inclusive coordinates, clipped to the sequence. returns
+        # upper case bytes.
+        length, offset, line_bases, line_width = self.index[name]
+        start = max(start, 1) - 1
+        end = min(end, length)
+        if end <= start:
+            return b""
+        first = offset + (start // line_bases) * line_width + start % line_bases
+        last = offset + ((end - 1) // line_bases) * line_width + (end - 1) % line_bases
+        sequence = self.map[first : last + 1]
+        if line_width != line_bases:
+            sequence = sequence.replace(b"\n", b"").replace(b"\r", b"")
+        return sequence.upper()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
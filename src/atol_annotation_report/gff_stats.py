@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+
+# this calculates AGAT-style feature statistics directly from a GFF3 or GTF
+# annotation, so the AGAT step can be skipped.
+# the annotation is streamed once. features are grouped by gene, and each gene
+# is summarised and dropped as soon as the stream has moved past it, so only
+# the genes overlapping the current position are held in memory. this relies
+# on the annotation being sorted or grouped by gene, as AGAT, BRAKER and most
+# other annotation tools write it.
+# per-feature lengths are kept in typed arrays (4 bytes per feature) so the
+# medians can be calculated exactly.
+#
+# the output has the same layout as the AGAT stats YAML, e.g.
+# {"mrna": {"with_isoforms": {"value": {...}}, "without_isoforms": {...}}},
+# and is passed to python_reporter.map_agat_stats.
+#
+# definitions follow AGAT: gene and transcript lengths are feature spans,
+# exons and introns are counted per transcript, a "cds" is the sum of the CDS
+# pieces of one transcript, and the isoform kept for "without isoforms" is the
+# one with the longest CDS (then the longest span).
+#
+# as in AGAT, each transcript type (mrna, ncrna, lnc_rna, ...) gets its own
+# section, with the genes that have transcripts of that type. exons and CDSs
+# whose parent isn't a known transcript type are held until the parent turns
+# up, and dropped when the stream moves to the next sequence.
+
+from array import array
+from collections import Counter
+import logging
+import re
+
+from atol_annotation_report.inputs import open_input
+
+logger = logging.getLogger(__name__)
+
+gene_types = {"gene", "pseudogene", "ncrna_gene"}
+# AGAT's level 2 features, e.g. the non-coding transcripts of Ensembl and
+# NCBI annotations
+transcript_types = {
+    "mrna",
+    "transcript",
+    "ncrna",
+    "lnc_rna",
+    "antisense_rna",
+    "mirna",
+    "pirna",
+    "rrna",
+    "scrna",
+    "snrna",
+    "snorna",
+    "srp_rna",
+    "trna",
+    "tmrna",
+    "y_rna",
+    "vault_rna",
+    "guide_rna",
+    "misc_rna",
+    "rnase_mrp_rna",
+    "rnase_p_rna",
+    "telomerase_rna",
+    "primary_transcript",
+    "nc_primary_transcript",
+    "processed_transcript",
+    "pseudogenic_transcript",
+}
+exon_types = {"exon"}
+cds_types = {"cds"}
+
+gtf_attribute_pattern = re.compile(r'(\S+)\s+"([^"]*)"')
+
+
+class Transcript:
+    __slots__ = ("feature_type", "start", "end", "explicit", "exons", "cds_pieces")
+
+    def __init__(self, feature_type="transcript"):
+        self.feature_type = feature_type
+        self.start = None
+        self.end = None
+        self.explicit = False
+        self.exons = []
+        self.cds_pieces = []
+
+    def extend(self, start, end):
+        if self.explicit:
+            return
+        if self.start is None or start < self.start:
+            self.start = start
+        if self.end is None or end > self.end:
+            self.end = end
+
+
+class Gene:
+    __slots__ = ("seqid", "start", "end", "explicit", "transcripts")
+
+    def __init__(self, seqid, start, end):
+        self.seqid = seqid
+        self.start = start
+        self.end = end
+        self.explicit = False
+        self.transcripts = {}
+
+    def extend(self, start, end):
+        if self.explicit:
+            return
+        self.start = min(self.start, start)
+        self.end = max(self.end, end)
+
+
+class LengthArray:
+    def __init__(self):
+        self.values = array("I")
+        self.total = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, length):
+        self.values.append(length)
+        self.total += length
+
+    def extend(self, lengths):
+        self.values.extend(lengths)
+        self.total += sum(lengths)
+
+    def mean(self):
+        return self.total / len(self.values)
+
+    def median(self):
+        # count the distinct lengths rather than sorting a full copy
+        counts = Counter(self.values)
+        n = len(self.values)
+        lower_rank = (n - 1) // 2
+        upper_rank = n // 2
+        seen = 0
+        lower = None
+        for length in sorted(counts):
+            seen += counts[length]
+            if lower is None and seen > lower_rank:
+                lower = length
+            if seen > upper_rank:
+                upper = length
+                break
+        median = (lower + upper) / 2
+        return int(median) if median.is_integer() else median
+
+
+class FeatureTypeStats:
+    def __init__(self):
+        self.genes = LengthArray()
+        self.transcripts = LengthArray()
+        self.exons = LengthArray()
+        self.cds = LengthArray()
+        self.introns = LengthArray()
+        self.single_exon_genes = 0
+        self.single_exon_transcripts = 0
+        self.exons_in_cds = 0
+
+    def add_gene(self, gene_length, transcripts):
+        self.genes.append(gene_length)
+        if all(len(t["exon_lengths"]) == 1 for t in transcripts):
+            self.single_exon_genes += 1
+        for t in transcripts:
+            self.transcripts.append(t["length"])
+            self.exons.extend(t["exon_lengths"])
+            self.introns.extend(t["intron_lengths"])
+            if len(t["exon_lengths"]) == 1:
+                self.single_exon_transcripts += 1
+            if t["cds_length"] > 0:
+                self.cds.append(t["cds_length"])
+                self.exons_in_cds += len(t["exon_lengths"])
+
+    def to_agat_values(self, feature_type):
+        n_genes = len(self.genes)
+        n_transcripts = len(self.transcripts)
+        n_cds = len(self.cds)
+        values = {
+            "Number of gene": n_genes,
+            f"Number of {feature_type}": n_transcripts,
+            "Number of exon": len(self.exons),
+            "Number of cds": n_cds,
+            "Number of intron": len(self.introns),
+            "Number of single exon gene": self.single_exon_genes,
+            f"Number of single exon {feature_type}": self.single_exon_transcripts,
+        }
+        # AGAT rounds per-feature ratios to one decimal place
+        if n_genes > 0:
+            values[f"mean {feature_type}s per gene"] = round(n_transcripts / n_genes, 1)
+        if n_transcripts > 0:
+            values[f"mean exons per {feature_type}"] = round(
+                len(self.exons) / n_transcripts, 1
+            )
+            values[f"mean cdss per {feature_type}"] = round(n_cds / n_transcripts, 1)
+            values[f"mean introns per {feature_type}"] = round(
+                len(self.introns) / n_transcripts, 1
+            )
+        if n_cds > 0:
+            values["mean exons per cds"] = round(self.exons_in_cds / n_cds, 1)
+        for label, lengths in [
+            ("gene", self.genes),
+            (feature_type, self.transcripts),
+            ("exon", self.exons),
+            ("cds", self.cds),
+            ("intron", self.introns),
+        ]:
+            if len(lengths) == 0:
+                continue
+            values[f"Total {label} length (bp)"] = lengths.total
+            values[f"mean {label} length (bp)"] = lengths.mean()
+            values[f"median {label} length (bp)"] = lengths.median()
+            values[f"Longest {label} (bp)"] = max(lengths.values)
+            values[f"Shortest {label} (bp)"] = min(lengths.values)
+        return values
+
+
+def summarise_transcript(transcript):
+    exons = transcript.exons
+    if not exons:
+        # AGAT creates missing exons from the CDS pieces
+        exons = transcript.cds_pieces
+    exons = sorted(exons)
+    exon_lengths = [end - start + 1 for start, end in exons]
+    intron_lengths = [
+        next_start - end - 1
+        for (_, end), (next_start, _) in zip(exons, exons[1:])
+        if next_start - end - 1 > 0
+    ]
+    return {
+        "length": transcript.end - transcript.start + 1,
+        "exon_lengths": exon_lengths,
+        "intron_lengths": intron_lengths,
+        "cds_length": sum(end - start + 1 for start, end in transcript.cds_pieces),
+    }
+
+
+class AnnotationStats:
+    def __init__(self):
+        self.with_isoforms = {}
+        self.without_isoforms = {}
+        # genes and transcripts that the stream has not yet moved past
+        self.genes = {}
+        self.transcript_gene = {}
+        # transcripts seen before their gene is known, on the current sequence
+        self.seqid = None
+        self.orphans = {}
+        self.n_dropped_orphans = 0
+
+    def flush(self, seqid=None, start=None):
+        # summarise every pending gene that ends before this position
+        for gene_id in list(self.genes):
+            gene = self.genes[gene_id]
+            if seqid is not None and gene.seqid == seqid and gene.end >= start:
+                continue
+            del self.genes[gene_id]
+            for transcript_id in gene.transcripts:
+                del self.transcript_gene[transcript_id]
+            self.add_gene(gene)
+
+    def add_gene(self, gene):
+        by_type = {}
+        for transcript in gene.transcripts.values():
+            if transcript.start is None:
+                continue
+            by_type.setdefault(transcript.feature_type, []).append(
+                summarise_transcript(transcript)
+            )
+        gene_length = gene.end - gene.start + 1
+        for feature_type, transcripts in by_type.items():
+            self.with_isoforms.setdefault(feature_type, FeatureTypeStats()).add_gene(
+                gene_length, transcripts
+            )
+            longest = max(transcripts, key=lambda t: (t["cds_length"], t["length"]))
+            self.without_isoforms.setdefault(feature_type, FeatureTypeStats()).add_gene(
+                gene_length, [longest]
+            )
+
+    def get_gene(self, gene_id, seqid, start, end):
+        gene = self.genes.get(gene_id)
+        if gene is None:
+            self.flush(seqid, start)
+            gene = Gene(seqid, start, end)
+            self.genes[gene_id] = gene
+        else:
+            gene.extend(start, end)
+        return gene
+
+    def get_transcript(self, transcript_id, gene_id, seqid, start, end):
+        if transcript_id in self.transcript_gene:
+            gene = self.genes[self.transcript_gene[transcript_id]]
+            gene.extend(start, end)
+            return gene.transcripts[transcript_id]
+        if gene_id is None:
+            return self.orphans.setdefault(transcript_id, Transcript())
+        gene = self.get_gene(gene_id, seqid, start, end)
+        transcript = self.orphans.pop(transcript_id, None) or Transcript()
+        if transcript.start is not None:
+            gene.extend(transcript.start, transcript.end)
+        gene.transcripts[transcript_id] = transcript
+        self.transcript_gene[transcript_id] = gene_id
+        return transcript
+
+    def drop_orphans(self):
+        # parents are on the same sequence as their features, so these never
+        # get a gene
+        self.n_dropped_orphans += len(self.orphans)
+        self.orphans = {}
+
+    def add_feature(
+        self, seqid, feature_type, start, end, strand, phase, gene_id, transcript_ids
+    ):
+        if seqid != self.seqid:
+            self.drop_orphans()
+            self.seqid = seqid
+        if feature_type in gene_types:
+            gene = self.get_gene(gene_id, seqid, start, end)
+            gene.start, gene.end, gene.explicit = start, end, True
+        elif feature_type in transcript_types:
+            transcript = self.get_transcript(
+                transcript_ids[0], gene_id, seqid, start, end
+            )
+            transcript.feature_type = feature_type
+            transcript.start, transcript.end, transcript.explicit = start, end, True
+        elif feature_type in exon_types or feature_type in cds_types:
+            for transcript_id in transcript_ids:
+                transcript = self.get_transcript(
+                    transcript_id, gene_id, seqid, start, end
+                )
+                transcript.extend(start, end)
+                if feature_type in exon_types:
+                    transcript.exons.append((start, end))
+                else:
+                    transcript.cds_pieces.append((start, end))
+
+    def to_agat_document(self):
+        self.flush()
+        self.drop_orphans()
+        if self.n_dropped_orphans > 0:
+            logger.warning(
+                f"Skipped the exons and CDSs of {self.n_dropped_orphans} parent "
+                "features that aren't a known transcript type or have no gene"
+            )
+        document = {}
+        for feature_type in self.with_isoforms:
+            document[feature_type] = {
+                "with_isoforms": {
+                    "value": self.with_isoforms[feature_type].to_agat_values(
+                        feature_type
+                    )
+                },
+                "without_isoforms": {
+                    "value": self.without_isoforms[feature_type].to_agat_values(
+                        feature_type
+                    )
+                },
+            }
+        return document
+
+
+def parse_gff3_attributes(attributes):
+    parsed = {}
+    for field in attributes.strip().split(";"):
+        if "=" in field:
+            key, value = field.split("=", 1)
+            parsed[key.strip()] = value.strip()
+    return parsed
+
+
+def parse_gtf_attributes(attributes):
+    parsed = dict(gtf_attribute_pattern.findall(attributes))
+    if not parsed:
+        # AUGUSTUS and BRAKER write a bare ID on gene and transcript lines
+        parsed["bare_id"] = attributes.strip()
+    return parsed
+
+
+def read_features(f):
+    # yields (seqid, type, start, end, strand, phase, gene_id, transcript_ids)
+    # for every gene, transcript, exon and CDS line, from either GFF3 or GTF
+    is_gtf = None
+    for line in f:
+        if line.startswith("#"):
+            if line.startswith("##FASTA"):
+                break
+            continue
+        columns = line.rstrip("\n").split("\t")
+        if len(columns) < 9:
+            continue
+        feature_type = columns[2].lower()
+        if (
+            feature_type not in gene_types
+            and feature_type not in transcript_types
+            and feature_type not in exon_types
+            and feature_type not in cds_types
+        ):
+            continue
+        seqid = columns[0]
+        start = int(columns[3])
+        end = int(columns[4])
+        strand = columns[6]
+        phase = int(columns[7]) if columns[7] in ("0", "1", "2") else 0
+        attributes = columns[8]
+
+        if is_gtf is None:
+            if '_id "' in attributes:
+                is_gtf = True
+            elif "=" in attributes:
+                is_gtf = False
+
+        if is_gtf:
+            parsed = parse_gtf_attributes(attributes)
+            bare_id = parsed.get("bare_id")
+            if feature_type in gene_types:
+                gene_id = parsed.get("gene_id", bare_id)
+                transcript_ids = []
+            else:
+                gene_id = parsed.get("gene_id")
+                transcript_ids = [parsed.get("transcript_id", bare_id)]
+        else:
+            parsed = parse_gff3_attributes(attributes)
+            feature_id = parsed.get("ID")
+            parents = parsed["Parent"].split(",") if "Parent" in parsed else []
+            if feature_type in gene_types:
+                gene_id = feature_id
+                transcript_ids = []
+            elif feature_type in transcript_types:
+                # a transcript without a parent gene is its own gene
+                gene_id = parents[0] if parents else feature_id
+                transcript_ids = [feature_id]
+            else:
+                gene_id = None
+                transcript_ids = parents
+
+        if feature_type in gene_types and gene_id is None:
+            continue
+        if feature_type not in gene_types and None in transcript_ids:
+            continue
+        if not transcript_ids and feature_type not in gene_types:
+            continue
+
+        yield seqid, feature_type, start, end, strand, phase, gene_id, transcript_ids
+
+
+def calculate_agat_stats(path_to_annotation):
+    annotation_stats = AnnotationStats()
+    with open_input(path_to_annotation) as f:
+        for feature in read_features(f):
+            annotation_stats.add_feature(*feature)
+    return annotation_stats.to_agat_document()
+
+
+def read_transcript_sequences(path_to_annotation):
+    # {transcript or gene ID: seqid}, to place proteins named after their
+    # transcript or gene on a sequence. each seqid is stored once.
+    seqids = {}
+    transcript_sequences = {}
+    with open_input(path_to_annotation) as f:
+        for seqid, _, _, _, _, _, gene_id, transcript_ids in read_features(f):
+            seqid = seqids.setdefault(seqid, seqid)
+            for transcript_id in transcript_ids:
+                transcript_sequences.setdefault(transcript_id, seqid)
+            if gene_id is not None:
+                transcript_sequences.setdefault(gene_id, seqid)
+    return transcript_sequences
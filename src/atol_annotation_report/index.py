@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+
+# a cross-annotation index of report results. json_full (or json_atol) files,
+# or the inputs listed in a batch manifest, are flattened into one row per
+# report in a single SQLite table with typed columns, so questions across
+# thousands of annotations are one query instead of a directory scan.
+#
+# - columns are named <block>_<field> (e.g. agat_gene_count,
+#   busco_complete_percent), or just the field for metadata. a json_atol file
+#   fills the same columns as the json_full fields it was copied from.
+# - a column is added the first time its field is seen. its type comes from
+#   that value: BOOLEAN, INTEGER, REAL, TEXT, or JSON TEXT for lists and
+#   objects. version fields are always TEXT. "N/A" is stored as NULL.
+# - the sources table is the manifest of everything ingested, with the sha256
+#   of its contents. a file whose size and modification time haven't changed
+#   isn't read again, and a report whose hash hasn't changed isn't stored
+#   again, so re-running ingest over the same tree only adds new and changed
+#   reports.
+# - the taxon, lineage and tool version columns are indexed for the query
+#   filters.
+# - export writes the table column by column, as Parquet if pyarrow is
+#   installed, or as column-oriented JSON with repeated text values stored
+#   once in a dictionary.
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import sys
+import time
+
+from atol_annotation_report.batch import input_columns, read_manifest
+from atol_annotation_report.cache import get_tool_version, hash_file
+from atol_annotation_report.inputs import open_input
+from atol_annotation_report.mappings import get_field_mapper
+from atol_annotation_report.profiling import log_formats, setup_logging
+from atol_annotation_report.python_reporter import collect_stats
+
+logger = logging.getLogger(__name__)
+
+report_blocks = ["agat", "busco", "omark", "annooddities"]
+
+taxon_columns = ["taxon_id", "scientific_name"]
+lineage_columns = ["busco_lineage_name", "omark_lineage"]
+version_columns = {
+    "reporter": "reporter_version",
+    "busco": "busco_version_busco",
+    "hmmsearch": "busco_version_hmmsearch",
+    "metaeuk": "busco_version_metaeuk",
+    "augustus": "busco_version_augustus",
+    "miniprot": "busco_version_miniprot",
+    "omamer": "omark_omamer_version",
+    "omamer_db": "omark_omamer_db_version",
+}
+indexed_columns = taxon_columns + lineage_columns + list(version_columns.values())
+
+default_query_columns = [
+    "source",
+    "scientific_name",
+    "taxon_id",
+    "busco_lineage_name",
+    "busco_complete_percent",
+    "agat_gene_count",
+    "omark_lineage",
+    "omark_percent_contaminant",
+]
+
+# {SQL type: export type}
+export_types = {
+    "BOOLEAN": "bool",
+    "INTEGER": "int64",
+    "REAL": "float64",
+    "TEXT": "string",
+    "JSON TEXT": "json",
+}
+
+
+def get_column_name(block, field):
+    if block is not None and not field.startswith(f"{block}_"):
+        field = f"{block}_{field}"
+    return re.sub(r"\W+", "_", field).strip("_").lower()
+
+
+def get_column_type(column, value):
+    if "version" in column:
+        return "TEXT"
+    if isinstance(value, bool):
+        return "BOOLEAN"
+    if isinstance(value, int):
+        return "INTEGER"
+    if isinstance(value, float):
+        return "REAL"
+    if isinstance(value, (list, dict)):
+        return "JSON TEXT"
+    return "TEXT"
+
+
+def to_sql_value(column_type, value):
+    if value is None or value == "N/A" or value == ["N/A"]:
+        return None
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    if column_type == "TEXT":
+        return str(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def get_atol_columns():
+    # {AToL field: column of the report field it was copied from}
+    atol_columns = {}
+    for tool in report_blocks:
+        mapper = get_field_mapper(tool)
+        for key_field, index in mapper.key_fields:
+            atol_columns[key_field] = get_column_name(tool, mapper.names[index])
+    return atol_columns
+
+
+def flatten_report(document):
+    # returns (kind, {column: value}) for a json_full or json_atol document
+    if list(document) == ["annotation"]:
+        atol_columns = get_atol_columns()
+        row = {
+            atol_columns.get(key, get_column_name(None, key)): value
+            for key, value in document["annotation"].items()
+        }
+        return "json_atol", row
+
+    row = {}
+    for key, value in document.items():
+        if isinstance(value, dict):
+            for field, field_value in value.items():
+                row[get_column_name(key, field)] = field_value
+        else:
+            row[get_column_name(None, key)] = value
+    return "json_full", row
+
+
+def escape_like(value):
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+
+def parse_tool_version(value):
+    tool, sep, version = value.partition("=")
+    if not sep or tool not in version_columns:
+        raise argparse.ArgumentTypeError(
+            f"expected TOOL=VERSION with TOOL one of {', '.join(version_columns)}"
+        )
+    return tool, version
+
+
+class ReportIndex:
+    def __init__(self, path_to_database):
+        self.path_to_database = path_to_database
+        self.db = sqlite3.connect(path_to_database, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "source TEXT PRIMARY KEY, "
+            "kind TEXT NOT NULL, "
+            "sha256 TEXT NOT NULL, "
+            "size INTEGER, "
+            "mtime_ns INTEGER, "
+            "ingested REAL NOT NULL)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS reports (source TEXT PRIMARY KEY)")
+        # {column: SQL type}
+        self.columns = {
+            x[1]: x[2] for x in self.db.execute("PRAGMA table_info(reports)")
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.db.close()
+
+    def begin(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self.db.execute("COMMIT")
+
+    def get_source(self, source):
+        return self.db.execute(
+            "SELECT sha256, size, mtime_ns FROM sources WHERE source = ?", (source,)
+        ).fetchone()
+
+    def touch_source(self, source, size, mtime_ns):
+        self.db.execute(
+            "UPDATE sources SET size = ?, mtime_ns = ? WHERE source = ?",
+            (size, mtime_ns, source),
+        )
+
+    def add_columns(self, row):
+        for column, value in row.items():
+            if column in self.columns:
+                continue
+            column_type = get_column_type(column, value)
+            self.db.execute(f'ALTER TABLE reports ADD COLUMN "{column}" {column_type}')
+            self.columns[column] = column_type
+            if column in indexed_columns:
+                # NOCASE, so the prefix filters (LIKE) can use the index
+                self.db.execute(
+                    f'CREATE INDEX IF NOT EXISTS "reports_{column}" '
+                    f'ON reports ("{column}" COLLATE NOCASE)'
+                )
+
+    def put(self, source, kind, sha256, row, size=None, mtime_ns=None):
+        # values that are N/A don't create columns
+        row = {k: v for k, v in row.items() if to_sql_value("TEXT", v) is not None}
+        self.add_columns(row)
+        columns = ["source", *row]
+        values = [source] + [to_sql_value(self.columns[k], v) for k, v in row.items()]
+        self.db.execute(
+            "INSERT OR REPLACE INTO reports ("
+            + ", ".join(f'"{x}"' for x in columns)
+            + ") VALUES ("
+            + ", ".join("?" for _ in columns)
+            + ")",
+            values,
+        )
+        self.db.execute(
+            "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?)",
+            (source, kind, sha256, size, mtime_ns, time.time()),
+        )
+
+    def make_filters(self, taxa=None, lineages=None, tool_versions=None):
+        # returns (WHERE clause, parameters). the values of one filter are
+        # alternatives, and every filter given must match.
+        clauses = []
+        params = []
+
+        def add_filter(conditions):
+            # conditions are (column, LIKE pattern)
+            conditions = [(c, p) for c, p in conditions if c in self.columns]
+            if not conditions:
+                clauses.append("0")
+                return
+            clauses.append(
+                "("
+                + " OR ".join(f"\"{c}\" LIKE ? ESCAPE '\\'" for c, _ in conditions)
+                + ")"
+            )
+            params.extend(p for _, p in conditions)
+
+        if taxa:
+            # a taxon ID, or a scientific name or its start (e.g. a genus)
+            add_filter(
+                [("taxon_id", escape_like(x)) for x in taxa]
+                + [("scientific_name", escape_like(x) + "%") for x in taxa]
+            )
+        if lineages:
+            add_filter(
+                [(c, escape_like(x) + "%") for x in lineages for c in lineage_columns]
+            )
+        if tool_versions:
+            # a version matches itself and its point releases
+            add_filter(
+                [
+                    (version_columns[tool], pattern)
+                    for tool, version in tool_versions
+                    for pattern in [escape_like(version), escape_like(version) + ".%"]
+                ]
+            )
+
+        return " AND ".join(clauses) or "1", params
+
+    def query(self, columns, taxa=None, lineages=None, tool_versions=None):
+        # returns a cursor over the matching rows, ordered by source
+        unknown = [x for x in columns if x not in self.columns]
+        if unknown:
+            raise ValueError(f"No such columns in the index: {', '.join(unknown)}")
+        where, params = self.make_filters(taxa, lineages, tool_versions)
+        return self.db.execute(
+            "SELECT "
+            + ", ".join(f'"{x}"' for x in columns)
+            + f" FROM reports WHERE {where} ORDER BY source",
+            params,
+        )
+
+
+def find_report_files(paths, pattern):
+    for path in paths:
+        if path.is_dir():
+            yield from sorted(path.rglob(pattern))
+        else:
+            yield path
+
+
+def ingest_files(index, paths, pattern):
+    # returns (n_added, n_unchanged, n_failed)
+    n_added = n_unchanged = n_failed = 0
+    index.begin()
+    for path in find_report_files(paths, pattern):
+        source = str(path.resolve())
+        try:
+            stat = path.stat()
+            known = index.get_source(source)
+            if known is not None and (known[1], known[2]) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                n_unchanged += 1
+                continue
+            sha256 = hash_file(path)
+            if known is not None and known[0] == sha256:
+                index.touch_source(source, stat.st_size, stat.st_mtime_ns)
+                n_unchanged += 1
+                continue
+            with open_input(path) as f:
+                kind, row = flatten_report(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping {path}: {e}")
+            n_failed += 1
+            continue
+        index.put(source, kind, sha256, row, stat.st_size, stat.st_mtime_ns)
+        n_added += 1
+    index.commit()
+    return n_added, n_unchanged, n_failed
+
+
+def hash_inputs(item):
+    inputs_hash = hashlib.sha256()
+    for column in input_columns:
+        if item[column] is not None:
+            inputs_hash.update(f"{column}\0{hash_file(item[column])}\0".encode())
+    return inputs_hash.hexdigest()
+
+
+def parse_item(item):
+    # runs the parsers for one manifest row in a worker process. returns
+    # (row, error)
+    try:
+        _, combined_stats = collect_stats(
+            **{column: item[column] for column in input_columns}
+        )
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    _, row = flatten_report(combined_stats)
+    row["reporter_version"] = get_tool_version()
+    return row, None
+
+
+def ingest_manifest(index, path_to_manifest, threads):
+    # returns (n_added, n_unchanged, n_failed)
+    manifest_name = str(path_to_manifest.resolve())
+    n_unchanged = n_failed = 0
+    changed = []
+    for item in read_manifest(path_to_manifest):
+        source = f"{manifest_name}#{item['id']}"
+        try:
+            sha256 = hash_inputs(item)
+        except OSError as e:
+            logger.warning(f"Skipping {item['id']}: {e}")
+            n_failed += 1
+            continue
+        known = index.get_source(source)
+        if known is not None and known[0] == sha256:
+            n_unchanged += 1
+        else:
+            changed.append((source, sha256, item))
+
+    logger.info(f"Parsing the inputs of {len(changed)} reports with {threads} workers")
+    with ProcessPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(parse_item, [x[2] for x in changed]))
+
+    n_added = 0
+    index.begin()
+    for (source, sha256, item), (row, error) in zip(changed, results):
+        if error is not None:
+            logger.warning(f"Skipping {item['id']}: {error}")
+            n_failed += 1
+            continue
+        index.put(source, "inputs", sha256, row)
+        n_added += 1
+    index.commit()
+    return n_added, n_unchanged, n_failed
+
+
+def encode_column(values):
+    # repeated text (names, lineages, versions) is stored once, and each row
+    # refers to it by position
+    if all(x is None or isinstance(x, str) for x in values):
+        dictionary = list(dict.fromkeys(x for x in values if x is not None))
+        if len(dictionary) * 2 <= len(values):
+            codes = {x: i for i, x in enumerate(dictionary)}
+            return {
+                "dictionary": dictionary,
+                "codes": [None if x is None else codes[x] for x in values],
+            }
+    return {"values": values}
+
+
+def get_export_columns(index, columns, rows):
+    # returns [(column, export type, values)]
+    export_columns = []
+    for i, column in enumerate(columns):
+        values = [row[i] for row in rows]
+        export_type = export_types.get(index.columns[column], "string")
+        if export_type == "bool":
+            values = [None if x is None else bool(x) for x in values]
+        elif export_type == "int64" and any(isinstance(x, float) for x in values):
+            export_type = "float64"
+        export_columns.append((column, export_type, values))
+    return export_columns
+
+
+def write_columnar_json(export_columns, path_to_output):
+    document = {
+        "n_rows": len(export_columns[0][2]) if export_columns else 0,
+        "columns": [
+            {"name": column, "type": export_type, **encode_column(values)}
+            for column, export_type, values in export_columns
+        ],
+    }
+    opener = gzip.open if path_to_output.suffix == ".gz" else open
+    with opener(path_to_output, "wt", encoding="utf-8") as f:
+        json.dump(document, f, separators=(",", ":"))
+
+
+def write_parquet(export_columns, path_to_output):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "Writing Parquet needs pyarrow. Install it, or export to .json or .json.gz"
+        ) from e
+
+    arrow_types = {
+        "bool": pyarrow.bool_(),
+        "int64": pyarrow.int64(),
+        "float64": pyarrow.float64(),
+        "string": pyarrow.string(),
+        "json": pyarrow.string(),
+    }
+    table = pyarrow.table(
+        {
+            column: pyarrow.array(values, type=arrow_types[export_type])
+            for column, export_type, values in export_columns
+        }
+    )
+    pyarrow.parquet.write_table(table, path_to_output, compression="zstd")
+
+
+def parse_columns(value):
+    return [x for x in value.split(",") if x]
+
+
+def add_filter_arguments(parser):
+    parser.add_argument(
+        "--taxon",
+        action="append",
+        help="Only reports for this taxon ID, or scientific name or its start (e.g. a genus). Can be repeated",
+    )
+    parser.add_argument(
+        "--lineage",
+        action="append",
+        help="Only reports whose BUSCO lineage or OMArk clade starts with this. Can be repeated",
+    )
+    parser.add_argument(
+        "--tool_version",
+        action="append",
+        type=parse_tool_version,
+        help="Only reports made with this version (or its point releases) of a tool, as TOOL=VERSION, e.g. busco=5.8. TOOL is one of "
+        + ", ".join(version_columns)
+        + ". Can be repeated",
+    )
+
+
+def parse_arguments():
+
+    argument_parser = argparse.ArgumentParser(
+        description="Index report results from many annotations in one SQLite file, and query or export them",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    argument_parser.add_argument(
+        "-d",
+        "--database",
+        default=Path("atol-annotation-report-index.sqlite"),
+        type=Path,
+        help="Path to the index",
+    )
+    argument_parser.add_argument(
+        "--log_format",
+        default="text",
+        choices=log_formats,
+        help="Write progress messages as plain text or as one JSON object per line",
+    )
+    subparsers = argument_parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest",
+        help="Add new and changed reports to the index",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    ingest_parser.add_argument(
+        "paths",
+        nargs="*",
+        type=Path,
+        help="json_full or json_atol files, or directories to search for them",
+    )
+    ingest_parser.add_argument(
+        "--pattern",
+        default="*json_full*.json",
+        help="Filename pattern for the files found in directories",
+    )
+    ingest_parser.add_argument(
+        "--manifest",
+        type=Path,
+        help="A batch manifest (see atol-annotation-report-batch). The parsers are run on each row's inputs and the results are indexed without writing any reports",
+    )
+    ingest_parser.add_argument(
+        "-t",
+        "--threads",
+        default=1,
+        type=int,
+        help="Number of processes used to parse the inputs of a manifest",
+    )
+    ingest_parser.set_defaults(run=run_ingest)
+
+    query_parser = subparsers.add_parser(
+        "query",
+        help="Print the matching reports as TSV",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    query_parser.add_argument(
+        "--columns",
+        default=default_query_columns,
+        type=parse_columns,
+        help="Comma-separated columns to print, or all",
+    )
+    query_parser.add_argument(
+        "-o",
+        "--output_file",
+        type=Path,
+        help="Write the TSV to this file instead of stdout",
+    )
+    add_filter_arguments(query_parser)
+    query_parser.set_defaults(run=run_query)
+
+    export_parser = subparsers.add_parser(
+        "export",
+        help="Write the matching reports to a columnar file",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    export_parser.add_argument(
+        "output_file",
+        type=Path,
+        help="Output path. .parquet is written with pyarrow, .json or .json.gz as column-oriented JSON",
+    )
+    export_parser.add_argument(
+        "--columns",
+        default=["all"],
+        type=parse_columns,
+        help="Comma-separated columns to export, or all",
+    )
+    add_filter_arguments(export_parser)
+    export_parser.set_defaults(run=run_export)
+
+    args = argument_parser.parse_args()
+    if args.command == "ingest" and not args.paths and args.manifest is None:
+        argument_parser.error("ingest needs paths or a --manifest")
+
+    return args
+
+
+def run_ingest(index, args):
+    n_added = n_unchanged = n_failed = 0
+    if args.paths:
+        logger.info(f"Indexing {args.pattern} files")
+        n_added, n_unchanged, n_failed = ingest_files(index, args.paths, args.pattern)
+    if args.manifest is not None:
+        logger.info(f"Indexing the reports in {args.manifest}")
+        counts = ingest_manifest(index, args.manifest, args.threads)
+        n_added += counts[0]
+        n_unchanged += counts[1]
+        n_failed += counts[2]
+    logger.info(
+        f"Indexed {n_added} reports ({n_unchanged} unchanged, {n_failed} skipped) "
+        f"in {args.database}"
+    )
+    return n_failed == 0
+
+
+def get_query(index, args):
+    columns = list(index.columns) if args.columns == ["all"] else args.columns
+    cursor = index.query(columns, args.taxon, args.lineage, args.tool_version)
+    return columns, cursor
+
+
+def run_query(index, args):
+    columns, cursor = get_query(index, args)
+    f = sys.stdout if args.output_file is None else open(args.output_file, "w")
+    try:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows(cursor)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return True
+
+
+def run_export(index, args):
+    columns, cursor = get_query(index, args)
+    export_columns = get_export_columns(index, columns, cursor.fetchall())
+    if args.output_file.suffix == ".parquet":
+        write_parquet(export_columns, args.output_file)
+    else:
+        write_columnar_json(export_columns, args.output_file)
+    n_rows = len(export_columns[0][2]) if export_columns else 0
+    logger.info(f"Exported {n_rows} reports to {args.output_file}")
+    return True
+
+
+def main():
+    args = parse_arguments()
+    setup_logging(args.log_format)
+
+    with ReportIndex(args.database) as index:
+        try:
+            succeeded = args.run(index, args)
+        except (ImportError, ValueError) as e:
+            logger.error(str(e))
+            succeeded = False
+
+    if not succeeded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# one way of opening input files for all the parsers, so tool outputs can be
+# read the way they are archived, without a decompressed copy on disk.
+#
+# - gzip and zstd are recognised by the first bytes of the file, not its
+#   name, and are decompressed while the parser reads. zstd needs the
+#   zstandard package (or python 3.14's compression.zstd).
+# - "-" is standard input, which is checked for compression the same way.
+# - URLs (scheme://...) are opened with fsspec if it is installed. a URL
+#   prefix can also be mapped to a local directory with add_mirror (e.g.
+#   s3://bucket/runs/ to /data/runs/), which serves those URLs from disk
+#   with or without fsspec. file:// URLs are local paths.
+#
+# input paths are kept as strings when they are "-" or URLs, because Path
+# would merge the slashes of the URL.
+
+from contextlib import contextmanager
+from pathlib import Path
+import gzip
+import io
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+gzip_magic = b"\x1f\x8b"
+zstd_magic = b"\x28\xb5\x2f\xfd"
+compression_suffixes = {".gz", ".gzip", ".zst", ".zstd"}
+
+# [(URL prefix, local directory)], longest prefix first
+mirrors = []
+
+
+def is_stdin(path):
+    return str(path) == "-"
+
+
+def is_url(path):
+    return "://" in str(path)
+
+
+def input_path(value):
+    # argparse type and manifest conversion for input arguments
+    if is_stdin(value) or is_url(value):
+        return value
+    return Path(value)
+
+
+def parse_mirror(value):
+    # PREFIX=DIR
+    prefix, sep, directory = value.rpartition("=")
+    if not sep or not is_url(prefix):
+        raise ValueError(f"expected URL_PREFIX=DIRECTORY, got {value}")
+    return prefix, Path(directory)
+
+
+def add_mirror(prefix, directory):
+    mirrors.append((prefix, Path(directory)))
+    mirrors.sort(key=lambda x: len(x[0]), reverse=True)
+
+
+def resolve_input(path):
+    # returns a local Path, "-", or the URL if it has no local mirror
+    if is_stdin(path):
+        return "-"
+    if not is_url(path):
+        return Path(path)
+    path = str(path)
+    if path.startswith("file://"):
+        return Path(path.removeprefix("file://"))
+    for prefix, directory in mirrors:
+        if path.startswith(prefix):
+            return Path(directory, path.removeprefix(prefix).lstrip("/"))
+    return path
+
+
+def get_uncompressed_name(path):
+    # the file name without a compression suffix, for formats that are
+    # recognised by their extension
+    name = str(path).rstrip("/").rsplit("/", 1)[-1]
+    stem, dot, suffix = name.rpartition(".")
+    if dot and "." + suffix.lower() in compression_suffixes:
+        return stem
+    return name
+
+
+def open_raw(path):
+    # a binary stream of the stored bytes
+    path = resolve_input(path)
+    if is_stdin(path):
+        # the with block must not close the interpreter's stdin
+        return os.fdopen(sys.stdin.fileno(), "rb", closefd=False)
+    if isinstance(path, Path):
+        return open(path, "rb")
+    try:
+        import fsspec
+    except ImportError:
+        raise ValueError(
+            f"Reading {path} needs fsspec, or a local mirror of the URL"
+        ) from None
+    return fsspec.open(path, "rb").open()
+
+
+def open_zstd(f):
+    try:
+        from compression import zstd
+
+        return zstd.ZstdFile(f)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError(
+            "Reading zstd-compressed input needs the zstandard package"
+        ) from None
+    return io.BufferedReader(
+        zstandard.ZstdDecompressor().stream_reader(
+            f, read_across_frames=True, closefd=False
+        )
+    )
+
+
+def decompress(f):
+    if not hasattr(f, "peek"):
+        f = io.BufferedReader(f)
+    magic = f.peek(len(zstd_magic))[: len(zstd_magic)]
+    if magic.startswith(gzip_magic):
+        return gzip.GzipFile(fileobj=f)
+    if magic == zstd_magic:
+        return open_zstd(f)
+    return f
+
+
+@contextmanager
+def open_input(path, mode="rt", newline=None):
+    # the decompressed contents of a file, "-" or URL, in text ("rt") or
+    # binary ("rb") mode
+    with open_raw(path) as raw:
+        f = decompress(raw)
+        try:
+            if mode == "rb":
+                yield f
+            else:
+                yield io.TextIOWrapper(f, encoding="utf-8", newline=newline)
+        finally:
+            if f is not raw:
+                f.close()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# the tool parsers map values from each tool's output to the report fields
+# with the declarative spec in resources/field_mappings.json. the spec is read
+# once per process and each tool's section is compiled into a FieldMapper, so
+# supporting a new tool version is an edit to the spec, not to the parsers.
+#
+# each tool in the spec has:
+# - fields: report fields in output order. "source" is the path to the value
+#   in the tool output. each step of the path is a key, or a list of
+#   alternative keys used by different tool versions (the first one present
+#   wins). with "select", the field collects the entries of the source list
+#   that contain that key. "default" replaces "N/A" for missing values.
+#   "better" ("higher" or "lower") says which way a metric improves, for
+#   ranking annotations in the comparison report. "type" is the kind of
+#   value the report expects, checked by validation.py before rendering.
+# - roots (optional): alternative paths to the part of the output that the
+#   field sources start from, tried in order. "values" are constant fields
+#   set when that root is used.
+# - key_fields: {AToL field: report field} for the AToL JSON.
+#
+# the field sources are compiled into a tree of path steps shared between
+# fields, so mapping an output visits each part of the document once.
+# missing fields are "N/A" in the full report and left out of the AToL JSON.
+
+import copy
+import json
+
+missing = object()
+
+compiled_mappers = None
+
+
+def get_spec_path():
+    from importlib.resources import files
+
+    return files("atol_annotation_report").joinpath("resources", "field_mappings.json")
+
+
+def compile_path(source):
+    return tuple(tuple(step) if isinstance(step, list) else (step,) for step in source)
+
+
+def find_value(document, aliases):
+    if isinstance(document, dict):
+        for alias in aliases:
+            if alias in document:
+                return document[alias]
+    return missing
+
+
+class FieldMapper:
+    def __init__(self, tool, tool_spec):
+        self.tool = tool
+        self.names = [f"{tool}_input_provided"]
+        self.defaults = [None]
+        # {field: "higher" or "lower"}
+        self.better = {}
+        # {field: value type}
+        self.types = {}
+
+        # roots are (path, [(field index, value)])
+        self.roots = []
+        for root in tool_spec.get("roots", []):
+            root_values = []
+            for name, value in root["values"].items():
+                root_values.append((self.add_name(name, None), value))
+            self.roots.append((compile_path(root["source"]), root_values))
+
+        # each node of the tree is {aliases: [leaves, child node]}, where
+        # leaves are (field index, select) for the fields read at that step
+        self.tree = {}
+        for field in tool_spec["fields"]:
+            index = self.add_name(field["name"], field.get("default", "N/A"))
+            if "better" in field:
+                self.better[field["name"]] = field["better"]
+            if "type" in field:
+                self.types[field["name"]] = field["type"]
+            node = self.tree
+            path = compile_path(field["source"])
+            for i, aliases in enumerate(path):
+                leaves, child = node.setdefault(aliases, [[], {}])
+                if i == len(path) - 1:
+                    leaves.append((index, field.get("select")))
+                node = child
+
+        self.key_fields = [
+            (key_field, self.names.index(name))
+            for key_field, name in tool_spec["key_fields"].items()
+        ]
+
+    def add_name(self, name, default):
+        if name not in self.names:
+            self.names.append(name)
+            self.defaults.append(default)
+        return self.names.index(name)
+
+    def get_section_paths(self):
+        # the paths to the parts of the output that the fields are read
+        # from, so loaders can skip the rest
+        if self.roots:
+            return [path for path, _ in self.roots]
+        return [(aliases,) for aliases in self.tree]
+
+    def find_root(self, document):
+        for path, root_values in self.roots:
+            root = document
+            for aliases in path:
+                root = find_value(root, aliases)
+                if root is missing:
+                    break
+            else:
+                return root, root_values
+        raise ValueError(
+            f"{self.tool} output has none of the sections "
+            + ", ".join("/".join("|".join(x) for x in path) for path, _ in self.roots)
+        )
+
+    def walk(self, node, document, values):
+        for aliases, (leaves, child) in node.items():
+            value = find_value(document, aliases)
+            if value is missing:
+                continue
+            for index, select in leaves:
+                if select is None:
+                    values[index] = value
+                else:
+                    selected = [x for x in value if select in x]
+                    values[index] = selected or copy.copy(self.defaults[index])
+            if child:
+                self.walk(child, value, values)
+
+    def map(self, document):
+        # returns (all_stats, key_stats)
+        values = [missing] * len(self.names)
+        values[0] = True
+        if self.roots:
+            document, root_values = self.find_root(document)
+            for index, value in root_values:
+                values[index] = value
+        self.walk(self.tree, document, values)
+
+        # fields found in the input come first, then the missing fields
+        all_stats = {
+            name: value
+            for name, value in zip(self.names, values)
+            if value is not missing
+        }
+        for name, value, default in zip(self.names, values, self.defaults):
+            if value is missing:
+                all_stats[name] = copy.copy(default)
+        key_stats = {
+            key_field: values[index]
+            for key_field, index in self.key_fields
+            if values[index] is not missing
+        }
+        return all_stats, key_stats
+
+
+def load_field_mappers(path_to_spec=None):
+    if path_to_spec is None:
+        path_to_spec = get_spec_path()
+    with open(path_to_spec, "rt") as f:
+        spec = json.load(f)
+    return {tool: FieldMapper(tool, tool_spec) for tool, tool_spec in spec.items()}
+
+
+def get_field_mapper(tool):
+    # the spec is compiled on first use and reused for every document
+    global compiled_mappers
+    if compiled_mappers is None:
+        compiled_mappers = load_field_mappers()
+    return compiled_mappers[tool]
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# this calculates the AnnoOddities transcript checks directly from a GFF3 or
+# GTF annotation and the genome FASTA, so the AnnoOddities stage and its
+# summary TSV can be skipped.
+# the result is the same {check: number of transcripts} table that
+# AnnoOddities writes, keyed by the same expressions (e.g. "exon_num == 1").
+#
+# the annotation is streamed one contig at a time. each contig's transcripts
+# are checked in a worker process that reads the genome through its .fai
+# index and a memory map, so the genome is never loaded into memory.
+#
+# checks that need the sequence:
+# - start codon: the first in-frame CDS codon is ATG
+# - stop codon: the last in-frame CDS codon, or the codon immediately after
+#   the CDS (GTF CDS features exclude the stop codon), is a stop
+# - in-frame stop: a stop codon anywhere before the last CDS codon
+# - canonical introns: GT-AG, GC-AG or AT-AC on the transcript strand.
+#   suspicious splicing means a non-canonical intron that would be canonical
+#   on the other strand.
+# is_fragment is approximated as a coding transcript missing both its start
+# and stop codon.
+# transcripts without a CDS (e.g. ncRNA exons) only get the exon and intron
+# checks. the coding_checks would count every one of them as an oddity.
+
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from atol_annotation_report.fasta import FastaIndex, reverse_complement
+from atol_annotation_report.gff_stats import cds_types, exon_types, read_features
+from atol_annotation_report.inputs import open_input
+
+stop_codons = {b"TAA", b"TAG", b"TGA"}
+canonical_splice_sites = {(b"GT", b"AG"), (b"GC", b"AG"), (b"AT", b"AC")}
+
+oddity_checks = {
+    "exon_num == 1": lambda t: t["exon_num"] == 1,
+    "exon_num > 1": lambda t: t["exon_num"] > 1,
+    "five_utr_length > 10000": lambda t: t["five_utr_length"] > 10000,
+    "five_utr_num > 5": lambda t: t["five_utr_num"] > 5,
+    "three_utr_length > 10000": lambda t: t["three_utr_length"] > 10000,
+    "three_utr_num > 4": lambda t: t["three_utr_num"] > 4,
+    "not is_complete": lambda t: not t["is_complete"],
+    "not has_start_codon": lambda t: not t["has_start_codon"],
+    "not has_stop_codon": lambda t: not t["has_stop_codon"],
+    "is_fragment": lambda t: t["is_fragment"],
+    "has_inframe_stop": lambda t: t["has_inframe_stop"],
+    "max_exon_length > 10000": lambda t: t["max_exon_length"] > 10000,
+    "max_intron_length > 120000": lambda t: t["max_intron_length"] > 120000,
+    "min_exon_length <= 5": lambda t: t["min_exon_length"] <= 5,
+    "0 < min_intron_length <= 5": lambda t: 0 < t["min_intron_length"] <= 5,
+    "selected_cds_fraction <= 0.3": lambda t: t["selected_cds_fraction"] <= 0.3,
+    "canonical_intron_proportion != 1": lambda t: t["canonical_intron_proportion"] != 1,
+    "only_non_canonical_splicing": lambda t: t["only_non_canonical_splicing"],
+    "suspicious_splicing": lambda t: t["suspicious_splicing"],
+}
+
+coding_checks = {
+    "not is_complete",
+    "not has_start_codon",
+    "not has_stop_codon",
+    "is_fragment",
+    "has_inframe_stop",
+    "selected_cds_fraction <= 0.3",
+}
+
+# the genome is opened once in each worker process by init_worker
+worker_genome = None
+
+
+def init_worker(path_to_genome):
+    global worker_genome
+    worker_genome = FastaIndex(path_to_genome)
+
+
+def spliced_sequence(genome, seqid, pieces, strand):
+    sequence = b"".join(genome.fetch(seqid, start, end) for start, end in pieces)
+    if strand == "-":
+        sequence = reverse_complement(sequence)
+    return sequence
+
+
+def check_codons(genome, seqid, strand, cds_pieces):
+    # cds_pieces are (start, end, phase), sorted by start
+    if strand == "-":
+        phase = cds_pieces[-1][2]
+    else:
+        phase = cds_pieces[0][2]
+    sequence = spliced_sequence(
+        genome, seqid, [(start, end) for start, end, _ in cds_pieces], strand
+    )
+    codons = [sequence[i : i + 3] for i in range(phase, len(sequence) - 2, 3)]
+
+    has_start_codon = phase == 0 and len(codons) > 0 and codons[0] == b"ATG"
+    has_stop_codon = len(codons) > 0 and codons[-1] in stop_codons
+    if not has_stop_codon:
+        if strand == "-":
+            cds_start = cds_pieces[0][0]
+            next_codon = reverse_complement(
+                genome.fetch(seqid, cds_start - 3, cds_start - 1)
+            )
+        else:
+            cds_end = cds_pieces[-1][1]
+            next_codon = genome.fetch(seqid, cds_end + 1, cds_end + 3)
+        has_stop_codon = next_codon in stop_codons
+        inframe_codons = codons
+    else:
+        inframe_codons = codons[:-1]
+    has_inframe_stop = any(codon in stop_codons for codon in inframe_codons)
+
+    return has_start_codon, has_stop_codon, has_inframe_stop
+
+
+def check_introns(genome, seqid, strand, introns):
+    n_canonical = 0
+    n_suspicious = 0
+    for start, end in introns:
+        left = genome.fetch(seqid, start, start + 1)
+        right = genome.fetch(seqid, end - 1, end)
+        forward = (left, right)
+        reverse = (reverse_complement(right), reverse_complement(left))
+        if strand == "-":
+            forward, reverse = reverse, forward
+        if forward in canonical_splice_sites:
+            n_canonical += 1
+        elif reverse in canonical_splice_sites:
+            n_suspicious += 1
+    return n_canonical, n_suspicious
+
+
+def utr_segments(exons, cds_start, cds_end):
+    # exon parts either side of the CDS, as (left lengths, right lengths)
+    left = []
+    right = []
+    for start, end in exons:
+        if start < cds_start:
+            left.append(min(end, cds_start - 1) - start + 1)
+        if end > cds_end:
+            right.append(end - max(start, cds_end + 1) + 1)
+    return left, right
+
+
+def summarise_transcript(genome, seqid, strand, exons, cds_pieces):
+    cds_pieces = sorted(cds_pieces)
+    exons = sorted(exons) if exons else [(start, end) for start, end, _ in cds_pieces]
+    exon_lengths = [end - start + 1 for start, end in exons]
+    introns = [
+        (end + 1, next_start - 1)
+        for (_, end), (next_start, _) in zip(exons, exons[1:])
+        if next_start - end - 1 > 0
+    ]
+    intron_lengths = [end - start + 1 for start, end in introns]
+    cds_length = sum(end - start + 1 for start, end, _ in cds_pieces)
+
+    if cds_pieces:
+        has_start_codon, has_stop_codon, has_inframe_stop = check_codons(
+            genome, seqid, strand, cds_pieces
+        )
+        left, right = utr_segments(exons, cds_pieces[0][0], cds_pieces[-1][1])
+    else:
+        has_start_codon, has_stop_codon, has_inframe_stop = False, False, False
+        left, right = [], []
+    five_utrs, three_utrs = (right, left) if strand == "-" else (left, right)
+
+    n_canonical, n_suspicious = check_introns(genome, seqid, strand, introns)
+    if introns:
+        canonical_intron_proportion = n_canonical / len(introns)
+    else:
+        canonical_intron_proportion = 1
+
+    return {
+        "is_coding": bool(cds_pieces),
+        "exon_num": len(exons),
+        "five_utr_length": sum(five_utrs),
+        "five_utr_num": len(five_utrs),
+        "three_utr_length": sum(three_utrs),
+        "three_utr_num": len(three_utrs),
+        "is_complete": has_start_codon and has_stop_codon,
+        "has_start_codon": has_start_codon,
+        "has_stop_codon": has_stop_codon,
+        "is_fragment": bool(cds_pieces) and not has_start_codon and not has_stop_codon,
+        "has_inframe_stop": has_inframe_stop,
+        "max_exon_length": max(exon_lengths),
+        "min_exon_length": min(exon_lengths),
+        "max_intron_length": max(intron_lengths, default=0),
+        "min_intron_length": min(intron_lengths, default=0),
+        "selected_cds_fraction": cds_length / sum(exon_lengths),
+        "canonical_intron_proportion": canonical_intron_proportion,
+        "only_non_canonical_splicing": bool(introns) and n_canonical == 0,
+        "suspicious_splicing": n_suspicious > 0,
+    }
+
+
+def check_contig(seqid, transcripts, genome=None):
+    if genome is None:
+        genome = worker_genome
+    if seqid not in genome:
+        raise ValueError(f"Sequence {seqid} from the annotation is not in the genome")
+    oddity_counts = Counter()
+    for strand, exons, cds_pieces in transcripts.values():
+        transcript = summarise_transcript(genome, seqid, strand, exons, cds_pieces)
+        for oddity, check in oddity_checks.items():
+            if not transcript["is_coding"] and oddity in coding_checks:
+                continue
+            if check(transcript):
+                oddity_counts[oddity] += 1
+    return oddity_counts
+
+
+def read_contigs(f):
+    # yields (seqid, {transcript_id: (strand, exons, cds_pieces)}) for each
+    # run of features on the same sequence
+    current_seqid = None
+    transcripts = {}
+    for (
+        seqid,
+        feature_type,
+        start,
+        end,
+        strand,
+        phase,
+        _,
+        transcript_ids,
+    ) in read_features(f):
+        if feature_type not in exon_types and feature_type not in cds_types:
+            continue
+        if seqid != current_seqid:
+            if transcripts:
+                yield current_seqid, transcripts
+            current_seqid = seqid
+            transcripts = {}
+        for transcript_id in transcript_ids:
+            transcript = transcripts.setdefault(transcript_id, (strand, [], []))
+            if feature_type in exon_types:
+                transcript[1].append((start, end))
+            else:
+                transcript[2].append((start, end, phase))
+    if transcripts:
+        yield current_seqid, transcripts
+
+
+def calculate_oddities(path_to_annotation, path_to_genome, threads=1):
+    oddity_counts = Counter({oddity: 0 for oddity in oddity_checks})
+    with open_input(path_to_annotation) as f:
+        if threads > 1:
+            with ProcessPoolExecutor(
+                max_workers=threads,
+                initializer=init_worker,
+                initargs=(path_to_genome,),
+            ) as pool:
+                # only a few contigs are queued at a time, so the annotation
+                # is not read into memory ahead of the workers
+                pending = set()
+                for seqid, transcripts in read_contigs(f):
+                    if len(pending) >= 2 * threads:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            oddity_counts.update(future.result())
+                    pending.add(pool.submit(check_contig, seqid, transcripts))
+                for future in pending:
+                    oddity_counts.update(future.result())
+        else:
+            genome = FastaIndex(path_to_genome)
+            for seqid, transcripts in read_contigs(f):
+                oddity_counts.update(check_contig(seqid, transcripts, genome))
+            genome.close()
+    return dict(oddity_counts)
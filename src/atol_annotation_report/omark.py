@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# this places OMArk's per-protein results on the contigs of the annotation, to
+# show which contigs the contaminant and inconsistent proteins come from.
+#
+# the detail files are the per-protein outputs from the same OMArk run,
+# either given one at a time or as the OMArk output directory. each file's
+# role comes from its name:
+# - *.omamer: the OMAmer search output. proteins with no HOG (hogid "na")
+#   are unplaced, the rest are placed
+# - names containing consistent, inconsistent, contaminant (or
+#   contamination) or unknown: lists of the proteins in that OMArk category,
+#   one per line, as IDs, FASTA headers or the first column of a table
+# other files in a directory are ignored.
+#
+# the files can have millions of rows, so they are streamed and only a
+# counter per contig and category is kept. proteins are matched to contigs
+# by their transcript or gene ID in the annotation.
+#
+# the result is added to the omark block as omark_contig_tallies, a table
+# with one row per contig, ordered by the number of contaminant and then
+# inconsistent proteins:
+# {"columns": ["contig", "consistent", ...], "rows": [["chr1", 10, ...], ...]}
+# omark_unmatched_proteins counts the proteins that are not in the annotation.
+
+from pathlib import Path
+import logging
+
+from atol_annotation_report.gff_stats import read_transcript_sequences
+from atol_annotation_report.inputs import (
+    get_uncompressed_name,
+    open_input,
+    resolve_input,
+)
+
+logger = logging.getLogger(__name__)
+
+omark_categories = ["consistent", "inconsistent", "contaminant", "unknown"]
+omamer_categories = ["placed", "unplaced"]
+tally_columns = ["contig"] + omark_categories + omamer_categories
+
+# (category, words in the file name), tried in order because "consistent"
+# is part of "inconsistent"
+category_names = [
+    ("inconsistent", ["inconsistent"]),
+    ("contaminant", ["contaminant", "contamination"]),
+    ("consistent", ["consistent"]),
+    ("unknown", ["unknown"]),
+]
+
+unplaced_hogs = {"na", "n/a", ""}
+
+
+def get_file_category(path):
+    name = get_uncompressed_name(path).lower()
+    if name.endswith(".omamer"):
+        return "omamer"
+    for category, words in category_names:
+        if any(word in name for word in words):
+            return category
+    return None
+
+
+def find_detail_files(path_to_detail):
+    # returns [(path, category)] for a detail file or an OMArk output
+    # directory
+    path_to_detail = resolve_input(path_to_detail)
+    if not isinstance(path_to_detail, Path) or not path_to_detail.is_dir():
+        category = get_file_category(path_to_detail)
+        if category is None:
+            raise ValueError(
+                f"Can't tell which OMArk output {path_to_detail} is from its name"
+            )
+        return [(path_to_detail, category)]
+    detail_files = []
+    for path in sorted(path_to_detail.iterdir()):
+        category = get_file_category(path)
+        if path.is_file() and category is not None:
+            detail_files.append((path, category))
+    if not detail_files:
+        raise ValueError(f"No OMArk per-protein files found in {path_to_detail}")
+    return detail_files
+
+
+def read_protein_list(f):
+    # yields the protein IDs of a category file
+    for line in f:
+        if not line.strip() or line[0] in "#!":
+            continue
+        yield line.lstrip(">").split(None, 1)[0]
+
+
+def read_omamer(f):
+    # yields (protein ID, category) from an OMAmer search output
+    protein_column = hog_column = None
+    for line in f:
+        columns = line.rstrip("\n").split("\t")
+        if protein_column is None:
+            header = [x.lstrip("!#").strip() for x in columns]
+            if "qseqid" in header and "hogid" in header:
+                protein_column = header.index("qseqid")
+                hog_column = header.index("hogid")
+            continue
+        if line.startswith(("!", "#")) or len(columns) <= hog_column:
+            continue
+        if columns[hog_column].lower() in unplaced_hogs:
+            yield columns[protein_column], "unplaced"
+        else:
+            yield columns[protein_column], "placed"
+
+
+def tally_contigs(detail_files, protein_contigs):
+    # returns {contig: [count per category]} and the number of unmatched
+    # proteins
+    category_index = {x: i for i, x in enumerate(tally_columns[1:])}
+    tallies = {}
+    n_unmatched = 0
+
+    def add(protein, category):
+        nonlocal n_unmatched
+        contig = protein_contigs.get(protein)
+        if contig is None:
+            n_unmatched += 1
+            return
+        counts = tallies.get(contig)
+        if counts is None:
+            counts = tallies[contig] = [0] * len(category_index)
+        counts[category_index[category]] += 1
+
+    for path, file_category in detail_files:
+        logger.debug(f"Reading OMArk {file_category} proteins from {path}")
+        with open_input(path) as f:
+            if file_category == "omamer":
+                for protein, category in read_omamer(f):
+                    add(protein, category)
+            else:
+                for protein in read_protein_list(f):
+                    add(protein, file_category)
+
+    return tallies, n_unmatched
+
+
+def summarise_omark_detail(path_to_detail, path_to_annotation):
+    detail_files = find_detail_files(path_to_detail)
+    tallies, n_unmatched = tally_contigs(
+        detail_files, read_transcript_sequences(path_to_annotation)
+    )
+    if n_unmatched:
+        logger.warning(
+            f"{n_unmatched} OMArk protein entries have no transcript or gene "
+            "with the same ID in the annotation"
+        )
+
+    contaminant = tally_columns.index("contaminant")
+    inconsistent = tally_columns.index("inconsistent")
+    rows = sorted(
+        ([contig, *counts] for contig, counts in tallies.items()),
+        key=lambda x: (-x[contaminant], -x[inconsistent], x[0]),
+    )
+    return {
+        "omark_contig_tallies": {"columns": tally_columns, "rows": rows},
+        "omark_unmatched_proteins": n_unmatched,
+    }
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# quick looks at a report before, or instead of, the full PDF.
+# - html: a self-contained HTML summary written straight from the combined
+#   statistics (the json_full document) without typst, so it takes
+#   milliseconds. it has the summary table of the report and every scalar
+#   field of each tool block.
+# - png and svg: the first page of the typst report, rendered from the same
+#   template (see render_preview in python_reporter.py and
+#   ReportRenderer.render_first_page).
+#
+# previews are written to a temporary file and moved into place, so the
+# report service never serves a half-written preview while the PDF is still
+# rendering. the temporary file is created with mode 0666, so the kernel
+# applies the umask and previews get the same permissions as the other
+# outputs, not mkstemp's private 0600.
+
+from pathlib import Path
+import os
+
+tool_blocks = [
+    ("agat", "AGAT Statistics"),
+    ("busco", "BUSCO"),
+    ("omark", "OMArk"),
+    ("annooddities", "AnnoOddities Results"),
+]
+
+# (label, block, fields tried in order), as in the report's summary table
+summary_rows = [
+    ("Number of genes", "agat", ["gene_count"]),
+    ("Number of CDSs", "agat", ["cds_count"]),
+    ("Number of mRNAs or transcripts", "agat", ["mrna_count", "transcript_count"]),
+    (
+        "Mean mRNA or transcript length",
+        "agat",
+        ["mean_mrna_length", "mean_transcript_length"],
+    ),
+    ("BUSCO summary", "busco", ["one_line_summary"]),
+    ("BUSCO lineage dataset", "busco", ["lineage_name"]),
+    ("BUSCO mode", "busco", ["mode"]),
+    ("OMArk completeness", "omark", ["omark_completeness_summary"]),
+    ("OMArk lineage", "omark", ["omark_lineage"]),
+    ("OMArk consistency", "omark", ["omark_consistency_summary"]),
+]
+
+style = """
+body { font-family: sans-serif; margin: 2em auto; max-width: 60em; }
+table { border-collapse: collapse; margin-bottom: 1.5em; }
+th, td { text-align: left; padding: 0.2em 1em 0.2em 0; vertical-align: top; }
+th { font-weight: bold; }
+.missing { color: #888; }
+"""
+
+
+def write_atomic(path, data):
+    path = Path(path)
+    # a random name, so concurrent writers in one directory don't collide
+    tmp_path = path.parent / f".{path.name}.{os.urandom(6).hex()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def format_value(value):
+    from html import escape
+
+    if value == "N/A" or value is None:
+        return '<span class="missing">N/A</span>'
+    if isinstance(value, float):
+        value = round(value, 2)
+    return escape(str(value))
+
+
+def get_label(field):
+    return field.replace("_", " ").capitalize()
+
+
+def table_rows(rows):
+    from html import escape
+
+    return "".join(
+        f"<tr><th>{escape(label)}</th><td>{format_value(value)}</td></tr>"
+        for label, value in rows
+    )
+
+
+def make_html_summary(combined_stats):
+    from html import escape
+
+    parts = ["<h1>Genome Annotation Report</h1>"]
+
+    if combined_stats.get("metadata_input_provided"):
+        parts.append(
+            f"<p>The <em>{escape(str(combined_stats.get('scientific_name', 'N/A')))}"
+            "</em> genome assembly "
+            f"{escape(str(combined_stats.get('assembly_accession', 'N/A')))} was "
+            f"annotated by {escape(str(combined_stats.get('contact_name', 'N/A')))}."
+            "</p>"
+        )
+
+    summary = []
+    for label, block, fields in summary_rows:
+        stats = combined_stats.get(block, {})
+        if not stats.get(f"{block}_input_provided"):
+            summary.append((label, "Not calculated"))
+            continue
+        values = [stats.get(x, "N/A") for x in fields]
+        summary.append((label, next((x for x in values if x != "N/A"), "N/A")))
+    parts.append(f"<h2>Summary</h2><table>{table_rows(summary)}</table>")
+
+    metadata = [
+        (get_label(key), value)
+        for key, value in combined_stats.items()
+        if not isinstance(value, (dict, list)) and key != "metadata_input_provided"
+    ]
+    if combined_stats.get("metadata_input_provided"):
+        parts.append(f"<h2>Metadata</h2><table>{table_rows(metadata)}</table>")
+
+    # tables and lists (e.g. duplicated BUSCOs) are left to the full report
+    for block, title in tool_blocks:
+        stats = combined_stats.get(block, {})
+        if not stats.get(f"{block}_input_provided"):
+            continue
+        rows = [
+            (get_label(field), value)
+            for field, value in stats.items()
+            if not isinstance(value, (dict, list))
+            and field != f"{block}_input_provided"
+        ]
+        parts.append(f"<h2>{escape(title)}</h2><table>{table_rows(rows)}</table>")
+
+    return (
+        '<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+        "<title>Genome Annotation Report</title>"
+        f"<style>{style}</style></head><body>{''.join(parts)}</body></html>\n"
+    )
+
+
+def write_html_summary(combined_stats, output_file):
+    write_atomic(output_file, make_html_summary(combined_stats).encode("utf-8"))
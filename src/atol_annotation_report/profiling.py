@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# per-stage timing and logging setup shared by the reporter and the batch
+# runner.
+#
+# StageProfiler.stage() records the wall time, CPU time and peak RSS of each
+# stage of a report (each parser, the merge, each JSON write and the typst
+# compile). CPU time includes worker processes that finished during the
+# stage. peak_rss_mb is the high-water mark of this process at the end of the
+# stage, so a stage that raises it is the one that used the memory.
+# a batch worker renders many reports, so on linux the high-water mark is
+# reset when each report's profiler is created, and peak_rss_mb is that
+# report's own peak (peak_rss_scope "report"). where it can't be reset, it is
+# the peak since the process started, including earlier reports
+# (peak_rss_scope "process").
+# each record is logged at debug level and can be written out with --profile.
+#
+# progress messages go through the logging module. the text format prints the
+# message only (with a prefix for warnings and errors), like the old print()
+# calls. the json format writes one object per line, with the stage record
+# fields added to stage messages.
+
+from contextlib import contextmanager
+import json
+import logging
+import resource
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+log_formats = ["text", "json"]
+profile_metrics = ["wall_s", "cpu_s", "peak_rss_mb"]
+profile_percentiles = [50, 90, 99]
+
+
+def get_cpu_time():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def get_peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+
+def reset_peak_rss():
+    # returns True if the high-water mark (ru_maxrss and VmHWM) was reset
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+class StageProfiler:
+    def __init__(self):
+        self.records = []
+        self.peak_rss_scope = "report" if reset_peak_rss() else "process"
+
+    @contextmanager
+    def stage(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = get_cpu_time()
+        try:
+            yield
+        finally:
+            record = {
+                "stage": name,
+                "wall_s": round(time.perf_counter() - wall_start, 6),
+                "cpu_s": round(get_cpu_time() - cpu_start, 6),
+                "peak_rss_mb": round(get_peak_rss_mb(), 1),
+            }
+            self.records.append(record)
+            logger.debug(
+                f"Stage {name} took {record['wall_s']:.3f} s", extra={"profile": record}
+            )
+
+    def write(self, path_to_profile):
+        with open(path_to_profile, "w", encoding="utf-8") as f:
+            json.dump(
+                {"peak_rss_scope": self.peak_rss_scope, "stages": self.records},
+                f,
+                indent=2,
+            )
+
+
+def percentile(values, q):
+    # linear interpolation between the closest ranks
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarise_profiles(profiles):
+    # profiles is a list of stage record lists, one per report. returns
+    # {stage: {"n": ..., metric: {"p50": ..., "p90": ..., "p99": ..., "max": ...}}}
+    by_stage = {}
+    for records in profiles:
+        for record in records:
+            by_stage.setdefault(record["stage"], []).append(record)
+    summary = {}
+    for stage, records in by_stage.items():
+        summary[stage] = {"n": len(records)}
+        for metric in profile_metrics:
+            values = [x[metric] for x in records]
+            summary[stage][metric] = {
+                f"p{q}": round(percentile(values, q), 6) for q in profile_percentiles
+            }
+            summary[stage][metric]["max"] = max(values)
+    return summary
+
+
+class TextLogFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            message = f"{record.levelname.capitalize()}: {message}"
+        return message
+
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if hasattr(record, "profile"):
+            entry.update(record.profile)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def setup_logging(log_format="text", verbose=False):
+    handler = logging.StreamHandler(sys.stdout)
+    if log_format == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(TextLogFormatter("%(message)s"))
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.INFO,
+        handlers=[handler],
+        force=True,
+    )
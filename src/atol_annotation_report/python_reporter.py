@@ -10,12 +10,71 @@
 # this script simutaneously collects a subset of data for atol in atol_report.json.
 # atol_report.json contains an object which can be fed straight into the genome-note-lite pipeline.
 
-from importlib.resources import files
+# typst, yaml, importlib.resources and the annotation and genome modules are
+# imported in the functions that use them, so runs that only need some of the
+# outputs don't pay for loading the rest.
+
+# the tool outputs can be gzip or zstd compressed, "-" for stdin, or URLs
+# (see inputs.py).
+
+# the metadata and the tool blocks are checked against the report schema
+# before anything is written (see validation.py).
+
 from pathlib import Path
 import argparse
+import csv
 import json
-import typst
-import yaml
+import logging
+import sys
+
+from atol_annotation_report.inputs import (
+    add_mirror,
+    get_uncompressed_name,
+    input_path,
+    is_stdin,
+    is_url,
+    open_input,
+    parse_mirror,
+)
+from atol_annotation_report.mappings import get_field_mapper
+from atol_annotation_report.preview import write_atomic, write_html_summary
+from atol_annotation_report.profiling import StageProfiler, log_formats, setup_logging
+from atol_annotation_report.validation import (
+    ValidationError,
+    check_metadata_rows,
+    format_error,
+    get_schema,
+    validate_blocks,
+)
+
+logger = logging.getLogger(__name__)
+
+output_formats = ["json_atol", "json_full", "pdf", "html", "png", "svg"]
+default_formats = ["json_atol", "json_full", "pdf"]
+# the first page of the PDF report, as an image
+preview_formats = {"png": "preview_png", "svg": "preview_svg"}
+
+# inputs that can be "-" (stdin), compressed or URLs
+stdin_arguments = [
+    "metadata_file",
+    "agat_file",
+    "annotation_file",
+    "busco_file",
+    "busco_full_table",
+    "omark_file",
+    "omark_detail",
+    "annooddities_file",
+]
+
+
+def parse_formats(value):
+    formats = [x.strip() for x in value.split(",") if x.strip()]
+    for output_format in formats:
+        if output_format not in output_formats:
+            raise argparse.ArgumentTypeError(
+                f"unknown output format {output_format}. Choose from {','.join(output_formats)}"
+            )
+    return formats
 
 
 def parse_arguments():
@@ -27,42 +86,88 @@ def parse_arguments():
 
     input_group = argument_parser.add_argument_group("Input")
     output_group = argument_parser.add_argument_group("Output")
+    validation_group = argument_parser.add_argument_group("Validation")
+    watch_group = argument_parser.add_argument_group("Watch")
+    cache_group = argument_parser.add_argument_group("Cache")
+    logging_group = argument_parser.add_argument_group("Logging")
 
     input_group.add_argument(
         "-m",
         "--metadata_file",
         nargs="?",
-        type=Path,
-        help="a JSON file containing metadata according to the Annotation Metadata Schema",
+        type=input_path,
+        help="a JSON file (or a CSV with meta_key and meta_value columns) containing metadata according to the Annotation Metadata Schema",
     )
     input_group.add_argument(
         "-a",
         "--agat_file",
         nargs="?",
-        type=Path,
+        type=input_path,
         help="a YAML file generated as output from an AGAT analysis on your annotation file",
     )
+    input_group.add_argument(
+        "-g",
+        "--annotation_file",
+        nargs="?",
+        type=input_path,
+        help="a GFF3 or GTF annotation file. If no AGAT file is given, AGAT statistics are calculated directly from this file",
+    )
     input_group.add_argument(
         "-b",
         "--busco_file",
         nargs="?",
-        type=Path,
+        type=input_path,
         help="a JSON file generated as output from a BUSCO analysis on your annotation file",
     )
+    input_group.add_argument(
+        "-bt",
+        "--busco_full_table",
+        nargs="?",
+        type=input_path,
+        help="the full_table.tsv from the same BUSCO analysis. Adds the duplicated and fragmented BUSCOs, and the completeness of each sequence (in genome mode, or with --annotation_file), to the report. Needs --busco_file",
+    )
     input_group.add_argument(
         "-om",
         "--omark_file",
         nargs="?",
-        type=Path,
+        type=input_path,
         help="a JSON file generated as output from an OMArk analysis on your annotation file",
     )
+    input_group.add_argument(
+        "-od",
+        "--omark_detail",
+        nargs="?",
+        type=input_path,
+        help="the per-protein outputs of the same OMArk analysis: its output directory, or one .omamer or protein category file. Adds the consistent, inconsistent and contaminant proteins on each contig to the report. Needs --omark_file and --annotation_file",
+    )
     input_group.add_argument(
         "-ao",
         "--annooddities_file",
         nargs="?",
-        type=Path,
+        type=input_path,
         help="a TXT file summarising any oddities found in the AnnoOddity analysis of your annotation file",
     )
+    input_group.add_argument(
+        "-f",
+        "--genome_file",
+        nargs="?",
+        type=Path,
+        help="an uncompressed FASTA file of the genome assembly. If an annotation file is given and no AnnoOddities file, the AnnoOddities checks are calculated directly from the annotation and this file",
+    )
+    input_group.add_argument(
+        "-t",
+        "--threads",
+        default=1,
+        type=int,
+        help="Number of processes used to check contigs in parallel",
+    )
+    input_group.add_argument(
+        "--input_mirror",
+        action="append",
+        default=[],
+        type=parse_mirror,
+        help="Read input URLs starting with URL_PREFIX from a local directory, as URL_PREFIX=DIRECTORY (e.g. s3://bucket/runs/=/data/runs/). Can be repeated. Other URLs need fsspec",
+    )
 
     output_group.add_argument(
         "-o",
@@ -83,418 +188,644 @@ def parse_arguments():
         type=Path,
         help="Path to the output JSON data for all results",
     )
+    output_group.add_argument(
+        "--html",
+        default=Path("summary.html"),
+        type=Path,
+        help="Path to the HTML summary (html format), written from the JSON data without typst",
+    )
+    output_group.add_argument(
+        "--preview_png",
+        default=Path("preview.png"),
+        type=Path,
+        help="Path to the PNG preview of the first page of the report (png format)",
+    )
+    output_group.add_argument(
+        "--preview_svg",
+        default=Path("preview.svg"),
+        type=Path,
+        help="Path to the SVG preview of the first page of the report (svg format)",
+    )
+    output_group.add_argument(
+        "--preview_ppi",
+        default=96,
+        type=float,
+        help="Resolution of the PNG preview in pixels per inch",
+    )
+    output_group.add_argument(
+        "--formats",
+        default=list(default_formats),
+        type=parse_formats,
+        help="Comma-separated outputs to write, from " + ",".join(output_formats),
+    )
+    output_group.add_argument(
+        "--no_pdf",
+        action="store_true",
+        help="Don't render the PDF report (same as leaving pdf out of --formats). typst is not loaded",
+    )
+    output_group.add_argument(
+        "--render_socket",
+        type=Path,
+        help="Send the report to a running atol-annotation-report-render-daemon listening on this Unix socket instead of compiling the template in this process",
+    )
+    output_group.add_argument(
+        "--package_cache",
+        type=Path,
+        help="A local directory of typst packages (laid out as <namespace>/<name>/<version>) to resolve template imports from instead of downloading them",
+    )
+
+    validation_group.add_argument(
+        "--no_validation",
+        action="store_true",
+        help="Don't check the metadata and tool outputs against the report schema",
+    )
+    validation_group.add_argument(
+        "--strict_validation",
+        action="store_true",
+        help="Also require the metadata keys in the report schema, with the types and patterns given there",
+    )
+    validation_group.add_argument(
+        "--validation_report",
+        type=Path,
+        help="If validation fails, write the problems found to this JSON file",
+    )
+
+    watch_group.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and rebuild the outputs whenever an input file is created or changes. Only the changed tools' results are parsed again. Stop with Ctrl-C",
+    )
+    watch_group.add_argument(
+        "--poll_interval",
+        default=1.0,
+        type=float,
+        help="Seconds between checks of the input files in watch mode",
+    )
+    watch_group.add_argument(
+        "--debounce",
+        default=2.0,
+        type=float,
+        help="Seconds the input files must stay unchanged before a rebuild in watch mode",
+    )
+
+    cache_group.add_argument(
+        "--cache_dir",
+        type=Path,
+        help="Directory for cached results (default: $XDG_CACHE_HOME/atol-annotation-report or ~/.cache/atol-annotation-report)",
+    )
+    cache_group.add_argument(
+        "--cache_max_mb",
+        default=1024,
+        type=int,
+        help="Size cap for the cache directory in MB. The least recently used results are deleted first",
+    )
+    cache_group.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Don't read or write cached results",
+    )
+
+    logging_group.add_argument(
+        "--log_format",
+        default="text",
+        choices=log_formats,
+        help="Write progress messages as plain text or as one JSON object per line",
+    )
+    logging_group.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Also log the timing of each stage",
+    )
+    logging_group.add_argument(
+        "--profile",
+        type=Path,
+        help="Write the wall time, CPU time and peak RSS of each stage to this JSON file",
+    )
 
     args = argument_parser.parse_args()
 
+    # standard input can only be read once
+    stdin_inputs = [
+        x
+        for x in stdin_arguments
+        if getattr(args, x) is not None and is_stdin(getattr(args, x))
+    ]
+    if len(stdin_inputs) > 1:
+        argument_parser.error(
+            "only one input can be read from stdin, not " + ", ".join(stdin_inputs)
+        )
+    if stdin_inputs == ["annotation_file"] and (
+        args.busco_full_table is not None
+        or args.omark_detail is not None
+        or args.genome_file is not None
+    ):
+        argument_parser.error(
+            "the annotation file is read more than once with --busco_full_table, "
+            "--omark_detail or --genome_file, so it can't come from stdin"
+        )
+    if args.watch:
+        unwatchable = [
+            x
+            for x in stdin_arguments
+            if getattr(args, x) is not None
+            and (is_stdin(getattr(args, x)) or is_url(getattr(args, x)))
+        ]
+        if unwatchable:
+            argument_parser.error(
+                "--watch needs local input files, not stdin or URLs for "
+                + ", ".join(unwatchable)
+            )
+
     return args
 
 
-def main():
-    args = parse_arguments()
+def read_metadata(path_to_metadata):
+    # a JSON list of {"meta_key": ..., "meta_value": ...} objects, or a CSV
+    # with meta_key and meta_value columns (from the web interface)
+    with open_input(path_to_metadata, newline="") as f:
+        if get_uncompressed_name(path_to_metadata).lower().endswith(".csv"):
+            reader = csv.DictReader(f)
+            # spreadsheet programs often save CSV with a byte order mark
+            if reader.fieldnames:
+                reader.fieldnames[0] = reader.fieldnames[0].lstrip("\ufeff")
+            return list(reader)
+        return json.load(f)
+
+
+def parse_metadata(path_to_metadata):
+    all_metadata = {}
+    all_metadata["metadata_input_provided"] = True
+    logger.info("Parsing metadata")
+    metadata_input = read_metadata(path_to_metadata)
+    errors = check_metadata_rows(metadata_input)
+    if errors:
+        raise ValidationError(errors)
+    for dict in metadata_input:
+        key = dict["meta_key"]
+        value = dict["meta_value"]
+        all_metadata[key] = value
+    return all_metadata
+
 
-    path_to_template = Path(files(), "resources", "full_report_template.typ")
+def read_agat(path_to_agat, sections=None):
+    # with sections, only those parts of the YAML are loaded (see agat_yaml.py)
+    from atol_annotation_report.agat_yaml import load_sections, load_yaml
 
+    with open_input(path_to_agat) as f:
+        if sections is None:
+            return load_yaml(f)
+        return load_sections(f, sections)
+
+
+def parse_agat(path_to_agat):
+    logger.info("Parsing AGAT file")
+    sections = get_field_mapper("agat").get_section_paths()
+    return map_agat_stats(read_agat(path_to_agat, sections=sections))
+
+
+def parse_annotation(path_to_annotation):
+    from atol_annotation_report.gff_stats import calculate_agat_stats
+
+    logger.info("Calculating AGAT statistics from annotation file")
+    return map_agat_stats(calculate_agat_stats(path_to_annotation))
+
+
+def map_agat_stats(full_agat_input):
+    # TODO: parse and map AGAT software version and add to the field mappings
+    return get_field_mapper("agat").map(full_agat_input)
+
+
+def read_json(path_to_json):
+    with open_input(path_to_json) as f:
+        return json.load(f)
+
+
+def parse_busco(path_to_busco):
+    # parse BUSCO json and map to new field names
+    logger.info("Parsing BUSCO file")
+    return get_field_mapper("busco").map(read_json(path_to_busco))
+
+
+def parse_busco_full_table(path_to_full_table, path_to_annotation=None):
+    from atol_annotation_report.busco import summarise_full_table
+
+    logger.info("Parsing BUSCO full table")
+    sequence_map = None
+    if path_to_annotation is not None:
+        # protein mode hits are placed on sequences through the annotation
+        from atol_annotation_report.gff_stats import read_transcript_sequences
+
+        sequence_map = read_transcript_sequences(path_to_annotation)
+    return summarise_full_table(path_to_full_table, sequence_map=sequence_map)
+
+
+def parse_omark(path_to_omark):
+    # parse OMArk file and map to new field names
+    logger.info("Parsing OMArk file")
+    return get_field_mapper("omark").map(read_json(path_to_omark))
+
+
+def parse_omark_detail(path_to_detail, path_to_annotation):
+    from atol_annotation_report.omark import summarise_omark_detail
+
+    logger.info("Parsing OMArk per-protein files")
+    return summarise_omark_detail(path_to_detail, path_to_annotation)
+
+
+def read_annooddities(path_to_oddities):
+    with open_input(path_to_oddities) as f:
+        oddity_table = csv.reader(f, delimiter="\t")
+        next(oddity_table)  # take out the header
+        oddity_dict = {}
+        for row in oddity_table:
+            key = row[0]
+            value = int(row[1])
+            oddity_dict[key] = value
+    return oddity_dict
+
+
+def parse_annooddities(path_to_oddities):
+    # parse the annooddity summary file
+    logger.info("Parsing AnnoOddities file")
+    return map_oddities(read_annooddities(path_to_oddities))
+
+
+def parse_genome_oddities(path_to_annotation, path_to_genome, threads=1):
+    from atol_annotation_report.oddities import calculate_oddities
+
+    logger.info("Calculating AnnoOddities checks from annotation and genome files")
+    return map_oddities(
+        calculate_oddities(path_to_annotation, path_to_genome, threads=threads)
+    )
+
+
+def map_oddities(oddity_dict):
+    all_oddities, _ = get_field_mapper("annooddities").map(oddity_dict)
+    return all_oddities
+
+
+def get_template_path():
+    from importlib.resources import files
+
+    return Path(
+        files("atol_annotation_report"), "resources", "full_report_template.typ"
+    )
+
+
+def run_parser(
+    cache, profiler, kind, input_files, parser, *parser_args, **parser_kwargs
+):
+    # with a cache, a parsed block is reused until one of its input files
+    # changes. stdin can't be hashed without consuming it, so it isn't cached
+    with profiler.stage(kind):
+        if cache is None or any(is_stdin(x) for x in input_files):
+            return parser(*parser_args, **parser_kwargs)
+        return cache.get_block(
+            kind, input_files, lambda: parser(*parser_args, **parser_kwargs)
+        )
+
+
+def collect_stats(
+    metadata_file=None,
+    agat_file=None,
+    annotation_file=None,
+    busco_file=None,
+    busco_full_table=None,
+    omark_file=None,
+    omark_detail=None,
+    annooddities_file=None,
+    genome_file=None,
+    threads=1,
+    cache=None,
+    profiler=None,
+    validate=True,
+    strict_validation=False,
+):
+    if profiler is None:
+        profiler = StageProfiler()
     # this dictionary will contain a json "annotation" object which can be inserted into the atol genome-note-lite input.
     stats_for_gnl = {}
 
-    all_metadata = {}
-    if args.metadata_file is not None:
-        path_to_metadata = args.metadata_file
-        all_metadata["metadata_input_provided"] = True
-        print("Parsing metadata")
-        with open(path_to_metadata, "rt") as f:
-            metadata_input = json.load(f)
-            for dict in metadata_input:
-                key = dict["meta_key"]
-                value = dict["meta_value"]
-                all_metadata[key] = value
+    if metadata_file is not None:
+        all_metadata = run_parser(
+            cache, profiler, "metadata", [metadata_file], parse_metadata, metadata_file
+        )
+        # checked before the tool outputs are parsed, and also on cache hits
+        if validate and strict_validation:
+            with profiler.stage("validate metadata"):
+                errors = get_schema("metadata").validate(all_metadata)
+            if errors:
+                raise ValidationError(errors)
     else:
-        print("No metadata file specified")
-        all_metadata["metadata_input_provided"] = False
-
-    all_agat_stats = {}
-    if args.agat_file is not None:
-        path_to_agat = args.agat_file
-        # define mappings from agat yaml input to annotation schema fields
-        key_agat_mappings = {
-            "gene_count": "Number of gene",
-            "cds_count": "Number of cds",
-            "transcript_count": "Number of transcript",
-            "mrna_count": "Number of mrna",
-            "mean_transcript_length": "mean transcript length (bp)",
-            "mean_mrna_length": "mean mrna length (bp)",
-            "mean_transcripts_per_gene": "mean transcripts per gene",
-            "mean_mrnas_per_gene": "mean mrnas per gene",
-            "mean_exons_per_transcript": "mean exons per transcript",
-            "mean_exons_per_mrna": "mean exons per mrna",
-        }
-        additional_agat_mappings = {
-            "exon_count": "Number of exon",
-            "mean_exon_length": "mean exon length (bp)",
-            "mean_gene_length": "mean gene length (bp)",
-            "total_gene_length": "Total gene length (bp)",
-            "total_transcript_length": "Total transcript length (bp)",
-            "total_mrna_length": "Total mrna length (bp)",
-        }
-        full_stat_agat_mappings = {
-            "intron_count": "Number of intron",
-            "single_exon_gene_count": "Number of single exon gene",
-            "single_exon_transcript_count": "Number of single exon transcript",
-            "single_exon_mrna_count": "Number of single exon mrna",
-        }
-        mean_stat_agat_mappings = {
-            "mean_cds_length": "mean cds length (bp)",
-            "mean_intron_length": "mean intron length (bp)",
-            "mean_cdss_per_transcript": "mean cdss per transcript",
-            "mean_cdss_per_mrna": "mean cdss per mrna",
-            "mean_exons_per_cds": "mean exons per cds",
-            "mean_introns_per_transcript": "mean introns per transcript",
-        }
-        median_stat_agat_mappings = {
-            "median_gene_length": "median gene length (bp)",
-            "median_transcript_length": "median transcript length (bp)",
-            "median_mrna_length": "median mrna length (bp)",
-            "median_exon_length": "median exon length (bp)",
-            "median_cds_length": "median cds length (bp)",
-            "median_intron_length": "median intron length (bp)",
-        }
-        long_short_agat_mappings = {
-            "longest_gene": "Longest gene (bp)",
-            "longest_transcript": "Longest transcript (bp)",
-            "longest_mrna": "Longest mrna (bp)",
-            "longest_exon": "Longest exon (bp)",
-            "longest_cds": "Longest cds (bp)",
-            "longest_intron": "Longest intron (bp)",
-            "shortest_gene": "Shortest gene (bp)",
-            "shortest_transcript": "Shortest transcript (bp)",
-            "shortest_mrna": "Shortest mrna (bp)",
-        }
-        length_agat_mappings = {
-            "total_cds_length": "Total cds length (bp)",
-            "total_exon_length": "Total exon length (bp)",
-            "total_intron_length": "Total intron length (bp)",
-        }
-        # TODO: parse and map AGAT software version and add to key_agat_mappings
-        # parse AGAT yaml and map to new field names
-        all_agat_stats["agat_input_provided"] = True
-        print("Parsing AGAT file")
-        with open(path_to_agat, "rt") as f:
-            key_agat_stats = {}
-            full_agat_input = yaml.load(f, Loader=yaml.SafeLoader)
-            if "transcript" in full_agat_input:
-                transcript_stats = full_agat_input["transcript"]
-                key_agat_stats["feature_stats_calculated_for"] = (
-                    "transcripts (without isoforms)"
-                )
-                if "without_isoforms" in transcript_stats:
-                    agat_stats_input = transcript_stats["without_isoforms"]["value"]
-                elif "without_isoform" in transcript_stats:
-                    agat_stats_input = transcript_stats["without_isoform"]["value"]
-                else:
-                    print(
-                        "AGAT stats for transcripts without isoform not found, looking for stats for mRNAs"
-                    )
-            elif "mrna" in full_agat_input:
-                mrna_stats = full_agat_input["mrna"]
-                key_agat_stats["feature_stats_calculated_for"] = (
-                    "mRNAs (without isoforms)"
-                )
-                if "without_isoforms" in mrna_stats:
-                    agat_stats_input = mrna_stats["without_isoforms"]["value"]
-                elif "without_isoform" in mrna_stats:
-                    agat_stats_input = mrna_stats["without_isoform"]["value"]
-                else:
-                    print("AGAT stats mRNAs without isoform stats not found")
-            else:
-                print("error: no transcript or mRNA stats detected in AGAT yaml file")
-            for reporting_field, agat_field in key_agat_mappings.items():
-                if agat_field in agat_stats_input:
-                    key_agat_stats[reporting_field] = agat_stats_input[agat_field]
-            all_agat_stats.update(key_agat_stats)
-            for reporting_field, agat_field in additional_agat_mappings.items():
-                if agat_field in agat_stats_input:
-                    all_agat_stats[reporting_field] = agat_stats_input[agat_field]
-            for reporting_field, agat_field in full_stat_agat_mappings.items():
-                if agat_field in agat_stats_input:
-                    all_agat_stats[reporting_field] = agat_stats_input[agat_field]
-            for reporting_field, agat_field in mean_stat_agat_mappings.items():
-                if agat_field in agat_stats_input:
-                    all_agat_stats[reporting_field] = agat_stats_input[agat_field]
-            for reporting_field, agat_field in median_stat_agat_mappings.items():
-                if agat_field in agat_stats_input:
-                    all_agat_stats[reporting_field] = agat_stats_input[agat_field]
-            for reporting_field, agat_field in long_short_agat_mappings.items():
-                if agat_field in agat_stats_input:
-                    all_agat_stats[reporting_field] = agat_stats_input[agat_field]
-            for reporting_field, agat_field in length_agat_mappings.items():
-                if agat_field in agat_stats_input:
-                    all_agat_stats[reporting_field] = agat_stats_input[agat_field]
-        for key, value in key_agat_mappings.items():
-            if key not in all_agat_stats.keys():
-                all_agat_stats[key] = "N/A"
-        for key, value in additional_agat_mappings.items():
-            if key not in all_agat_stats.keys():
-                all_agat_stats[key] = "N/A"
-        for key, value in full_stat_agat_mappings.items():
-            if key not in all_agat_stats.keys():
-                all_agat_stats[key] = "N/A"
-        for key, value in mean_stat_agat_mappings.items():
-            if key not in all_agat_stats.keys():
-                all_agat_stats[key] = "N/A"
-        for key, value in median_stat_agat_mappings.items():
-            if key not in all_agat_stats.keys():
-                all_agat_stats[key] = "N/A"
-        for key, value in long_short_agat_mappings.items():
-            if key not in all_agat_stats.keys():
-                all_agat_stats[key] = "N/A"
-        for key, value in length_agat_mappings.items():
-            if key not in all_agat_stats.keys():
-                all_agat_stats[key] = "N/A"
-        # agat_output = {'agat':all_agat_stats}
+        logger.info("No metadata file specified")
+        all_metadata = {"metadata_input_provided": False}
+
+    if agat_file is not None:
+        all_agat_stats, key_agat_stats = run_parser(
+            cache, profiler, "agat", [agat_file], parse_agat, agat_file
+        )
+        stats_for_gnl.update(key_agat_stats)
+    elif annotation_file is not None:
+        all_agat_stats, key_agat_stats = run_parser(
+            cache,
+            profiler,
+            "annotation agat",
+            [annotation_file],
+            parse_annotation,
+            annotation_file,
+        )
         stats_for_gnl.update(key_agat_stats)
     else:
-        print("No AGAT file specified")
-        all_agat_stats["agat_input_provided"] = False
+        logger.info("No AGAT file specified")
+        all_agat_stats = {"agat_input_provided": False}
     agat_output = {"agat": all_agat_stats}
 
-    all_busco_stats = {}
-    if args.busco_file is not None:
-        path_to_busco = args.busco_file
-        # define mappings from BUSCO json input to annotation schema fields
-        parameter_busco_mappings = {"mode": "mode", "gene_predictor": "gene_predictor"}
-        lineage_busco_mappings = {"lineage_name": "name"}
-        version_busco_mappings = {
-            "version_busco": "busco",
-            "version_hmmsearch": "hmmsearch",
-            "version_metaeuk": "metaeuk",
-            "version_augustus": "augustus",
-            "version_miniprot": "miniprot",
-        }
-        result_busco_mappings = {
-            "one_line_summary": "one_line_summary",
-            "n_markers": "n_markers",
-            "domain": "domain",
-        }
-        # these are mappings from the annotation schema to the atol schema
-        key_busco_mappings = {
-            "annot_busco_mode": "mode",
-            "annot_busco_lineage": "lineage_name",
-            "annot_busco_summary": "one_line_summary",
-            "annot_busco_version": "version_busco",
-        }
-        all_busco_stats["busco_input_provided"] = True
-        # parse BUSCO json and map to new field names
-        print("Parsing BUSCO file")
-        with open(path_to_busco, "rt") as f:
-            key_busco_stats = {}
-            all_busco_input = json.load(f)
-            busco_param_info = all_busco_input["parameters"]
-            busco_lineage_info = all_busco_input["lineage_dataset"]
-            busco_version_info = all_busco_input["versions"]
-            busco_result_info = all_busco_input["results"]
-            for reporting_field, busco_field in parameter_busco_mappings.items():
-                if busco_field in busco_param_info:
-                    all_busco_stats[reporting_field] = busco_param_info[busco_field]
-            for reporting_field, busco_field in lineage_busco_mappings.items():
-                all_busco_stats[reporting_field] = busco_lineage_info[busco_field]
-            for reporting_field, busco_field in version_busco_mappings.items():
-                if busco_field in busco_version_info:
-                    all_busco_stats[reporting_field] = busco_version_info[busco_field]
-            for busco_result_field, busco_result_value in busco_result_info.items():
-                if busco_result_field in ["Complete percentage", "Complete"]:
-                    all_busco_stats["complete_percent"] = busco_result_value
-                elif busco_result_field in ["Single copy percentage", "Single copy"]:
-                    all_busco_stats["single_copy_percent"] = busco_result_value
-                elif busco_result_field in ["Multi copy percentage", "Multi copy"]:
-                    all_busco_stats["duplicated_percent"] = busco_result_value
-                elif busco_result_field in ["Fragmented percentage", "Fragmented"]:
-                    all_busco_stats["fragmented_percent"] = busco_result_value
-                elif busco_result_field in ["Missing percentage", "Missing"]:
-                    all_busco_stats["missing_percent"] = busco_result_value
-                else:
-                    for reporting_field, busco_field in result_busco_mappings.items():
-                        all_busco_stats[reporting_field] = busco_result_info[
-                            busco_field
-                        ]
-            for atol_field, reporting_field in key_busco_mappings.items():
-                key_busco_stats[atol_field] = all_busco_stats[reporting_field]
-        for key, value in parameter_busco_mappings.items():
-            if key not in all_busco_stats.keys():
-                all_busco_stats[key] = "N/A"
-        for key, value in lineage_busco_mappings.items():
-            if key not in all_busco_stats.keys():
-                all_busco_stats[key] = "N/A"
-        for key, value in version_busco_mappings.items():
-            if key not in all_busco_stats.keys():
-                all_busco_stats[key] = "N/A"
-        for key, value in result_busco_mappings.items():
-            if key not in all_busco_stats.keys():
-                all_busco_stats[key] = "N/A"
-        for key, value in result_busco_mappings.items():
-            if key not in all_busco_stats.keys():
-                all_busco_stats[key] = "N/A"
+    if busco_file is not None:
+        all_busco_stats, key_busco_stats = run_parser(
+            cache, profiler, "busco", [busco_file], parse_busco, busco_file
+        )
         stats_for_gnl.update(key_busco_stats)
+        if busco_full_table is not None:
+            full_table_inputs = [busco_full_table]
+            if annotation_file is not None:
+                full_table_inputs.append(annotation_file)
+            all_busco_stats |= run_parser(
+                cache,
+                profiler,
+                "busco full_table",
+                full_table_inputs,
+                parse_busco_full_table,
+                *full_table_inputs,
+            )
     else:
-        print("No BUSCO file specified")
-        all_busco_stats["busco_input_provided"] = False
+        logger.info("No BUSCO file specified")
+        all_busco_stats = {"busco_input_provided": False}
+        if busco_full_table is not None:
+            logger.warning(
+                "Ignoring the BUSCO full table, because it needs --busco_file"
+            )
     busco_output = {"busco": all_busco_stats}
 
-    all_omark_stats = {}
-    if args.omark_file is not None:
-        path_to_omark = args.omark_file
-        # define mappings from omark output
-        omark_key_mappings = {
-            "omark_percent_consistent": "consistent",
-            "omark_percent_inconsistent": "inconsistent",
-            "omark_percent_contaminant": "likely_contamination",
-            "omark_percent_unknown": "unknown",
-        }
-        omark_info_mappings = {
-            "omark_lineage": "selected_clade",
-            "conserved_hogs": "conserved_hogs",
-            "omark_protein_count": "proteins_in_proteome",
-            "omamer_version": "omamer_version",
-            "omamer_db_version": "db_version",
-            "omark_completeness_summary": "conserv_pcts_raw",
-            "omark_consistency_summary": "results_pcts_raw",
-        }
-        omark_conserved_hog_mappings = {
-            "single_hog_percent": "single",
-            "duplicated_hog_percent": "duplicated",
-            "unexpected_dup_hog_percent": "duplicated_unexpected",
-            "expected_dup_hog_percent": "duplicated_expected",
-            "missing_hog_percent": "missing",
-        }
-        omark_consistency_mappings = {
-            "percent_consistent_partial": "consistent_partial_hits",
-            "percent_consistent_fragments": "consistent_fragmented",
-            "percent_inconsistent_partial": "inconsistent_partial_hits",
-            "percent_inconsistent_fragments": "inconsistent_fragmented",
-            "percent_contaminant_partial": "likely_contamination_partial_hits",
-            "percent_contaminant_fragments": "likely_contamination_fragmented",
-        }
-        all_omark_stats["omark_input_provided"] = True
-        # parse OMArk file and map to new field names
-        print("Parsing OMArk file")
-        with open(path_to_omark, "rt") as f:
-            key_omark_stats = {}
-            all_omark_stats["detected_sp"] = []
-            all_omark_stats["contaminant_sp"] = []
-            all_omark_input = json.load(f)
-            omark_hogs = all_omark_input["conserv_pcts"]
-            omark_consistency = all_omark_input["results_pcts"]
-            omark_spp = all_omark_input["detected_species"]
-            for reporting_field, omark_field in omark_info_mappings.items():
-                all_omark_stats[reporting_field] = all_omark_input[omark_field]
-            for reporting_field, omark_field in omark_key_mappings.items():
-                all_omark_stats[reporting_field] = omark_consistency[omark_field]
-            key_omark_stats.update(all_omark_stats)
-            for reporting_field, omark_field in omark_consistency_mappings.items():
-                all_omark_stats[reporting_field] = omark_consistency[omark_field]
-            for reporting_field, omark_field in omark_conserved_hog_mappings.items():
-                all_omark_stats[reporting_field] = omark_hogs[omark_field]
-            for spp in range(len(omark_spp)):
-                if "Clade" in (omark_spp[spp]):
-                    all_omark_stats["detected_sp"].append(omark_spp[spp])
-                elif "Potential_contaminants" in (omark_spp[spp]):
-                    all_omark_stats["contaminant_sp"].append(omark_spp[spp])
-        for key, value in omark_key_mappings.items():
-            if key not in all_omark_stats.keys():
-                all_omark_stats[key] = "N/A"
-        for key, value in omark_info_mappings.items():
-            if key not in all_omark_stats.keys():
-                all_omark_stats[key] = "N/A"
-        for key, value in omark_conserved_hog_mappings.items():
-            if key not in all_omark_stats.keys():
-                all_omark_stats[key] = "N/A"
-        for key, value in omark_consistency_mappings.items():
-            if key not in all_omark_stats.keys():
-                all_omark_stats[key] = "N/A"
-        if all_omark_stats["detected_sp"] == []:
-            all_omark_stats["detected_sp"].append("N/A")
-        if all_omark_stats["contaminant_sp"] == []:
-            all_omark_stats["contaminant_sp"].append("N/A")
+    if omark_file is not None:
+        all_omark_stats, key_omark_stats = run_parser(
+            cache, profiler, "omark", [omark_file], parse_omark, omark_file
+        )
         stats_for_gnl.update(key_omark_stats)
+        if omark_detail is not None and annotation_file is not None:
+            from atol_annotation_report.omark import find_detail_files
+
+            detail_files = [x for x, _ in find_detail_files(omark_detail)]
+            all_omark_stats |= run_parser(
+                cache,
+                profiler,
+                "omark detail",
+                [annotation_file, *detail_files],
+                parse_omark_detail,
+                omark_detail,
+                annotation_file,
+            )
+        elif omark_detail is not None:
+            logger.warning(
+                "Ignoring the OMArk per-protein files, because they need "
+                "--annotation_file"
+            )
     else:
-        print("No OMArk file specified")
-        all_omark_stats["omark_input_provided"] = False
+        logger.info("No OMArk file specified")
+        all_omark_stats = {"omark_input_provided": False}
+        if omark_detail is not None:
+            logger.warning(
+                "Ignoring the OMArk per-protein files, because they need --omark_file"
+            )
     omark_output = {"omark": all_omark_stats}
 
-    all_oddities = {}
-    if args.annooddities_file is not None:
-        path_to_oddities = args.annooddities_file
-        # define mappings from annooddity output
-        oddity_mappings = {
-            "single_exon_transcripts": "exon_num == 1",
-            "multi_exon_transcripts": "exon_num > 1",
-            "five_utr_above_10000bp": "five_utr_length > 10000",
-            "five_utr_num_above_5": "five_utr_num > 5",
-            "three_utr_above_10000bp": "three_utr_length > 10000",
-            "three_utr_num_above_4": "three_utr_num > 4",
-            "incomplete_transcripts": "not is_complete",
-            "missing_start_codon": "not has_start_codon",
-            "missing_stop_codon": "not has_stop_codon",
-            "fragmented": "is_fragment",
-            "has_inframe_stop_codons": "has_inframe_stop",
-            "max_exon_above_10000bp": "max_exon_length > 10000",
-            "max_intron_above_120000bp": "max_intron_length > 120000",
-            "min_exon_below_5bp": "min_exon_length <= 5",
-            "min_intron_bw_0_and_5bp": "0 < min_intron_length <= 5",
-            "cds_fraction_below_30pc": "selected_cds_fraction <= 0.3",
-            "has_non_canonical_introns": "canonical_intron_proportion != 1",
-            "only_non_canonical_splicing": "only_non_canonical_splicing",
-            "has_suspicious_splicing": "suspicious_splicing",
-        }
-        all_oddities["annooddities_input_provided"] = True
-        # parse the annooddity summary file
-        print("Parsing AnnoOddities file")
-        with open(path_to_oddities, "rt") as f:
-            oddity_table = csv.reader(f, delimiter="\t")
-            next(oddity_table)  # take out the header
-            oddity_dict = {}
-            for row in oddity_table:
-                key = row[0]
-                value = int(row[1])
-                oddity_dict[key] = value
-            for reporting_field, oddity_field in oddity_mappings.items():
-                all_oddities[reporting_field] = oddity_dict[oddity_field]
-        for key, value in oddity_mappings.items():
-            if key not in all_oddities.keys():
-                all_oddities[key] = "N/A"
+    if annooddities_file is not None:
+        all_oddities = run_parser(
+            cache,
+            profiler,
+            "annooddities",
+            [annooddities_file],
+            parse_annooddities,
+            annooddities_file,
+        )
+    elif annotation_file is not None and genome_file is not None:
+        all_oddities = run_parser(
+            cache,
+            profiler,
+            "annotation annooddities",
+            [annotation_file, genome_file],
+            parse_genome_oddities,
+            annotation_file,
+            genome_file,
+            threads=threads,
+        )
     else:
-        print("No AnnoOddities file specified")
-        all_oddities["annooddities_input_provided"] = False
+        logger.info("No AnnoOddities file specified")
+        all_oddities = {"annooddities_input_provided": False}
     oddity_output = {"annooddities": all_oddities}
 
-    with open(args.json_atol, "w", encoding="utf-8") as f:
-        output_for_gnl = {"annotation": stats_for_gnl}
-        json.dump(output_for_gnl, f)
+    with profiler.stage("merge"):
+        combined_stats = (
+            all_metadata | agat_output | busco_output | omark_output | oddity_output
+        )
 
-    print("Combining statistics and writing to JSON")
-    combined_stats = (
-        all_metadata | agat_output | busco_output | omark_output | oddity_output
-    )
+    if validate:
+        with profiler.stage("validate"):
+            errors = validate_blocks(combined_stats)
+        if errors:
+            raise ValidationError(errors)
+
+    return stats_for_gnl, combined_stats
+
+
+def render_report(combined_stats, output_file, renderer=None, package_path=None):
+    # populate typst template with json data. a renderer that already has the
+    # template loaded (see render.py) can be passed in to skip the cold compile.
+    logger.info("Rendering typst template")
+    if renderer is None:
+        import typst
 
-    with open(args.json_full, "w", encoding="utf-8") as f:
-        json.dump(combined_stats, f)
+        full_results = {"full_results": json.dumps(combined_stats)}
+        typst.compile(
+            input=get_template_path(),
+            output=output_file,
+            sys_inputs=full_results,
+            package_path=package_path,
+        )
+    else:
+        renderer.render(combined_stats, output_file)
+
+
+def render_preview(
+    combined_stats, format="png", ppi=None, renderer=None, package_path=None
+):
+    # returns the first page of the report as PNG or SVG bytes. a renderer
+    # that can render pages (ReportRenderer or DaemonRenderer) reuses its warm
+    # compiler
+    from atol_annotation_report.render import get_first_page
+
+    logger.info(f"Rendering {format.upper()} preview")
+    if hasattr(renderer, "render_first_page"):
+        return renderer.render_first_page(combined_stats, format=format, ppi=ppi)
+    import typst
 
-    # populate typst template with json dataa
     full_results = {"full_results": json.dumps(combined_stats)}
+    return get_first_page(
+        typst.compile(
+            input=get_template_path(),
+            format=format,
+            ppi=ppi,
+            sys_inputs=full_results,
+            package_path=package_path,
+        )
+    )
 
-    print("Rendering typst template")
 
-    typst.compile(
-        input=path_to_template, output=args.output_file, sys_inputs=full_results
+def generate_report(args, renderer=None, package_path=None, cache=None, profiler=None):
+    if profiler is None:
+        profiler = StageProfiler()
+    stats_for_gnl, combined_stats = collect_stats(
+        metadata_file=args.metadata_file,
+        agat_file=args.agat_file,
+        annotation_file=args.annotation_file,
+        busco_file=args.busco_file,
+        busco_full_table=args.busco_full_table,
+        omark_file=args.omark_file,
+        omark_detail=args.omark_detail,
+        annooddities_file=args.annooddities_file,
+        genome_file=args.genome_file,
+        threads=args.threads,
+        cache=cache,
+        profiler=profiler,
+        validate=not getattr(args, "no_validation", False),
+        strict_validation=getattr(args, "strict_validation", False),
     )
 
-    print(
-        "AToL Annotation Report Tool completed. Report available as PDF ("
-        + str(args.output_file)
-        + ") and JSON ("
-        + str(args.json_full)
-        + ")"
+    outputs = []
+
+    if "json_atol" in args.formats:
+        with profiler.stage("json_atol"):
+            with open(args.json_atol, "w", encoding="utf-8") as f:
+                output_for_gnl = {"annotation": stats_for_gnl}
+                json.dump(output_for_gnl, f)
+        outputs.append("AToL JSON (" + str(args.json_atol) + ")")
+
+    if "json_full" in args.formats:
+        logger.info("Combining statistics and writing to JSON")
+        with profiler.stage("json_full"):
+            with open(args.json_full, "w", encoding="utf-8") as f:
+                json.dump(combined_stats, f)
+        outputs.append("JSON (" + str(args.json_full) + ")")
+
+    # the previews are written before the PDF, so they are ready while it
+    # renders
+    if "html" in args.formats:
+        with profiler.stage("html"):
+            write_html_summary(combined_stats, args.html)
+        outputs.append("HTML (" + str(args.html) + ")")
+
+    for output_format, argument in preview_formats.items():
+        if output_format not in args.formats:
+            continue
+        output_file = getattr(args, argument)
+        with profiler.stage(output_format):
+            preview = render_preview(
+                combined_stats,
+                format=output_format,
+                ppi=getattr(args, "preview_ppi", None),
+                renderer=renderer,
+                package_path=package_path,
+            )
+            write_atomic(output_file, preview)
+        outputs.append(output_format.upper() + " preview (" + str(output_file) + ")")
+
+    if "pdf" in args.formats:
+        with profiler.stage("pdf"):
+            # a PDF is only cached when we know which template renders it
+            if renderer is None:
+                path_to_template = get_template_path()
+            else:
+                path_to_template = renderer.path_to_template
+            if cache is not None and path_to_template is not None:
+                pdf_key = cache.pdf_key(path_to_template, combined_stats)
+                pdf_cached = cache.get_pdf(pdf_key, args.output_file)
+            else:
+                pdf_key = None
+                pdf_cached = False
+            if not pdf_cached:
+                render_report(
+                    combined_stats,
+                    args.output_file,
+                    renderer=renderer,
+                    package_path=package_path,
+                )
+                if pdf_key is not None:
+                    cache.put_pdf(pdf_key, args.output_file)
+        outputs.insert(0, "PDF (" + str(args.output_file) + ")")
+
+    logger.info(
+        "AToL Annotation Report Tool completed. Report available as "
+        + ", ".join(outputs)
+    )
+
+
+def log_validation_errors(errors, path_to_report=None):
+    for error in errors:
+        logger.error(format_error(error))
+    if path_to_report is not None:
+        with open(path_to_report, "w", encoding="utf-8") as f:
+            json.dump({"valid": False, "errors": errors}, f, indent=2)
+    logger.error(
+        f"Validation failed with {len(errors)} errors, so no report was written"
     )
 
 
+def main():
+    args = parse_arguments()
+    setup_logging(args.log_format, verbose=args.verbose)
+    if args.no_pdf and "pdf" in args.formats:
+        args.formats.remove("pdf")
+    for prefix, directory in args.input_mirror:
+        add_mirror(prefix, directory)
+
+    cache = None
+    if not args.no_cache:
+        from atol_annotation_report.cache import ResultCache
+
+        cache = ResultCache(args.cache_dir, max_mb=args.cache_max_mb)
+
+    renderer = None
+    if args.render_socket is not None:
+        from atol_annotation_report.render import DaemonRenderer
+
+        renderer = DaemonRenderer(args.render_socket)
+
+    if args.watch:
+        from atol_annotation_report.watch import watch
+
+        # one warm compiler for every rebuild
+        if renderer is None and {"pdf", "png", "svg"} & set(args.formats):
+            from atol_annotation_report.render import ReportRenderer
+
+            renderer = ReportRenderer(package_path=args.package_cache)
+        watch(args, renderer=renderer, cache=cache)
+        return
+
+    profiler = StageProfiler()
+    try:
+        generate_report(
+            args,
+            renderer=renderer,
+            package_path=args.package_cache,
+            cache=cache,
+            profiler=profiler,
+        )
+    except ValidationError as e:
+        log_validation_errors(e.errors, args.validation_report)
+        sys.exit(1)
+    if args.profile is not None:
+        profiler.write(args.profile)
+
+
 if __name__ == "__main__":
     main()
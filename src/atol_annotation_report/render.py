@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+# this keeps a typst compiler warm so many reports can be rendered against
+# the same template. typst.compile pays for font discovery, template parsing
+# and package resolution on every call, even though only the full_results
+# input changes between reports.
+#
+# ReportRenderer is the in-process version. serve() wraps one in a daemon
+# listening on a Unix socket, and DaemonRenderer is the matching client.
+# all three renderers have the same render(combined_stats, output_file) method,
+# and ReportRenderer and DaemonRenderer can also render the first page as an
+# image for previews.
+#
+# the warm compiler takes the report data as sys_inputs for each compile,
+# which typst-py only accepts from 0.14.5 (keep min_typst_version in step with
+# pyproject.toml).
+#
+# the daemon protocol is one JSON object per line in each direction.
+# request: {"full_results": {...}, "output_file": "path/to/report.pdf"}
+# response: {"status": "success", "output_file": "..."} or
+#           {"status": "error", "message": "..."}
+# preview request: {"full_results": {...}, "format": "png" or "svg",
+#                   "ppi": ...}
+# response: {"status": "success", "preview": "<base64 image>"} or an error
+#
+# the daemon writes the PDF to whatever path a client sends, as the user
+# running it. the socket is created readable and writable by that user only,
+# so only their own processes can connect. don't loosen its permissions or
+# put it where other users could replace it. on start, only a stale socket
+# (one that refuses connections) is removed from the path.
+
+from pathlib import Path
+import argparse
+import base64
+import json
+import logging
+import os
+import re
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+
+from atol_annotation_report.profiling import setup_logging
+from atol_annotation_report.python_reporter import get_template_path
+
+logger = logging.getLogger(__name__)
+
+min_typst_version = "0.14.5"
+
+
+def get_version_tuple(version):
+    return tuple(int(x) for x in re.findall(r"\d+", version)[:3])
+
+
+def check_typst_version():
+    from importlib.metadata import version
+
+    installed = version("typst")
+    if get_version_tuple(installed) < get_version_tuple(min_typst_version):
+        raise RuntimeError(
+            f"Rendering with a warm compiler needs typst>={min_typst_version}, "
+            f"but typst {installed} is installed"
+        )
+    return installed
+
+
+def get_first_page(pages):
+    # typst returns a list of images for a document with several pages
+    return pages[0] if isinstance(pages, list) else pages
+
+
+class ReportRenderer:
+    def __init__(self, path_to_template=None, package_path=None):
+        import typst
+
+        check_typst_version()
+        if path_to_template is None:
+            path_to_template = get_template_path()
+        self.path_to_template = path_to_template
+        # with a package_path the compiler resolves @namespace/name:version
+        # imports from that directory and never goes to the network
+        self.compiler = typst.Compiler(path_to_template, package_path=package_path)
+        # a typst compiler is not safe to share between threads
+        self.lock = threading.Lock()
+
+    def render(self, combined_stats, output_file=None, format="pdf"):
+        full_results = {"full_results": json.dumps(combined_stats)}
+        with self.lock:
+            return self.compiler.compile(
+                output=output_file, format=format, sys_inputs=full_results
+            )
+
+    def render_first_page(self, combined_stats, format="png", ppi=None):
+        # returns the first page as PNG or SVG bytes
+        full_results = {"full_results": json.dumps(combined_stats)}
+        with self.lock:
+            pages = self.compiler.compile(
+                format=format, ppi=ppi, sys_inputs=full_results
+            )
+        return get_first_page(pages)
+
+
+class DaemonRenderer:
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        # the daemon may have been started with a different template
+        self.path_to_template = None
+
+    def send(self, request):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(str(self.socket_path))
+            s.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with s.makefile("rb") as f:
+                response = json.loads(f.readline())
+        if response["status"] != "success":
+            raise RuntimeError(
+                "Render daemon failed to render report: " + response["message"]
+            )
+        return response
+
+    def render(self, combined_stats, output_file):
+        self.send(
+            {
+                "full_results": combined_stats,
+                "output_file": str(Path(output_file).resolve()),
+            }
+        )
+
+    def render_first_page(self, combined_stats, format="png", ppi=None):
+        response = self.send(
+            {"full_results": combined_stats, "format": format, "ppi": ppi}
+        )
+        return base64.b64decode(response["preview"])
+
+
+class RenderRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if "output_file" in request:
+                    self.server.renderer.render(
+                        request["full_results"], request["output_file"]
+                    )
+                    response = {
+                        "status": "success",
+                        "output_file": request["output_file"],
+                    }
+                else:
+                    preview = self.server.renderer.render_first_page(
+                        request["full_results"],
+                        format=request["format"],
+                        ppi=request.get("ppi"),
+                    )
+                    response = {
+                        "status": "success",
+                        "preview": base64.b64encode(preview).decode("ascii"),
+                    }
+            except Exception as e:
+                response = {"status": "error", "message": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class RenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, renderer):
+        self.renderer = renderer
+        # the socket is created with mode 0600 (see the top of this file)
+        umask = os.umask(0o177)
+        try:
+            super().__init__(str(socket_path), RenderRequestHandler)
+        finally:
+            os.umask(umask)
+
+
+def stop_daemon(signum, frame):
+    raise KeyboardInterrupt
+
+
+def remove_stale_socket(socket_path):
+    # a socket left behind by a daemon that didn't stop cleanly refuses
+    # connections and is removed. anything else at the path, including the
+    # socket of a running daemon, is left alone. returns False if the path
+    # can't be used
+    if not os.path.lexists(socket_path):
+        return True
+    if not stat.S_ISSOCK(socket_path.lstat().st_mode):
+        logger.error(f"{socket_path} exists and is not a socket")
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+        except ConnectionRefusedError:
+            logger.info(f"Removing the stale socket {socket_path}")
+            socket_path.unlink()
+            return True
+        except OSError as e:
+            logger.error(f"Can't check the socket {socket_path}: {e}")
+            return False
+    logger.error(f"Another render daemon is listening on {socket_path}")
+    return False
+
+
+def serve(socket_path, path_to_template=None, package_path=None):
+    socket_path = Path(socket_path)
+    if not remove_stale_socket(socket_path):
+        sys.exit(1)
+
+    logger.info("Loading typst template")
+    renderer = ReportRenderer(path_to_template, package_path=package_path)
+
+    # treat SIGTERM from a job scheduler or service manager like Ctrl-C
+    signal.signal(signal.SIGTERM, stop_daemon)
+
+    with RenderServer(socket_path, renderer) as server:
+        logger.info(f"Render daemon listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Render daemon stopping")
+        finally:
+            os.unlink(socket_path)
+
+
+def parse_arguments():
+
+    argument_parser = argparse.ArgumentParser(
+        description="Run a local daemon that keeps the typst report template loaded and renders reports sent to it over a Unix socket",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    argument_parser.add_argument(
+        "-s",
+        "--socket",
+        default=Path("atol-annotation-report.sock"),
+        type=Path,
+        help="Path to the Unix socket to listen on. Only the user running the daemon can connect to it",
+    )
+    argument_parser.add_argument(
+        "--template",
+        type=Path,
+        help="Path to the typst template (default: the bundled full report template)",
+    )
+    argument_parser.add_argument(
+        "--package_cache",
+        type=Path,
+        help="A local directory of typst packages (laid out as <namespace>/<name>/<version>) to resolve template imports from instead of downloading them",
+    )
+
+    args = argument_parser.parse_args()
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+    setup_logging()
+    serve(args.socket, args.template, package_path=args.package_cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+// Page styling
+#set page(
+  paper: "a4",
+  flipped: true,
+  margin: (x: 1.8cm, y: 1.5cm),
+)
+
+#set text(
+  size: 11pt
+)
+
+#set par(
+  justify: true,
+  leading: 0.52em,
+)
+
+// Load comparison data
+#let cmp = json(bytes(sys.inputs.comparison))
+#let n = cmp.labels.len()
+#let reference_index = cmp.labels.position(l => l == cmp.reference)
+
+#let fmt(x) = if x == none { "–" } else if type(x) == float { str(calc.round(x, digits: 2)) } else { str(x) }
+#let fmt_delta(x) = if x == none { "" } else if x > 0 { "+" + fmt(x) } else { fmt(x) }
+
+// One table cell: the value, its difference from the reference and its rank
+#let metric_cell(m, i) = {
+  [#fmt(m.values.at(i))]
+  if i != reference_index and m.deltas.at(i) != none [
+    #text(size: 8pt)[(#fmt_delta(m.deltas.at(i)))]
+  ]
+  if m.ranks != none and m.ranks.at(i) != none [
+    #text(size: 8pt, fill: gray)[rank #m.ranks.at(i)]
+  ]
+}
+
+#heading(level: 1, "Genome Annotation Comparison Report")
+_Report generated: #datetime.today().display()_
+
+This report compares #n annotations. Differences in brackets are relative to
+#emph[#cmp.reference]. Ranks are given for metrics where a higher or lower
+value is better (1 is best).
+
+#v(1em)
+
+// Overview
+== Overview
+
+#table(
+  columns: 6,
+  stroke: none,
+  table.header(
+    [*Annotation*], [*Scientific name*], [*Annotation tools*], [*BUSCO summary*], [*Mean rank*], [*Overall rank*]
+  ),
+  ..for i in range(n) {
+    let rep = cmp.reports.at(i)
+    let busco = rep.at("busco", default: (:))
+    (
+      [*#cmp.labels.at(i)*],
+      [#emph[#rep.at("scientific_name", default: "N/A")]],
+      [#rep.at("annotation_tools", default: "N/A")],
+      [#busco.at("one_line_summary", default: "N/A")],
+      [#fmt(cmp.mean_ranks.at(i))],
+      [#fmt(cmp.overall_ranks.at(i))],
+    )
+  }
+)
+
+// Metric tables
+#let blocks = (
+  ("agat", "AGAT Statistics"),
+  ("busco", "BUSCO"),
+  ("omark", "OMArk"),
+  ("annooddities", "AnnoOddities Results"),
+)
+
+#for (block, title) in blocks {
+  let metrics = cmp.metrics.filter(m => m.block == block)
+  if metrics.len() > 0 [
+    #v(1em)
+
+    == #title
+
+    #table(
+      columns: (25%,) + (1fr,) * n,
+      stroke: none,
+      table.header(
+        [*Metric*], ..cmp.labels.map(l => [*#l*])
+      ),
+      ..for m in metrics {
+        ([*#m.label:*],) + range(n).map(i => metric_cell(m, i))
+      }
+    )
+  ]
+}
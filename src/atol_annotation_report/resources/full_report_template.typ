@@ -1,5 +1,3 @@
-#import "@preview/tabut:1.0.2": tabut, records-from-csv, tabut-cells, rows-to-records
-
 // Page styling
 #set page(
   paper: "a4",
@@ -239,6 +237,72 @@
     [*Missing:*], [#rep.busco.missing_percent%],
     [*Total markers:*], [#rep.busco.n_markers],
   )
+
+  #let duplicated = rep.busco.at("duplicated_buscos", default: ())
+  #if duplicated.len() > 0 {
+    [
+      #v(0.5em)
+
+      === Duplicated BUSCOs
+      #table(
+        columns: (25%, auto, auto),
+        stroke: none,
+        table.header(
+          [*BUSCO*], [*Description*], [*Copies*]
+        ),
+        ..for b in duplicated.slice(0, calc.min(duplicated.len(), 50)) {
+          ([#b.busco_id], [#b.description], [#if b.sequences.len() > 0 [#b.sequences.join(", ")] else [Duplicated]])
+        }
+      )
+      #if duplicated.len() > 50 [
+        _#(duplicated.len() - 50) more duplicated BUSCOs are listed in the JSON report._
+      ]
+    ]
+  }
+
+  #let fragmented = rep.busco.at("fragmented_buscos", default: ())
+  #if fragmented.len() > 0 {
+    [
+      #v(0.5em)
+
+      === Fragmented BUSCOs
+      #table(
+        columns: (25%, auto, auto),
+        stroke: none,
+        table.header(
+          [*BUSCO*], [*Description*], [*Sequence*]
+        ),
+        ..for b in fragmented.slice(0, calc.min(fragmented.len(), 50)) {
+          ([#b.busco_id], [#b.description], [#if b.sequence != none [#b.sequence]])
+        }
+      )
+      #if fragmented.len() > 50 [
+        _#(fragmented.len() - 50) more fragmented BUSCOs are listed in the JSON report._
+      ]
+    ]
+  }
+
+  #let sequences = rep.busco.at("busco_sequences", default: ())
+  #if sequences.len() > 0 {
+    [
+      #v(0.5em)
+
+      === Completeness by Sequence
+      #table(
+        columns: 5,
+        stroke: none,
+        table.header(
+          [*Sequence*], [*Complete*], [*Single-copy*], [*Duplicated*], [*Fragmented*]
+        ),
+        ..for s in sequences.slice(0, calc.min(sequences.len(), 25)) {
+          ([#s.sequence], [#s.complete_percent%], [#s.single_copy], [#s.duplicated], [#s.fragmented])
+        }
+      )
+      #if sequences.len() > 25 [
+        _#(sequences.len() - 25) more sequences are listed in the JSON report._
+      ]
+    ]
+  }
 ]
 
 #if rep.omark.omark_input_provided == true [
@@ -309,6 +373,36 @@
     ]
   }
 
+  #let tallies = rep.omark.at("omark_contig_tallies", default: none)
+  #if tallies != none {
+    let column = name => tallies.columns.position(c => c == name)
+    let flagged = tallies.rows.filter(r => r.at(column("contaminant")) + r.at(column("inconsistent")) > 0)
+    if flagged.len() > 0 [
+      #v(0.5em)
+
+      === Contigs with Contaminant or Inconsistent Proteins
+      #table(
+        columns: 5,
+        stroke: none,
+        table.header(
+          [*Contig*], [*Contaminant*], [*Inconsistent*], [*Consistent*], [*Unknown*]
+        ),
+        ..for r in flagged.slice(0, calc.min(flagged.len(), 25)) {
+          (
+            [#r.at(column("contig"))],
+            [#r.at(column("contaminant"))],
+            [#r.at(column("inconsistent"))],
+            [#r.at(column("consistent"))],
+            [#r.at(column("unknown"))],
+          )
+        }
+      )
+      #if flagged.len() > 25 [
+        _#(flagged.len() - 25) more contigs are listed in the JSON report._
+      ]
+    ]
+  }
+
   #if rep.omark.contaminant_sp != ("N/A",) {
     [
       #v(0.5em)
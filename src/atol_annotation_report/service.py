@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+
+# a local report service for the web interface. each upload is queued as a
+# job in a SQLite database and run by a bounded pool of worker processes, so
+# the web request returns as soon as the job is queued instead of waiting
+# for the report.
+# the workers are the batch runner's: each one loads the typst template once.
+#
+# HTTP API, listening on localhost only:
+# POST /jobs with {"metadata_file": "/path", "annotation_file": "/path", ...}
+#   (any of the batch input columns) queues a job and returns 202 with
+#   {"job_id": ..., "status": "queued", "status_url": "/jobs/<job_id>"}
+# GET /jobs/<job_id> returns {"job_id", "status", "error", "seconds",
+#   "outputs": {output: url}}. status is queued, running, success or failed.
+# GET /jobs/<job_id>/<output> downloads output_file (the PDF), json_atol or
+#   json_full once the job has succeeded. the previews, html (a summary page)
+#   and preview_png (the first page of the report), are written before the
+#   PDF is rendered, and can be fetched as soon as they are listed, while the
+#   job is still running.
+#
+# the queue lives in the database, so queued jobs survive a restart. jobs
+# that were running when the service stopped are queued again at startup.
+# a job that can't be started is marked failed, a worker process that dies
+# fails its job and the pool is replaced, and database errors are retried.
+# if the dispatcher stops anyway, the whole service stops with it, rather
+# than accepting jobs that never run.
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import _thread
+import argparse
+import json
+import logging
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+
+from atol_annotation_report.batch import init_worker, input_columns, run_item
+from atol_annotation_report.cache import default_cache_dir, default_max_mb
+from atol_annotation_report.profiling import log_formats, setup_logging
+from atol_annotation_report.python_reporter import default_formats
+from atol_annotation_report.render import stop_daemon
+
+logger = logging.getLogger(__name__)
+
+job_outputs = {
+    "output_file": ("report.pdf", "application/pdf"),
+    "json_atol": ("json_atol.json", "application/json"),
+    "json_full": ("json_full.json", "application/json"),
+    "html": ("summary.html", "text/html"),
+    "preview_png": ("preview.png", "image/png"),
+}
+preview_outputs = {"html", "preview_png"}
+# inputs that can be a file or a directory (OMArk's output directory)
+directory_inputs = {"omark_detail"}
+service_formats = [*default_formats, "html", "png"]
+
+# how often the dispatcher checks the database for jobs queued by another
+# process
+poll_seconds = 1.0
+
+
+class JobQueue:
+    def __init__(self, path_to_database):
+        self.path_to_database = path_to_database
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, "
+                "status TEXT NOT NULL, "
+                "inputs TEXT NOT NULL, "
+                "outdir TEXT NOT NULL, "
+                "created REAL NOT NULL, "
+                "started REAL, "
+                "finished REAL, "
+                "seconds REAL, "
+                "error TEXT)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)"
+            )
+
+    @contextmanager
+    def connect(self):
+        # a connection per call, because the HTTP server and the dispatcher
+        # use the queue from different threads
+        db = sqlite3.connect(self.path_to_database, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, inputs, outdir):
+        job_id = uuid.uuid4().hex
+        with self.connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, inputs, outdir, created) "
+                "VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(inputs), str(Path(outdir, job_id)), time.time()),
+            )
+        return job_id
+
+    def claim(self):
+        # marks the oldest queued job as running and returns it, or None
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            job = db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+            ).fetchone()
+            if job is not None:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', started = ? WHERE id = ?",
+                    (time.time(), job["id"]),
+                )
+            db.execute("COMMIT")
+        return None if job is None else dict(job)
+
+    def finish(self, job_id, status, seconds=None, error=""):
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, finished = ?, seconds = ?, error = ? "
+                "WHERE id = ?",
+                (status, time.time(), seconds, error, job_id),
+            )
+
+    def requeue(self, job_id):
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL WHERE id = ?",
+                (job_id,),
+            )
+
+    def requeue_running(self):
+        with self.connect() as db:
+            return db.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL "
+                "WHERE status = 'running'"
+            ).rowcount
+
+    def get(self, job_id):
+        with self.connect() as db:
+            job = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if job is None else dict(job)
+
+
+def make_item(job):
+    # the batch runner's manifest item for a job
+    inputs = json.loads(job["inputs"])
+    item = {"id": job["id"]}
+    for column in input_columns:
+        item[column] = Path(inputs[column]) if inputs.get(column) else None
+    for column, (filename, _) in job_outputs.items():
+        item[column] = Path(job["outdir"], filename)
+    return item
+
+
+def is_available(job, output):
+    # previews are moved into place whole, so they can be served mid-job
+    if output in preview_outputs:
+        return job["status"] in ("running", "success")
+    return job["status"] == "success"
+
+
+class Dispatcher(threading.Thread):
+    def __init__(self, queue, threads, initargs):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.threads = threads
+        self.initargs = initargs
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+    def start_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.threads, initializer=init_worker, initargs=self.initargs
+        )
+
+    def start_job(self, pool, job):
+        # returns the job's future, or None if it failed to start
+        try:
+            item = make_item(job)
+            item["output_file"].parent.mkdir(parents=True, exist_ok=True)
+            future = pool.submit(run_item, item)
+        except BrokenProcessPool:
+            # the job runs on the next pool
+            self.queue.requeue(job["id"])
+            raise
+        except Exception as e:
+            logger.exception(f"Job {job['id']} could not be started")
+            self.queue.finish(job["id"], "failed", error=f"{type(e).__name__}: {e}")
+            return None
+        logger.info(f"Starting job {job['id']}")
+        return future
+
+    def run(self):
+        try:
+            self.dispatch()
+        except Exception:
+            logger.exception("The job dispatcher stopped, stopping the service")
+            _thread.interrupt_main()
+
+    def dispatch(self):
+        pool = self.start_pool()
+        running = {}
+        try:
+            while not self.stopping.is_set():
+                try:
+                    broken = self.dispatch_jobs(pool, running)
+                except sqlite3.Error:
+                    logger.exception(
+                        "Can't read or update the job queue, retrying in "
+                        f"{poll_seconds} seconds"
+                    )
+                    self.stopping.wait(poll_seconds)
+                    continue
+                if broken:
+                    # a worker process died. the pool's other jobs fail with
+                    # it, and later jobs run on a new pool
+                    logger.warning("A worker process died, starting new workers")
+                    done, _ = wait(running)
+                    self.record_finished(done, running)
+                    pool.shutdown(wait=False)
+                    pool = self.start_pool()
+        finally:
+            pool.shutdown()
+
+    def dispatch_jobs(self, pool, running):
+        # starts queued jobs and records finished ones. returns True if the
+        # pool is broken
+        # only as many jobs as workers leave the database at a time
+        while len(running) < self.threads:
+            job = self.queue.claim()
+            if job is None:
+                break
+            try:
+                future = self.start_job(pool, job)
+            except BrokenProcessPool:
+                return True
+            if future is not None:
+                running[future] = job["id"]
+        if not running:
+            self.wakeup.wait(poll_seconds)
+            self.wakeup.clear()
+            return False
+        done, _ = wait(running, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+        return self.record_finished(done, running)
+
+    def record_finished(self, done, running):
+        # returns True if a job failed because the pool is broken
+        broken = False
+        for future in done:
+            job_id = running.pop(future)
+            try:
+                status = future.result()
+            except Exception as e:
+                # e.g. a worker process was killed
+                broken = broken or isinstance(e, BrokenProcessPool)
+                status = {
+                    "status": "failed",
+                    "error": f"{type(e).__name__}: {e}",
+                }
+            logger.info(f"Job {job_id} {status['status']}")
+            self.queue.finish(
+                job_id,
+                status["status"],
+                seconds=status.get("seconds"),
+                error=status["error"],
+            )
+        return broken
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, code, document):
+        body = json.dumps(document).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, code, message):
+        self.send_json(code, {"status": "error", "message": message})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self.send_error_json(404, f"Unknown path {self.path}")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            inputs = json.loads(self.rfile.read(length))
+        except ValueError:
+            return self.send_error_json(400, "The request body is not JSON")
+        if not isinstance(inputs, dict):
+            return self.send_error_json(400, "The request body must be a JSON object")
+        unknown = [x for x in inputs if x not in input_columns]
+        if unknown:
+            return self.send_error_json(400, "Unknown inputs: " + ", ".join(unknown))
+        inputs = {k: v for k, v in inputs.items() if v}
+        if not inputs:
+            return self.send_error_json(400, "No input files given")
+        missing = [
+            v
+            for k, v in inputs.items()
+            if not (Path(v).exists() if k in directory_inputs else Path(v).is_file())
+        ]
+        if missing:
+            return self.send_error_json(
+                400, "Input files not found: " + ", ".join(missing)
+            )
+
+        job_id = self.server.queue.submit(inputs, self.server.jobs_dir)
+        self.server.dispatcher.wakeup.set()
+        logger.info(f"Queued job {job_id}")
+        self.send_json(
+            202, {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+        )
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) not in (2, 3) or parts[0] != "jobs":
+            return self.send_error_json(404, f"Unknown path {self.path}")
+        job = self.server.queue.get(parts[1])
+        if job is None:
+            return self.send_error_json(404, f"Unknown job {parts[1]}")
+
+        if len(parts) == 2:
+            outputs = {}
+            for output, (filename, _) in job_outputs.items():
+                if not is_available(job, output):
+                    continue
+                if Path(job["outdir"], filename).exists():
+                    outputs[output] = f"/jobs/{job['id']}/{output}"
+            return self.send_json(
+                200,
+                {
+                    "job_id": job["id"],
+                    "status": job["status"],
+                    "error": job["error"] or "",
+                    "seconds": job["seconds"],
+                    "outputs": outputs,
+                },
+            )
+
+        if parts[2] not in job_outputs:
+            return self.send_error_json(404, f"Unknown output {parts[2]}")
+        if not is_available(job, parts[2]):
+            return self.send_error_json(409, f"Job {job['id']} is {job['status']}")
+        filename, content_type = job_outputs[parts[2]]
+        path = Path(job["outdir"], filename)
+        if not path.exists():
+            return self.send_error_json(404, f"Job {job['id']} has no {parts[2]}")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(path.stat().st_size))
+        if parts[2] not in preview_outputs:
+            self.send_header(
+                "Content-Disposition", f'attachment; filename="{filename}"'
+            )
+        self.end_headers()
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 16):
+                self.wfile.write(chunk)
+
+
+class ReportServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, queue, jobs_dir, dispatcher):
+        self.queue = queue
+        self.jobs_dir = jobs_dir
+        self.dispatcher = dispatcher
+        super().__init__(address, ServiceRequestHandler)
+
+
+def serve(
+    host,
+    port,
+    path_to_database,
+    jobs_dir,
+    threads,
+    package_path=None,
+    cache_dir=None,
+    cache_max_mb=default_max_mb,
+    log_format="text",
+):
+    jobs_dir = Path(jobs_dir).resolve()
+    jobs_dir.mkdir(parents=True, exist_ok=True)
+    queue = JobQueue(path_to_database)
+    n_requeued = queue.requeue_running()
+    if n_requeued:
+        logger.info(f"Queued {n_requeued} interrupted jobs again")
+
+    dispatcher = Dispatcher(
+        queue,
+        threads,
+        (package_path, service_formats, cache_dir, cache_max_mb, log_format, False),
+    )
+    dispatcher.start()
+
+    # treat SIGTERM from a service manager like Ctrl-C
+    signal.signal(signal.SIGTERM, stop_daemon)
+
+    with ReportServer((host, port), queue, jobs_dir, dispatcher) as server:
+        logger.info(
+            f"Report service listening on http://{host}:{port} with {threads} workers"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Report service stopping")
+        finally:
+            dispatcher.stop()
+            dispatcher.join()
+
+
+def parse_arguments():
+
+    argument_parser = argparse.ArgumentParser(
+        description="Run a local service that queues report jobs and runs them in a pool of worker processes",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    argument_parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address to listen on. The service has no authentication, so keep it local",
+    )
+    argument_parser.add_argument(
+        "-p",
+        "--port",
+        default=8765,
+        type=int,
+        help="Port to listen on",
+    )
+    argument_parser.add_argument(
+        "-t",
+        "--threads",
+        default=2,
+        type=int,
+        help="Number of worker processes, i.e. the most reports generated at once",
+    )
+    argument_parser.add_argument(
+        "-d",
+        "--database",
+        default=Path("atol-annotation-report-jobs.sqlite"),
+        type=Path,
+        help="Path to the SQLite job queue",
+    )
+    argument_parser.add_argument(
+        "-j",
+        "--jobs_dir",
+        default=Path("atol-annotation-report-jobs"),
+        type=Path,
+        help="Directory for job outputs, one subdirectory per job",
+    )
+    argument_parser.add_argument(
+        "--package_cache",
+        type=Path,
+        help="A local directory of typst packages (laid out as <namespace>/<name>/<version>) to resolve template imports from instead of downloading them",
+    )
+    argument_parser.add_argument(
+        "--cache_dir",
+        type=Path,
+        help="Directory for cached results, shared by all workers (default: $XDG_CACHE_HOME/atol-annotation-report or ~/.cache/atol-annotation-report)",
+    )
+    argument_parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Don't read or write cached results",
+    )
+    argument_parser.add_argument(
+        "--log_format",
+        default="text",
+        choices=log_formats,
+        help="Write progress messages as plain text or as one JSON object per line",
+    )
+
+    args = argument_parser.parse_args()
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+    setup_logging(args.log_format)
+    if args.no_cache:
+        cache_dir = None
+    else:
+        cache_dir = args.cache_dir or default_cache_dir()
+    serve(
+        args.host,
+        args.port,
+        args.database,
+        args.jobs_dir,
+        args.threads,
+        package_path=args.package_cache,
+        cache_dir=cache_dir,
+        log_format=args.log_format,
+    )
+
+
+if __name__ == "__main__":
+    main()
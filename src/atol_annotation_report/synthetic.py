@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+# generators for large synthetic tool outputs, used by the benchmark suite to
+# see how the reporter scales beyond the bundled test data.
+# every generator takes a seed, so the same scale and seed always give the
+# same files.
+#
+# - AGAT YAML: one section per transcript-level feature type, each with
+#   with_isoforms and without_isoforms statistics for its subfeatures
+# - BUSCO short summary JSON for a lineage with many markers
+# - BUSCO full table in genome mode, with hits spread over many scaffolds
+# - OMArk summary JSON with many detected and contaminant species
+# - AnnoOddities summary TSV with the standard checks plus extra rows
+
+from pathlib import Path
+import json
+import random
+
+from atol_annotation_report.oddities import oddity_checks
+
+# sizes of the generated inputs. small is close to the bundled test data.
+scales = {
+    "small": {
+        "agat_feature_types": 2,
+        "agat_subfeature_types": 8,
+        "busco_markers": 1614,
+        "busco_sequences": 10,
+        "omark_species": 2,
+        "omark_contaminants": 1,
+        "oddity_rows": len(oddity_checks),
+    },
+    "large": {
+        "agat_feature_types": 40,
+        "agat_subfeature_types": 60,
+        "busco_markers": 13780,
+        "busco_sequences": 2000,
+        "omark_species": 500,
+        "omark_contaminants": 300,
+        "oddity_rows": 20000,
+    },
+}
+
+transcript_types = [
+    "transcript",
+    "mrna",
+    "ncrna",
+    "trna",
+    "rrna",
+    "lnc_rna",
+    "snrna",
+    "snorna",
+    "mirna",
+    "pseudogenic_transcript",
+]
+subfeature_types = [
+    "cds",
+    "exon",
+    "intron",
+    "five_prime_utr",
+    "three_prime_utr",
+    "start_codon",
+    "stop_codon",
+    "cds piece",
+]
+
+
+def get_type_names(names, n):
+    # the first n names, numbered once the list runs out
+    return [
+        names[i] if i < len(names) else f"{names[i % len(names)]}_{i}" for i in range(n)
+    ]
+
+
+def make_agat_values(rng, feature_type, subfeatures):
+    n_genes = rng.randint(1000, 60000)
+    n_transcripts = int(n_genes * rng.uniform(1, 1.6))
+    values = {
+        "Number of gene": n_genes,
+        f"Number of {feature_type}": n_transcripts,
+        "Number of single exon gene": rng.randint(0, n_genes // 5),
+        f"Number of single exon {feature_type}": rng.randint(0, n_transcripts // 5),
+        f"mean {feature_type}s per gene": round(n_transcripts / n_genes, 1),
+        "Number gene overlapping": rng.randint(0, n_genes // 50),
+    }
+    for feature in ["gene", feature_type, *subfeatures]:
+        mean_length = rng.uniform(50, 20000)
+        values[f"Number of {feature}"] = values.get(
+            f"Number of {feature}", rng.randint(n_transcripts, n_transcripts * 12)
+        )
+        values[f"mean {feature} length (bp)"] = round(mean_length, 11)
+        values[f"median {feature} length (bp)"] = int(mean_length * 0.8)
+        values[f"90 percentile {feature} length (bp)"] = int(mean_length * 2.5)
+        values[f"Longest {feature} (bp)"] = int(mean_length * rng.uniform(10, 100))
+        values[f"Shortest {feature} (bp)"] = rng.randint(1, 50)
+        values[f"Total {feature} length (bp)"] = int(
+            mean_length * values[f"Number of {feature}"]
+        )
+        values[f"% of genome covered by {feature}"] = round(rng.uniform(0, 60), 1)
+        if feature not in ("gene", feature_type):
+            values[f"mean {feature}s per {feature_type}"] = round(rng.uniform(1, 12), 1)
+    return values
+
+
+def write_agat_yaml(path, n_feature_types, n_subfeature_types, seed=0):
+    import yaml
+
+    rng = random.Random(seed)
+    subfeatures = get_type_names(subfeature_types, n_subfeature_types)
+    document = {}
+    for feature_type in get_type_names(transcript_types, n_feature_types):
+        document[feature_type] = {
+            "isoform": "yes",
+            "with_isoforms": {
+                "value": make_agat_values(rng, feature_type, subfeatures)
+            },
+            "without_isoforms": {
+                "value": make_agat_values(rng, feature_type, subfeatures)
+            },
+        }
+    with open(path, "wt") as f:
+        f.write("---\n")
+        yaml.safe_dump(document, f, default_flow_style=False)
+
+
+def write_busco_json(path, n_markers, seed=0):
+    rng = random.Random(seed)
+    counts = {"Single copy": rng.randint(n_markers // 2, n_markers)}
+    counts["Multi copy"] = rng.randint(0, (n_markers - counts["Single copy"]) // 2)
+    counts["Fragmented"] = rng.randint(
+        0, n_markers - counts["Single copy"] - counts["Multi copy"]
+    )
+    counts["Missing"] = (
+        n_markers - counts["Single copy"] - counts["Multi copy"] - counts["Fragmented"]
+    )
+    counts["Complete"] = counts["Single copy"] + counts["Multi copy"]
+    percents = {k: round(100 * v / n_markers, 1) for k, v in counts.items()}
+    results = {
+        "one_line_summary": (
+            f"C:{percents['Complete']}%[S:{percents['Single copy']}%,"
+            f"D:{percents['Multi copy']}%],F:{percents['Fragmented']}%,"
+            f"M:{percents['Missing']}%,n:{n_markers}"
+        )
+    }
+    for category in ["Complete", "Single copy", "Multi copy", "Fragmented", "Missing"]:
+        results[f"{category} percentage"] = percents[category]
+        results[f"{category} BUSCOs"] = counts[category]
+    results.update(
+        {
+            "n_markers": n_markers,
+            "avg_identity": None,
+            "domain": "eukaryota",
+            "internal_stop_codon_count": 0,
+            "internal_stop_codon_percent": 0,
+        }
+    )
+    document = {
+        "parameters": {"mode": "proteins", "domain": "eukaryota", "cpu": "32"},
+        "lineage_dataset": {
+            "name": "synthetic_odb10",
+            "creation_date": "2024-01-08",
+            "number_of_buscos": str(n_markers),
+            "number_of_species": "300",
+        },
+        "versions": {"hmmsearch": 3.4, "busco": "5.8.3"},
+        "results": results,
+    }
+    with open(path, "wt") as f:
+        json.dump(document, f, indent=4)
+
+
+def write_busco_full_table(path, n_markers, n_sequences, seed=0):
+    rng = random.Random(seed)
+    with open(path, "wt") as f:
+        f.write("# BUSCO version is: 5.8.3\n")
+        f.write(
+            "# The lineage dataset is: synthetic_odb10 (Creation date: 2024-01-08, "
+            f"number of genomes: 300, number of BUSCOs: {n_markers})\n"
+        )
+        f.write(
+            "# Busco id\tStatus\tSequence\tGene Start\tGene End\tStrand\tScore\t"
+            "Length\tOrthoDB url\tDescription\n"
+        )
+        for i in range(n_markers):
+            busco_id = f"{i + 1000}at2759"
+            status = rng.choices(
+                ["Complete", "Duplicated", "Fragmented", "Missing"], [70, 10, 10, 10]
+            )[0]
+            if status == "Missing":
+                f.write(f"{busco_id}\tMissing\n")
+                continue
+            n_copies = rng.randint(2, 6) if status == "Duplicated" else 1
+            for _ in range(n_copies):
+                start = rng.randint(1, 10000000)
+                end = start + rng.randint(300, 20000)
+                sequence = f"scaffold_{rng.randint(1, n_sequences)}"
+                f.write(
+                    f"{busco_id}\t{status}\t{sequence}:{start}-{end}\t{start}\t{end}\t"
+                    f"{rng.choice('+-')}\t{rng.uniform(100, 3000):.1f}\t"
+                    f"{rng.randint(100, 2000)}\t"
+                    f"https://v101.orthodb.org/?query={busco_id}\t"
+                    f"Synthetic protein {i}\n"
+                )
+
+
+def write_omark_json(path, n_species, n_contaminants, seed=0):
+    rng = random.Random(seed)
+    detected_species = []
+    for i in range(n_species + n_contaminants):
+        entry = {
+            "Clade" if i < n_species else "Potential_contaminants": f"Species {i}",
+            "NCBI_taxid": rng.randint(1000, 3000000),
+            "Number_of_associated_proteins": rng.randint(1, 40000),
+            "Percentage_of_proteomes_total": round(rng.uniform(0, 100), 2),
+        }
+        detected_species.append(entry)
+    categories = ["consistent", "inconsistent", "likely_contamination", "unknown"]
+    results_pcts = {}
+    for category in categories:
+        results_pcts[category] = round(rng.uniform(0, 100), 2)
+        for part in ["partial_hits", "fragmented"]:
+            results_pcts[f"{category}_{part}"] = round(rng.uniform(0, 10), 2)
+    conserv_pcts = {
+        key: round(rng.uniform(0, 100), 2)
+        for key in [
+            "single",
+            "duplicated",
+            "duplicated_unexpected",
+            "duplicated_expected",
+            "missing",
+        ]
+    }
+    document = {
+        "selected_clade": "Synthetic clade",
+        "conserved_hogs": rng.randint(5000, 30000),
+        "conserv_pcts": conserv_pcts,
+        "conserv_pcts_raw": (
+            "S:{single}%,D:{duplicated}%[U:{duplicated_unexpected}%,"
+            "E:{duplicated_expected}%],M:{missing}%"
+        ).format(**conserv_pcts),
+        "proteins_in_proteome": rng.randint(10000, 80000),
+        "results_pcts": results_pcts,
+        "results_pcts_raw": (
+            "A:{consistent}%,I:{inconsistent}%,C:{likely_contamination}%,U:{unknown}%"
+        ).format(**results_pcts),
+        "detected_species": detected_species,
+        "omamer_version": "2.1.0",
+        "db_version": "2.0.3",
+    }
+    with open(path, "wt") as f:
+        json.dump(document, f, indent=4)
+
+
+def write_annooddities_tsv(path, n_rows, seed=0):
+    rng = random.Random(seed)
+    checks = list(oddity_checks)
+    checks += [f"exon_num > {i}" for i in range(2, n_rows - len(checks) + 2)]
+    with open(path, "wt") as f:
+        f.write("check\tn_transcripts\n")
+        for check in checks:
+            f.write(f"{check}\t{rng.randint(0, 100000)}\n")
+
+
+def write_inputs(outdir, scale="large", seed=0):
+    # returns {input argument: path}
+    sizes = scales[scale]
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    inputs = {
+        "agat_file": Path(outdir, "agat.stats.yaml"),
+        "busco_file": Path(outdir, "short_summary.specific.busco.json"),
+        "busco_full_table": Path(outdir, "full_table.tsv"),
+        "omark_file": Path(outdir, "omark_summary.json"),
+        "annooddities_file": Path(outdir, "annooddities_summary.tsv"),
+    }
+    write_agat_yaml(
+        inputs["agat_file"],
+        sizes["agat_feature_types"],
+        sizes["agat_subfeature_types"],
+        seed=seed,
+    )
+    write_busco_json(inputs["busco_file"], sizes["busco_markers"], seed=seed)
+    write_busco_full_table(
+        inputs["busco_full_table"],
+        sizes["busco_markers"],
+        sizes["busco_sequences"],
+        seed=seed,
+    )
+    write_omark_json(
+        inputs["omark_file"],
+        sizes["omark_species"],
+        sizes["omark_contaminants"],
+        seed=seed,
+    )
+    write_annooddities_tsv(inputs["annooddities_file"], sizes["oddity_rows"], seed=seed)
+    return inputs
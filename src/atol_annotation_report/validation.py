@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+# checks the metadata and the parsed tool blocks before any rendering, so a
+# bad upload fails at once with a list of all its problems, instead of deep
+# inside the typst compile.
+#
+# - metadata: each row needs a meta_key and a meta_value, as before. with
+#   strict validation (--strict_validation), the keys the report template
+#   reads must also be present and match resources/metadata_schema.json: a
+#   type, and optionally a minimum length or a regular expression that the
+#   whole value must match. other keys are allowed.
+# - tool blocks: the "type" of each field in the field mapping spec (see
+#   mappings.py). "N/A", for values missing from the tool output, is always
+#   allowed.
+#
+# the schemas are compiled once per process into a list of checks for each
+# field, and reused for every input.
+#
+# each problem is reported as {"input": "metadata" or the tool, "field": ...,
+# "message": ...}. collect_stats raises them together as a ValidationError.
+#
+# run as atol-annotation-report-validate, this checks many metadata files
+# (JSON or CSV) and/or the rows of a batch manifest in a process pool,
+# without rendering, and writes a JSON report of the problems of each input.
+
+from pathlib import Path
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+
+from atol_annotation_report.mappings import get_field_mapper
+from atol_annotation_report.profiling import log_formats, setup_logging
+
+logger = logging.getLogger(__name__)
+
+tool_blocks = ["agat", "busco", "omark", "annooddities"]
+
+# type: (check, description)
+value_types = {
+    "string": (lambda x: isinstance(x, str), "a string"),
+    "text": (
+        lambda x: isinstance(x, (str, int, float)) and not isinstance(x, bool),
+        "a string or a number",
+    ),
+    "integer": (
+        lambda x: (isinstance(x, int) and not isinstance(x, bool))
+        or (isinstance(x, float) and x.is_integer()),
+        "a whole number",
+    ),
+    "number": (
+        lambda x: isinstance(x, (int, float)) and not isinstance(x, bool),
+        "a number",
+    ),
+    "list": (lambda x: isinstance(x, list), "a list"),
+}
+
+compiled_schemas = None
+
+
+class ValidationError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(
+            f"{len(errors)} validation errors: "
+            + "; ".join(format_error(x) for x in errors)
+        )
+
+    def __reduce__(self):
+        # so the errors survive being sent back from a worker process
+        return (ValidationError, (self.errors,))
+
+
+def make_error(input_name, field, message):
+    return {"input": input_name, "field": field, "message": message}
+
+
+def format_error(error):
+    if error["field"] is None:
+        return f"{error['input']}: {error['message']}"
+    return f"{error['input']} {error['field']}: {error['message']}"
+
+
+def get_metadata_schema_path():
+    from importlib.resources import files
+
+    return files("atol_annotation_report").joinpath("resources", "metadata_schema.json")
+
+
+class Schema:
+    def __init__(self, input_name, field_specs, missing_value=None):
+        self.input_name = input_name
+        self.missing_value = missing_value
+        # [(field, required, [(check, message)])]
+        self.fields = []
+        for field, spec in field_specs.items():
+            check, description = value_types[spec["type"]]
+            checks = [(check, f"should be {description}")]
+            if "min_length" in spec:
+                checks.append(
+                    (
+                        lambda x, n=spec["min_length"]: len(str(x).strip()) >= n,
+                        f"should have at least {spec['min_length']} characters",
+                    )
+                )
+            if "pattern" in spec:
+                checks.append(
+                    (
+                        lambda x, pattern=re.compile(spec["pattern"]): (
+                            pattern.fullmatch(str(x).strip()) is not None
+                        ),
+                        f"should match {spec['pattern']}",
+                    )
+                )
+            self.fields.append((field, spec.get("required", False), checks))
+
+    def validate(self, document):
+        errors = []
+        for field, required, checks in self.fields:
+            if field not in document:
+                if required:
+                    errors.append(make_error(self.input_name, field, "is missing"))
+                continue
+            value = document[field]
+            if self.missing_value is not None and value == self.missing_value:
+                continue
+            for check, message in checks:
+                if not check(value):
+                    errors.append(
+                        make_error(
+                            self.input_name, field, f"{message}, not {value!r:.80}"
+                        )
+                    )
+                    break
+        return errors
+
+
+def load_schemas(path_to_metadata_schema=None):
+    if path_to_metadata_schema is None:
+        path_to_metadata_schema = get_metadata_schema_path()
+    with open(path_to_metadata_schema, "rt") as f:
+        metadata_spec = json.load(f)
+    schemas = {"metadata": Schema("metadata", metadata_spec["fields"])}
+    for tool in tool_blocks:
+        field_specs = {
+            field: {"type": value_type}
+            for field, value_type in get_field_mapper(tool).types.items()
+        }
+        schemas[tool] = Schema(tool, field_specs, missing_value="N/A")
+    return schemas
+
+
+def get_schema(input_name):
+    # the schemas are compiled on first use and reused for every input
+    global compiled_schemas
+    if compiled_schemas is None:
+        compiled_schemas = load_schemas()
+    return compiled_schemas[input_name]
+
+
+def check_metadata_rows(rows):
+    # the metadata is a list of {"meta_key": ..., "meta_value": ...} objects
+    if not isinstance(rows, list):
+        return [
+            make_error(
+                "metadata", None, "should be a list of meta_key and meta_value pairs"
+            )
+        ]
+    errors = []
+    for i, row in enumerate(rows):
+        if (
+            not isinstance(row, dict)
+            or not row.get("meta_key")
+            or ("meta_value" not in row)
+        ):
+            errors.append(
+                make_error(
+                    "metadata", None, f"row {i + 1} has no meta_key or meta_value"
+                )
+            )
+    return errors
+
+
+def validate_blocks(combined_stats):
+    # the metadata is checked when it is parsed, so this only checks the
+    # tool blocks that had an input
+    errors = []
+    for tool in tool_blocks:
+        block = combined_stats.get(tool, {})
+        if block.get(f"{tool}_input_provided"):
+            errors.extend(get_schema(tool).validate(block))
+    return errors
+
+
+def validate_metadata_file(path, strict=False):
+    from atol_annotation_report.python_reporter import read_metadata
+
+    try:
+        rows = read_metadata(path)
+    except (OSError, ValueError, csv.Error) as e:
+        errors = [make_error("metadata", None, f"can't be read: {e}")]
+    else:
+        errors = check_metadata_rows(rows)
+        if not errors and strict:
+            metadata = {x["meta_key"]: x["meta_value"] for x in rows}
+            errors = get_schema("metadata").validate(metadata)
+    return {"input": str(path), "valid": not errors, "errors": errors}
+
+
+def validate_manifest_row(item, strict=False):
+    # parses the row's inputs the way a report run does, without rendering
+    # ValidationError from the package, not __main__ under python -m
+    from atol_annotation_report.batch import input_columns
+    from atol_annotation_report.python_reporter import (
+        ValidationError,
+        collect_stats,
+    )
+
+    try:
+        collect_stats(
+            **{column: item[column] for column in input_columns},
+            strict_validation=strict,
+        )
+        errors = []
+    except ValidationError as e:
+        errors = e.errors
+    except Exception as e:
+        errors = [make_error("report", None, f"{type(e).__name__}: {e}")]
+    return {"input": item["id"], "valid": not errors, "errors": errors}
+
+
+def find_metadata_files(paths, pattern):
+    for path in paths:
+        if path.is_dir():
+            yield from sorted(x for x in path.rglob(pattern) if x.is_file())
+        else:
+            yield path
+
+
+def parse_arguments():
+
+    argument_parser = argparse.ArgumentParser(
+        description="Check metadata files and report inputs against the report schema without rendering",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    argument_parser.add_argument(
+        "metadata",
+        nargs="*",
+        type=Path,
+        help="Metadata files (JSON, or CSV with meta_key and meta_value columns), or directories to search for them",
+    )
+    argument_parser.add_argument(
+        "--pattern",
+        default="*metadata*",
+        help="Filename pattern for the metadata files found in directories",
+    )
+    argument_parser.add_argument(
+        "-m",
+        "--manifest",
+        type=Path,
+        help="A batch manifest (see atol-annotation-report-batch). Every input of each row is parsed and checked",
+    )
+    argument_parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Also require the metadata keys in the report schema, with the types and patterns given there",
+    )
+    argument_parser.add_argument(
+        "-t",
+        "--threads",
+        default=os.cpu_count(),
+        type=int,
+        help="Number of worker processes",
+    )
+    argument_parser.add_argument(
+        "-o",
+        "--report",
+        default=Path("validation_report.json"),
+        type=Path,
+        help="Path to the JSON report with the problems found in each input",
+    )
+    argument_parser.add_argument(
+        "--log_format",
+        default="text",
+        choices=log_formats,
+        help="Write progress messages as plain text or as one JSON object per line",
+    )
+
+    args = argument_parser.parse_args()
+    if not args.metadata and args.manifest is None:
+        argument_parser.error("give metadata files, a --manifest, or both")
+
+    return args
+
+
+def main():
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    args = parse_arguments()
+    setup_logging(args.log_format)
+
+    jobs = []
+    paths = list(find_metadata_files(args.metadata, args.pattern))
+    if paths:
+        jobs.append((validate_metadata_file, paths))
+    if args.manifest is not None:
+        from atol_annotation_report.batch import read_manifest
+
+        jobs.append((validate_manifest_row, read_manifest(args.manifest)))
+
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=args.threads,
+        initializer=setup_logging,
+        initargs=(args.log_format,),
+    ) as pool:
+        for validate, items in jobs:
+            logger.info(f"Checking {len(items)} inputs with {args.threads} workers")
+            # thousands of small files are sent to the workers in chunks
+            chunksize = max(1, len(items) // (args.threads * 4))
+            results.extend(
+                pool.map(
+                    partial(validate, strict=args.strict), items, chunksize=chunksize
+                )
+            )
+
+    n_invalid = sum(1 for x in results if not x["valid"])
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(
+            {"n_inputs": len(results), "n_invalid": n_invalid, "inputs": results},
+            f,
+            indent=2,
+        )
+    for result in results:
+        for error in result["errors"]:
+            logger.warning(f"{result['input']}: {format_error(error)}")
+    logger.info(
+        f"Validation completed: {len(results) - n_invalid} valid, {n_invalid} invalid. "
+        f"Report written to {args.report}"
+    )
+
+    if n_invalid > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
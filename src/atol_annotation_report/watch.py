@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# watch mode (--watch): keeps the report up to date while a pipeline is
+# still writing the tool outputs, which arrive at different times.
+#
+# - the input paths are polled with stat, so it works on the network
+#   filesystems of a cluster, where file events often don't arrive. an input
+#   that doesn't exist yet is left out of the report until it appears.
+# - a change is only acted on once the inputs have stopped changing for the
+#   debounce period, so a burst of writes (or a tool writing its output in
+#   pieces) gives one rebuild.
+# - parsed blocks are kept in memory with the size and modification time of
+#   their input files (BlockMemo), so a rebuild only re-parses the blocks
+#   whose files changed and merges them with the rest.
+# - the typst compiler is created once and reused for every rebuild.
+#
+# a rebuild that fails (e.g. on a half-written file, or inputs that don't
+# pass validation) is logged and retried on the next change. the outputs are
+# written one at a time, so a failure while rendering can leave them partly
+# updated (e.g. new JSON next to the previous PDF). a parsing or validation
+# failure happens before any output is written.
+
+from argparse import Namespace
+from pathlib import Path
+import copy
+import logging
+import signal
+import time
+
+from atol_annotation_report.profiling import StageProfiler
+from atol_annotation_report.python_reporter import (
+    generate_report,
+    log_validation_errors,
+    stdin_arguments,
+)
+from atol_annotation_report.validation import ValidationError
+
+logger = logging.getLogger(__name__)
+
+watch_arguments = [*stdin_arguments, "genome_file"]
+
+
+def get_signature(path):
+    # None for a file that doesn't exist yet. directories (e.g. OMArk
+    # output) change when any file in them does
+    path = Path(path)
+    try:
+        if path.is_dir():
+            return tuple((x.name, get_signature(x)) for x in sorted(path.iterdir()))
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class BlockMemo:
+    # the cache interface of run_parser and generate_report, holding the last
+    # result of each block in memory. a disk cache, if given, is used for
+    # blocks that changed and for PDFs
+    def __init__(self, cache=None):
+        self.cache = cache
+        # kind: (signatures of the input files, result)
+        self.blocks = {}
+
+    def get_block(self, kind, input_files, parse):
+        signatures = [get_signature(x) for x in input_files]
+        entry = self.blocks.get(kind)
+        if entry is None or entry[0] != signatures:
+            if self.cache is None:
+                result = parse()
+            else:
+                result = self.cache.get_block(kind, input_files, parse)
+            entry = (signatures, result)
+            self.blocks[kind] = entry
+        else:
+            logger.info(f"Using {kind} results from the last rebuild")
+        # collect_stats merges extra results into the blocks it gets
+        return copy.deepcopy(entry[1])
+
+    def pdf_key(self, path_to_template, combined_stats):
+        if self.cache is None:
+            return None
+        return self.cache.pdf_key(path_to_template, combined_stats)
+
+    def get_pdf(self, key, output_file):
+        return key is not None and self.cache.get_pdf(key, output_file)
+
+    def put_pdf(self, key, output_file):
+        self.cache.put_pdf(key, output_file)
+
+
+def get_watched_inputs(args):
+    return {
+        x: getattr(args, x) for x in watch_arguments if getattr(args, x) is not None
+    }
+
+
+def get_state(watched_inputs):
+    return {x: get_signature(path) for x, path in watched_inputs.items()}
+
+
+def rebuild(args, state, memo, renderer, profile_path=None):
+    # the inputs that exist so far
+    present = Namespace(**vars(args))
+    for argument in watch_arguments:
+        if state.get(argument) is None:
+            setattr(present, argument, None)
+    waiting = [x for x in state if state[x] is None]
+    if waiting:
+        logger.info("Waiting for " + ", ".join(waiting))
+
+    profiler = StageProfiler()
+    start = time.perf_counter()
+    try:
+        generate_report(
+            present,
+            renderer=renderer,
+            package_path=args.package_cache,
+            cache=memo,
+            profiler=profiler,
+        )
+    except ValidationError as e:
+        log_validation_errors(e.errors, args.validation_report)
+        return
+    except Exception as e:
+        # usually a file that is still being written, which the next change
+        # fixes
+        logger.error(
+            f"Rebuild failed, the outputs may be partly updated: "
+            f"{type(e).__name__}: {e}"
+        )
+        return
+    logger.info(f"Rebuilt report in {time.perf_counter() - start:.2f} seconds")
+    if profile_path is not None:
+        profiler.write(profile_path)
+
+
+def stop_watching(signum, frame):
+    raise KeyboardInterrupt
+
+
+def watch(args, renderer=None, cache=None):
+    watched_inputs = get_watched_inputs(args)
+    memo = BlockMemo(cache)
+
+    # treat SIGTERM from a job scheduler like Ctrl-C
+    signal.signal(signal.SIGTERM, stop_watching)
+
+    logger.info(
+        f"Watching {len(watched_inputs)} inputs every {args.poll_interval} seconds"
+    )
+    built_state = None
+    state = get_state(watched_inputs)
+    changed_at = time.monotonic()
+    try:
+        while True:
+            if state != built_state and any(x is not None for x in state.values()):
+                if time.monotonic() - changed_at >= args.debounce:
+                    previous = built_state or {}
+                    changed = [x for x in state if state[x] != previous.get(x)]
+                    logger.info("Inputs changed: " + ", ".join(changed))
+                    rebuild(args, state, memo, renderer, profile_path=args.profile)
+                    built_state = state
+            time.sleep(args.poll_interval)
+            new_state = get_state(watched_inputs)
+            if new_state != state:
+                state = new_state
+                changed_at = time.monotonic()
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
@@ -2,13 +2,46 @@
 
 namespace App\Http\Controllers;
 
+use Illuminate\Http\Client\ConnectionException;
 use Illuminate\Http\Request;
+use Illuminate\Support\Facades\Http;
 use Illuminate\Support\Facades\Storage;
-use Symfony\Component\Process\Process;
-use Symfony\Component\Process\Exception\ProcessFailedException;
+use Illuminate\Support\Str;
 
 class UploadController extends Controller
 {
+    // reports are generated by the local atol-annotation-report-service.
+    // an upload is queued there and the browser polls the job status, so no
+    // PHP worker waits for the report.
+    private const OUTPUT_FILENAMES = [
+        'output_file' => 'report.pdf',
+        'json_atol' => 'json_atol.json',
+        'json_full' => 'json_full.json',
+        'html' => 'summary.html',
+        'preview_png' => 'preview.png',
+    ];
+    // previews are shown in the page rather than downloaded
+    private const PREVIEW_OUTPUTS = ['html', 'preview_png'];
+
+    private function reportService()
+    {
+        return Http::baseUrl(config('services.report_service.url'))
+            ->acceptJson()
+            ->timeout(10);
+    }
+
+    private function serviceUnavailable()
+    {
+        return response()->json(['status'=>'error','message'=>'The report service is not running'], 503);
+    }
+
+    private function storeUpload($file)
+    {
+        // keep the client's extension so the reporter can tell CSV metadata from JSON
+        $name = Str::uuid().'.'.$file->getClientOriginalExtension();
+        return Storage::path($file->storeAs('uploads', $name));
+    }
+
     public function store(Request $request)
     {
         // simple validation
@@ -20,81 +53,80 @@ public function store(Request $request)
             'species_name' => 'nullable|string',
         ]);
 
-        // Ensure uploads dir
-        $uploadDir = storage_path('app/uploads');
-        if (!is_dir($uploadDir)) {
-            @mkdir($uploadDir, 0777, true);
-        }
-
         // store files
-        $gff = $request->file('file_one')->store('uploads');
-        $meta = $request->file('file_two')->store('uploads');
-        $busco = $request->hasFile('busco_results') ? $request->file('busco_results')->store('uploads') : null;
-        $omark = $request->hasFile('omark_results') ? $request->file('omark_results')->store('uploads') : null;
-
-    // prepare paths for script
-    $script = storage_path('app/uploads/pipeline.py');
-    $gffPath = storage_path('app/'.$gff);
-    $buscoScript = storage_path('app/uploads/plot_BUSCO.py');
-    $omarkScript = storage_path('app/uploads/plot_OMArk.py');
-    $outputPdf = storage_path('app/uploads/results/output.pdf');
-
-        // ensure public results dir
-        $publicResults = public_path('results');
-        if (!is_dir($publicResults)) {
-            @mkdir($publicResults, 0777, true);
-        }
-
-        // Ensure results dir
-        $outdir = storage_path('app/uploads/results');
-        if (!is_dir($outdir)) { @mkdir($outdir, 0777, true); }
-
-        // Build process for Python pipeline
-        $cmd = [
-            'python', $script,
-            $gffPath,
-            $buscoScript,
-            $omarkScript,
-            $outputPdf
+        $inputs = [
+            'annotation_file' => $this->storeUpload($request->file('file_one')),
+            'metadata_file' => $this->storeUpload($request->file('file_two')),
         ];
-
-        $process = new Process($cmd);
-        $process->setTimeout(120);
+        if ($request->hasFile('busco_results')) {
+            $inputs['busco_file'] = $this->storeUpload($request->file('busco_results'));
+        }
+        if ($request->hasFile('omark_results')) {
+            $inputs['omark_file'] = $this->storeUpload($request->file('omark_results'));
+        }
 
         try {
-            $process->run();
-            if (! $process->isSuccessful()) {
-                throw new ProcessFailedException($process);
-            }
-
-            $stdout = trim($process->getOutput());
-            // pipeline.pl prints a JSON object on stdout in the mock
-            $json = @json_decode($stdout, true);
-            if (is_array($json) && !empty($json['status']) && $json['status'] === 'success' && !empty($json['output'])) {
-                $resultPath = $json['output'];
-                // copy result to public/results so it can be downloaded
-                $basename = basename($resultPath);
-                $publicFile = $publicResults.DIRECTORY_SEPARATOR.$basename;
-                @copy($resultPath, $publicFile);
+            $response = $this->reportService()->post('/jobs', $inputs);
+        } catch (ConnectionException $e) {
+            return $this->serviceUnavailable();
+        }
+        if (! $response->successful()) {
+            $message = $response->json('message') ?? 'The report service did not accept the job';
+            return response()->json(['status'=>'error','message'=>$message], 500);
+        }
 
-                $downloadUrl = url('results/'.$basename);
-                return response()->json(['status'=>'success','output_url'=>$downloadUrl]);
-            }
+        $jobId = $response->json('job_id');
+        return response()->json([
+            'status' => 'queued',
+            'job_id' => $jobId,
+            'status_url' => url('jobs/'.$jobId),
+        ], 202);
+    }
 
-            // fallback: return whole stdout
-            return response()->json(['status'=>'error','message'=>'Pipeline did not return success','raw'=>$stdout], 500);
+    public function status($jobId)
+    {
+        try {
+            $response = $this->reportService()->get('/jobs/'.$jobId);
+        } catch (ConnectionException $e) {
+            return $this->serviceUnavailable();
+        }
+        if (! $response->successful()) {
+            return response()->json($response->json(), $response->status());
+        }
 
-        } catch (\Exception $e) {
-            return response()->json(['status'=>'error','message'=>$e->getMessage()], 500);
+        // point the download links at this app instead of the local service
+        $job = $response->json();
+        $outputs = [];
+        foreach (array_keys($job['outputs'] ?? []) as $output) {
+            $outputs[$output] = url('jobs/'.$jobId.'/'.$output);
         }
+        $job['outputs'] = $outputs;
+        return response()->json($job);
     }
 
-    public function downloadResult($filename)
+    public function downloadResult($jobId, $output)
     {
-        $path = public_path('results/'.$filename);
-        if (!file_exists($path)) {
-            abort(404);
+        try {
+            $response = $this->reportService()
+                ->withOptions(['stream' => true])
+                ->get('/jobs/'.$jobId.'/'.$output);
+        } catch (ConnectionException $e) {
+            return $this->serviceUnavailable();
+        }
+        if (! $response->successful()) {
+            abort($response->status());
+        }
+
+        $body = $response->toPsrResponse()->getBody();
+        $stream = function () use ($body) {
+            while (! $body->eof()) {
+                echo $body->read(65536);
+            }
+        };
+        $headers = ['Content-Type' => $response->header('Content-Type')];
+        if (in_array($output, self::PREVIEW_OUTPUTS)) {
+            return response()->stream($stream, 200, $headers);
         }
-        return response()->download($path);
+        return response()->streamDownload($stream, self::OUTPUT_FILENAMES[$output], $headers);
     }
 }
@@ -28,6 +28,10 @@
         'region' => env('AWS_DEFAULT_REGION', 'us-east-1'),
     ],
 
+    'report_service' => [
+        'url' => env('REPORT_SERVICE_URL', 'http://127.0.0.1:8765'),
+    ],
+
     'slack' => [
         'notifications' => [
             'bot_user_oauth_token' => env('SLACK_BOT_USER_OAUTH_TOKEN'),
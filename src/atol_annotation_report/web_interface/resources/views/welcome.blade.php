@@ -430,6 +430,42 @@ function closeModal() {
             }
             closeBtn.addEventListener('click', closeModal);
 
+            // the previews are ready before the PDF, so show them while it renders
+            function previewHtml(outputs) {
+                if (!outputs) return '';
+                let html = '';
+                if (outputs.html) html += `<br><a href="${outputs.html}" target="_blank">View summary</a>`;
+                if (outputs.preview_png) html += `<br><img src="${outputs.preview_png}" alt="First page of the report" style="max-width: 100%; margin-top: 0.5em;">`;
+                return html;
+            }
+
+            // the report is generated in the background, so poll the job until it finishes
+            const POLL_INTERVAL_MS = 2000;
+
+            async function pollJob(statusUrl) {
+                let job;
+                try {
+                    const res = await fetch(statusUrl, { headers: { 'Accept': 'application/json' } });
+                    job = await res.json();
+                } catch (err) {
+                    openModal('error', 'Lost contact with the server while waiting for the report.');
+                    return;
+                }
+
+                if (job.status === 'queued' || job.status === 'running') {
+                    openModal('running', job.status === 'queued'
+                        ? 'Your report is queued. Please wait while it is generated.'
+                        : 'Generating your report…' + previewHtml(job.outputs));
+                    setTimeout(() => pollJob(statusUrl), POLL_INTERVAL_MS);
+                } else if (job.status === 'success' && job.outputs && job.outputs.output_file) {
+                    openModal('success', `Completed successfully. <br><a href="${job.outputs.output_file}" download>Download report</a>`
+                        + (job.outputs.json_full ? ` | <a href="${job.outputs.json_full}" download>Download JSON</a>` : '')
+                        + previewHtml(job.outputs));
+                } else {
+                    openModal('error', job.error || job.message || 'The report could not be generated.');
+                }
+            }
+
             form.addEventListener('submit', async (e) => {
                 e.preventDefault();
 
@@ -480,8 +516,9 @@ function closeModal() {
                         return;
                     }
 
-                    if (body && body.status === 'success' && body.output_url) {
-                        openModal('success', `Completed successfully. <br><a href="${body.output_url}" download>Download results</a>`);
+                    if (body && body.status === 'queued' && body.status_url) {
+                        openModal('running', 'Your report is queued. Please wait while it is generated.');
+                        pollJob(body.status_url);
                         return;
                     }
 
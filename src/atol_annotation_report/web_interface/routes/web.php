@@ -9,4 +9,7 @@
 use App\Http\Controllers\UploadController;
 
 Route::post('/upload', [UploadController::class, 'store']);
-Route::get('/results/{filename}', [UploadController::class, 'downloadResult']);
+Route::get('/jobs/{jobId}', [UploadController::class, 'status'])->whereAlphaNumeric('jobId');
+Route::get('/jobs/{jobId}/{output}', [UploadController::class, 'downloadResult'])
+    ->whereAlphaNumeric('jobId')
+    ->whereIn('output', ['output_file', 'json_atol', 'json_full', 'html', 'preview_png']);